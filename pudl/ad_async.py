@@ -0,0 +1,237 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ad_async - an asyncio front end for pudl, requires python 3.5 or newer"""
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import itertools
+import logging
+
+from pudl.ad_computer import ADComputer
+from pudl.ad_group import ADGroup
+from pudl.ad_query import ADQueryPool, SEARCH_SCOPE
+from pudl.ad_user import ADUser
+
+# The number of blocking LDAP operations that may run at once
+CONCURRENCY = 8
+
+
+class AsyncADQuery(object):
+    """Query Active Directory from asyncio code without blocking the event loop.
+    python-ldap calls are run on a bounded pool of worker threads, so at most
+    *concurrency* operations are in progress at a time.
+
+    Pass an ADQueryPool with at least *concurrency* connections for operations
+    to truly run in parallel.  A single ADQuery connection handles one call at a
+    time, so with an ADQuery every call, and every step of an asynchronous
+    iterator, runs on a single worker thread whatever the concurrency.
+
+    Methods returning a single value return awaitables, while the iter_* methods
+    return asynchronous iterators for use with *async for*::
+
+        aq = AsyncADQuery(ADQueryPool(user, password, size=16), concurrency=16)
+        users = await aq.users(base_dn, samaccountnames=['bhodges'])
+        async for user in aq.iter_users(base_dn):
+            ...
+    """
+
+    def __init__(self, adq, concurrency=CONCURRENCY, loop=None):
+        """The AsyncADQuery constructor
+
+        :param adq: The ADQuery or ADQueryPool instance to query with
+        :param int concurrency: The maximum number of LDAP operations run at once,
+            defaults to *{0}*, always 1 unless adq is an ADQueryPool
+        :param loop: The asyncio event loop, defaults to the running loop
+        """.format(CONCURRENCY)
+        self.logger = logging.getLogger(__name__)
+
+        self.adq = adq
+        if not isinstance(adq, ADQueryPool):
+            concurrency = 1
+        self.concurrency = concurrency
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.loop = loop
+
+
+    def search(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE, limit=0):
+        """Perform an AD search, see ADQuery.search()
+
+        :return: An awaitable list of search results, each a (DN, attributes) tuple
+        :rtype: asyncio.Future
+        """
+        return self.run(self.adq.search, base_dn, search_filter, attributes, scope, limit=limit)
+
+
+    def iter_search(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE, limit=0):
+        """Perform an AD search, see ADQuery.iter_search()
+
+        :return: An asynchronous iterator of search results
+        :rtype: AsyncResults
+        """
+        return AsyncResults(self, self.adq.iter_search(base_dn, search_filter, attributes, scope,
+                                                       limit=limit))
+
+
+    def users(self, base_dn, **kwargs):
+        """Gather a list of ADUser objects, accepts the same arguments as ADUser.users()
+
+        :return: An awaitable list of populated ADUser objects
+        :rtype: asyncio.Future
+        """
+        return self.run(ADUser(self.adq).users, base_dn, **kwargs)
+
+
+    def iter_users(self, base_dn, **kwargs):
+        """Generate ADUser objects, accepts the same arguments as ADUser.iter_users()
+
+        :return: An asynchronous iterator of populated ADUser objects
+        :rtype: AsyncResults
+        """
+        return AsyncResults(self, ADUser(self.adq).iter_users(base_dn, **kwargs))
+
+
+    def groups(self, base_dn, **kwargs):
+        """Gather a list of ADGroup objects, accepts the same arguments as ADGroup.groups()
+
+        :return: An awaitable list of populated ADGroup objects
+        :rtype: asyncio.Future
+        """
+        return self.run(ADGroup(self.adq).groups, base_dn, **kwargs)
+
+
+    def iter_groups(self, base_dn, **kwargs):
+        """Generate ADGroup objects, accepts the same arguments as ADGroup.iter_groups()
+
+        :return: An asynchronous iterator of populated ADGroup objects
+        :rtype: AsyncResults
+        """
+        return AsyncResults(self, ADGroup(self.adq).iter_groups(base_dn, **kwargs))
+
+
+    def computers(self, base_dn, **kwargs):
+        """Gather a list of ADComputer objects, accepts the same arguments as
+        ADComputer.computers()
+
+        :return: An awaitable list of populated ADComputer objects
+        :rtype: asyncio.Future
+        """
+        return self.run(ADComputer(self.adq).computers, base_dn, **kwargs)
+
+
+    def iter_computers(self, base_dn, **kwargs):
+        """Generate ADComputer objects, accepts the same arguments as
+        ADComputer.iter_computers()
+
+        :return: An asynchronous iterator of populated ADComputer objects
+        :rtype: AsyncResults
+        """
+        return AsyncResults(self, ADComputer(self.adq).iter_computers(base_dn, **kwargs))
+
+
+    def run(self, func, *args, **kwargs):
+        """Run any blocking callable on the worker threads
+
+        :param callable func: The callable to run, with any further arguments
+
+        :return: An awaitable for the value returned by func
+        :rtype: asyncio.Future
+        """
+        loop = self.loop or asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+
+    def close(self):
+        """Shut down the worker threads once any pending operations complete"""
+        self.executor.shutdown(wait=False)
+
+
+class AsyncResults(object):
+    """An asynchronous iterator over a blocking generator, such as ADUser.iter_users().
+    Items are pulled from the generator on a worker thread, up to a page of
+    results at a time.
+    """
+
+    def __init__(self, aq, iterable):
+        """The AsyncResults constructor
+
+        :param AsyncADQuery aq: The AsyncADQuery whose worker threads are used
+        :param iterable iterable: The blocking iterable or generator
+        """
+        self.aq = aq
+        self.iterable = iterable
+        self.chunk_size = getattr(aq.adq, 'page_size', 1)
+        self._buffer = collections.deque()
+        self._exhausted = False
+
+
+    def __aiter__(self):
+        return self
+
+
+    def __anext__(self):
+        loop = self.aq.loop or asyncio.get_event_loop()
+        future = loop.create_future()
+        if self._buffer:
+            future.set_result(self._buffer.popleft())
+        elif self._exhausted:
+            future.set_exception(StopAsyncIteration())  #pylint: disable=undefined-variable
+        else:
+            self.aq.run(self._fill).add_done_callback(functools.partial(self._filled, future))
+
+        return future
+
+
+    def close(self):
+        """Close the underlying generator, abandoning any search in progress
+
+        :return: An awaitable that completes once the generator is closed
+        :rtype: asyncio.Future
+        """
+        self._exhausted = True
+        self._buffer.clear()
+        return self.aq.run(getattr(self.iterable, 'close', lambda: None))
+
+
+    def _fill(self):
+        """Pull the next chunk of items from the blocking iterable, on a worker thread
+
+        :return: A list of items, empty once the iterable is exhausted
+        :rtype: list
+        """
+        return list(itertools.islice(self.iterable, self.chunk_size))
+
+
+    def _filled(self, future, fill):
+        """Complete an __anext__ future from the results of _fill()
+
+        :param asyncio.Future future: The future returned by __anext__
+        :param asyncio.Future fill: The completed _fill() future
+        """
+        if future.cancelled():
+            return
+        if fill.cancelled():
+            future.cancel()
+            return
+        if fill.exception() is not None:
+            future.set_exception(fill.exception())
+            return
+
+        self._buffer.extend(fill.result())
+        if self._buffer:
+            future.set_result(self._buffer.popleft())
+        else:
+            self._exhausted = True
+            future.set_exception(StopAsyncIteration())  #pylint: disable=undefined-variable
@@ -17,6 +17,9 @@ import logging
 
 from pudl.ad_object import ADObject
 
+# Matches computer objects, {0} is replaced with any further clauses
+COMPUTER_FILTER = '(&(objectClass=computer){0})'
+
 class ADComputer(ADObject):
     """A class to represent AD computer objects.  Includes a number of
     helper methods, particularly object-factory related.
@@ -26,6 +29,10 @@ class ADComputer(ADObject):
     on the results returned by the LDAP query.
     """
 
+    __slots__ = ()
+
+    object_class = 'computer'
+
 
     def computer(self, base_dn, samaccountname, attributes=()):
         """Produces a single, populated ADComputer object through the object factory.
@@ -39,7 +46,8 @@ class ADComputer(ADObject):
         :rtype: ADComputer
         """
 
-        computers = self.computers(base_dn, samaccountnames=[samaccountname], attributes=attributes)
+        computers = self.computers(base_dn, samaccountnames=[samaccountname], attributes=attributes,
+                                   limit=1)
 
         try:
             # Usually we will find a match, but perhaps not always
@@ -48,42 +56,59 @@ class ADComputer(ADObject):
             logging.info("%s - unable to retrieve object from AD by sAMAccountName", samaccountname)
 
 
-    def computers(self, base_dn, samaccountnames=(), attributes=()):
+    def computers(self, base_dn, samaccountnames=(), attributes=(), extra_filter='', lazy=False,
+                  limit=0):
         """Gathers a list of ADComputer objects
 
         :param str base_dn: The base DN to search within
         :param list samaccountnames: A list of computer names for which objects will be
             created, defaults to all computers if unspecified
         :param list attributes: Object attributes to populate, defaults to all
+        :param str extra_filter: Further LDAP filter clauses objects must match, ANDed
+            into the search filter, such as *(department=Eng*)*, see where_filter()
+        :param bool lazy: If set True, computers are lazy objects created with only
+            LAZY_ATTRIBUTES and any attributes specified.  Other attributes are
+            read for all of the computers the first time any of them is read, see LazyLoader
+        :param int limit: The maximum number of computers to return, defaults to 0 for all,
+            the search is abandoned once enough have arrived
 
         :return: A list of populated ADComputer objects
         :rtype: list
         """
-        ad_computers = []
-
-        search_filter = '(&(objectClass=computer){0})'
-        # If no samaccountnames specified, filter will pull all computer objects under
-        # base_dn
-        if not samaccountnames:
-            search_filter = search_filter.format('(sAMAccountName=*)')
-        else:
-            if len(samaccountnames) == 1:
-                computer_names = '(sAMAccountName={0})'.format(samaccountnames[0])
-            else:
-                computer_names = '(|{0})'.format(''.join(['(sAMAccountName={0})'.\
-                                                          format(computer) for computer
-                                                          in samaccountnames]))
-
-            search_filter = search_filter.format(computer_names)
-
-
-        logging.debug('%s Search filter: %s', self.__class__.__name__, search_filter)
+        return list(self.iter_computers(base_dn, samaccountnames=samaccountnames,
+                                        attributes=attributes, extra_filter=extra_filter,
+                                        lazy=lazy, limit=limit))
 
-        results = self.adq.search(base_dn, search_filter, attributes)
 
-        for search_result in results:
-            adc = self._object_factory(search_result)
-            ad_computers.append(adc)
-
-        return ad_computers
+    def iter_computers(self, base_dn, samaccountnames=(), attributes=(), extra_filter='',
+                       lazy=False, limit=0):
+        """Generates ADComputer objects as each page of search results arrives,
+        rather than gathering every computer before returning
 
+        :param str base_dn: The base DN to search within
+        :param list samaccountnames: A list of computer names for which objects will be
+            created, defaults to all computers if unspecified
+        :param list attributes: Object attributes to populate, defaults to all
+        :param str extra_filter: Further LDAP filter clauses objects must match, ANDed
+            into the search filter, such as *(department=Eng*)*, see where_filter()
+        :param bool lazy: If set True, computers are lazy objects created with only
+            LAZY_ATTRIBUTES and any attributes specified.  Other attributes are
+            read for all computers generated so far and still in use the first time
+            any of them is read, see LazyLoader
+        :param int limit: The maximum number of computers to return, defaults to 0 for all,
+            the search is abandoned once enough have arrived
+
+        :return: A generator of populated ADComputer objects
+        :rtype: generator
+        """
+        search_filter = COMPUTER_FILTER
+        table = self._intern_table()
+        layout = self._record_layout()
+        loader = None
+        if lazy:
+            loader, attributes = self._lazy_loader(attributes)
+
+        for data in self._iter_search_pages(base_dn, search_filter, samaccountnames,
+                                            attributes, extra_filter, limit):
+            for adc in self._objects_factory(data, loader, table, layout):
+                yield adc
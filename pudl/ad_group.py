@@ -15,7 +15,10 @@
 
 import logging
 
-from pudl.ad_object import ADObject
+from pudl.ad_object import ADObject, intern_values, is_loaded
+
+# Matches group objects, {0} is replaced with any further clauses
+GROUP_FILTER = '(&(objectClass=group)(!(objectClass=user))(!(objectClass=computer)){0})'
 
 class ADGroup(ADObject):
     """A class to represent AD group objects.  Includes a number of
@@ -30,6 +33,10 @@ class ADGroup(ADObject):
 
     """
 
+    __slots__ = ()
+
+    object_class = 'group'
+
 
     def group(self, base_dn, samaccountname, attributes=(), explicit_membership_only=False):
         """Produces a single, populated ADGroup object through the object factory.
@@ -48,7 +55,7 @@ class ADGroup(ADObject):
         """
 
         groups = self.groups(base_dn, samaccountnames=[samaccountname], attributes=attributes,
-                             explicit_membership_only=explicit_membership_only)
+                             explicit_membership_only=explicit_membership_only, limit=1)
 
         try:
             # Usually we will find a match, but perhaps not always
@@ -57,7 +64,8 @@ class ADGroup(ADObject):
             logging.info("%s - unable to retrieve object from AD by sAMAccountName", samaccountname)
 
 
-    def groups(self, base_dn, samaccountnames=(), attributes=(), explicit_membership_only=False):
+    def groups(self, base_dn, samaccountnames=(), attributes=(), explicit_membership_only=False,
+               extra_filter='', lazy=False, limit=0):
         """Gathers a list of ADGroup objects
 
         sAMAccountName may not be present in group objects in modern AD schemas.
@@ -68,40 +76,79 @@ class ADGroup(ADObject):
         :param list samaccountnames: A list of group names for which objects will be
             created, defaults to all groups if unspecified
         :param list attributes: Object attributes to populate, defaults to all
+        :param str extra_filter: Further LDAP filter clauses objects must match, ANDed
+            into the search filter, such as *(department=Eng*)*, see where_filter()
+        :param bool lazy: If set True, groups are lazy objects created with only
+            LAZY_ATTRIBUTES and any attributes specified.  Other attributes are
+            read for all of the groups the first time any of them is read, see LazyLoader
+        :param int limit: The maximum number of groups to return, defaults to 0 for all,
+            the search is abandoned once enough have arrived
 
         :return: A list of populated ADGroup objects
         :rtype: list
         """
-        ad_groups = []
-
-        search_filter = '(&(objectClass=group)(!(objectClass=user))(!(objectClass=computer)){0})'
-        # If no samaccountnames specified, filter will pull all group objects under
-        # base_dn
-        if not samaccountnames:
-            search_filter = search_filter.format('(sAMAccountName=*)')
-        else:
-            if len(samaccountnames) == 1:
-                group_names = '(sAMAccountName={0})'.format(samaccountnames[0])
-            else:
-                group_names = '(|{0})'.format(''.join(['(sAMAccountName={0})'.\
-                                                       format(group) for group
-                                                       in samaccountnames]))
-
-            search_filter = search_filter.format(group_names)
-
-
-        logging.debug('%s Search filter: %s', self.__class__.__name__, search_filter)
+        return list(self.iter_groups(base_dn, samaccountnames=samaccountnames,
+                                     attributes=attributes,
+                                     explicit_membership_only=explicit_membership_only,
+                                     extra_filter=extra_filter, lazy=lazy, limit=limit))
 
-        results = self.adq.search(base_dn, search_filter, attributes)
 
-        for search_result in results:
-            adg = self._object_factory(search_result)
-            if not explicit_membership_only and 'member' in dir(adg):
-                member = [u[0] for u in
-                          self.adq.search(base_dn, '(memberOf:1.2.840.113556.1.4.1941:={0})'.\
-                          format(search_result[0]), attributes=['member'])]
-                adg.member = member
-            ad_groups.append(adg)
+    def iter_groups(self, base_dn, samaccountnames=(), attributes=(),
+                    explicit_membership_only=False, extra_filter='', lazy=False, limit=0):
+        """Generates ADGroup objects as each page of search results arrives,
+        rather than gathering every group before returning
 
-        return ad_groups
+        :param str base_dn: The base DN to search within
+        :param list samaccountnames: A list of group names for which objects will be
+            created, defaults to all groups if unspecified
+        :param list attributes: Object attributes to populate, defaults to all
+        :param str extra_filter: Further LDAP filter clauses objects must match, ANDed
+            into the search filter, such as *(department=Eng*)*, see where_filter()
+        :param bool lazy: If set True, groups are lazy objects created with only
+            LAZY_ATTRIBUTES and any attributes specified.  Other attributes are
+            read for all groups generated so far and still in use the first time
+            any of them is read, see LazyLoader
+        :param int limit: The maximum number of groups to return, defaults to 0 for all,
+            the search is abandoned once enough have arrived
+
+        :return: A generator of populated ADGroup objects
+        :rtype: generator
+        """
+        search_filter = GROUP_FILTER
+        table = self._intern_table()
+        layout = self._record_layout()
+
+        def expand(name, groups):
+            """Expand nested members when member is loaded lazily"""
+            if name == 'member' and not explicit_membership_only:
+                self._expand_member(base_dn, groups, table)
+
+        loader = None
+        if lazy:
+            loader, attributes = self._lazy_loader(attributes, expand)
+
+        for data in self._iter_search_pages(base_dn, search_filter, samaccountnames,
+                                            attributes, extra_filter, limit):
+            ad_groups = self._objects_factory(data, loader, table, layout)
+            if not explicit_membership_only:
+                self._expand_member(base_dn, [(adg, search_result[0]) for adg, search_result
+                                              in zip(ad_groups, data)
+                                              if is_loaded(adg, 'member')], table)
+            for adg in ad_groups:
+                yield adg
+
+
+    def _expand_member(self, base_dn, groups, table=None):
+        """Replace the member values of groups with their nested members.  The
+        searches for every group are in flight together.
 
+        :param str base_dn: The base DN to search within
+        :param list groups: (ADGroup, DN) tuples
+        :param dict table: If provided, the member DNs are interned in this table
+        """
+        expand = {distinguished_name: adg for adg, distinguished_name in groups}
+        # Only the DN of each nested member is kept, 1.1 requests no attributes
+        searches = [(dn, base_dn, '(memberOf:1.2.840.113556.1.4.1941:={0})'.format(dn),
+                     ['1.1']) for dn in expand]
+        for distinguished_name, results in self.adq.multi_search(searches):
+            expand[distinguished_name].member = intern_values(table, [u[0] for u in results])
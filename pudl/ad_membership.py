@@ -0,0 +1,388 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ad_membership - strategies for expanding nested group membership"""
+
+import logging
+import ldap
+
+from pudl.helper import attribute_values
+
+# The available strategies for expanding nested membership, and the default
+MEMBERSHIP_STRATEGIES = ('chain', 'tokengroups', 'graph')
+MEMBERSHIP_STRATEGY = 'chain'
+
+# Pull every object with direct members when building a group graph
+GRAPH_FILTER = '(member=*)'
+
+# The number of SIDs to resolve with a single search filter
+SID_CHUNK_SIZE = 200
+
+
+def membership_resolver(strategy, adq, base_dn):
+    """Create a resolver for the specified nested membership strategy
+
+    :param str strategy: One of *chain*, *tokengroups* or *graph*
+    :param ADQuery adq: The ADQuery instance used for any searches
+    :param str base_dn: The base DN to search within, only groups located
+        beneath it are included in resolved memberships
+
+    :return: A resolver with memberof(distinguished_name) and
+        memberships(distinguished_names) methods
+    :rtype: ChainResolver, TokenGroupsResolver or GraphResolver
+    """
+    if strategy == 'chain':
+        return ChainResolver(adq, base_dn)
+    elif strategy == 'tokengroups':
+        return TokenGroupsResolver(adq, base_dn)
+    elif strategy == 'graph':
+        return GraphResolver(adq, base_dn)
+    else:
+        raise ValueError('Unknown membership strategy: {0}, expected one of {1}'.\
+                         format(strategy, ', '.join(MEMBERSHIP_STRATEGIES)))
+
+
+def naming_context(base_dn):
+    """Derive the domain naming context (the trailing DC= components) of a DN
+
+    :param str base_dn: A distinguished name, such as
+        *OU=Departments,DC=example,DC=com*
+
+    :return: The naming context, such as *DC=example,DC=com*
+    :rtype: str
+    """
+    components = base_dn.split(',')
+    index = len(components)
+    while index > 0 and components[index - 1].strip().lower().startswith('dc='):
+        index -= 1
+
+    return ','.join(components[index:]) or base_dn
+
+
+class ChainResolver(object):
+    """Resolve nested membership on the server, one
+    LDAP_MATCHING_RULE_IN_CHAIN search per object
+    """
+
+    def __init__(self, adq, base_dn):
+        """ChainResolver constructor
+
+        :param ADQuery adq: The ADQuery instance used for searches
+        :param str base_dn: The base DN to search within
+        """
+        self.adq = adq
+        self.base_dn = base_dn
+
+
+    def memberof(self, distinguished_name):
+        """Determine every group an object is a member of, directly or through nesting
+
+        :param str distinguished_name: The DN of the member object
+
+        :return: A list of group DistinguishedNames
+        :rtype: list
+        """
+        return [g[0] for g in self.adq.search(self.base_dn,
+                                              '(member:1.2.840.113556.1.4.1941:={0})'.\
+                                              format(distinguished_name),
+                                              attributes=['memberof'])]
+
+
+    def memberships(self, distinguished_names):
+        """Determine nested membership for many objects, with all of the searches
+        in flight at once on the same connection
+
+        :param list distinguished_names: The DNs of the member objects
+
+        :return: Key/value pairs mapping each DN to a list of group DNs
+        :rtype: dict
+        """
+        searches = [(dn, self.base_dn, '(member:1.2.840.113556.1.4.1941:={0})'.format(dn),
+                     ['memberof']) for dn in distinguished_names]
+
+        return {dn: [g[0] for g in results] for dn, results in self.adq.multi_search(searches)}
+
+
+class TokenGroupsResolver(object):
+    """Resolve nested membership from the constructed tokenGroups attribute,
+    with a single base scope read per object.  The group SIDs returned are mapped
+    to DNs through a cache, with any unknown SIDs looked up in bulk, so
+    each distinct group is only searched for once.
+
+    tokenGroups is computed from security groups alone and includes the
+    primary group (typically Domain Users), so results may differ from the
+    chain and graph strategies where distribution groups or primary groups
+    are involved.  As with the other strategies, only groups beneath base_dn are
+    listed.
+    """
+
+    def __init__(self, adq, base_dn):
+        """TokenGroupsResolver constructor
+
+        :param ADQuery adq: The ADQuery instance used for searches
+        :param str base_dn: The base DN to search within
+        """
+        self.adq = adq
+        self.base_dn = base_dn
+        # Binary SID to DN, or None for SIDs that could not be resolved
+        self.sids = {}
+
+
+    def memberof(self, distinguished_name):
+        """Determine every group an object is a member of, directly or through nesting
+
+        :param str distinguished_name: The DN of the member object
+
+        :return: A list of group DistinguishedNames
+        :rtype: list
+        """
+        #pylint: disable=no-member
+        results = self.adq.search(distinguished_name, '(objectClass=*)',
+                                  attributes=['tokenGroups'], scope=ldap.SCOPE_BASE)
+        #pylint: enable=no-member
+        sids = []
+        for search_result in results:
+            sids += attribute_values(search_result[1], 'tokengroups')
+
+        self.resolve([sid for sid in sids if sid not in self.sids])
+
+        return [self.sids[sid] for sid in sids if self.sids[sid] is not None]
+
+
+    def memberships(self, distinguished_names):
+        """Determine nested membership for many objects.  The tokenGroups reads are
+        all in flight at once on the same connection, and unknown SIDs across every
+        object are then resolved together.
+
+        :param list distinguished_names: The DNs of the member objects
+
+        :return: Key/value pairs mapping each DN to a list of group DNs
+        :rtype: dict
+        """
+        searches = [(dn, dn, '(objectClass=*)', ['tokenGroups']) for dn in distinguished_names]
+        token_groups = {}
+        #pylint: disable=no-member
+        for dn, results in self.adq.multi_search(searches, scope=ldap.SCOPE_BASE):
+        #pylint: enable=no-member
+            token_groups[dn] = []
+            for search_result in results:
+                token_groups[dn] += attribute_values(search_result[1], 'tokengroups')
+
+        self.resolve([sid for sids in token_groups.values() for sid in sids
+                      if sid not in self.sids])
+
+        return {dn: [self.sids[sid] for sid in sids if self.sids[sid] is not None]
+                for dn, sids in token_groups.items()}
+
+
+    def resolve(self, sids):
+        """Look up the DNs for a list of SIDs, adding them to the cache
+
+        :param list sids: Binary SIDs to resolve
+        """
+        sids = list(set(sids))
+        for index in range(0, len(sids), SID_CHUNK_SIZE):
+            chunk = sids[index:index + SID_CHUNK_SIZE]
+            search_filter = '(|{0})'.format(''.join(['(objectSid={0})'.format(escape_binary(sid))
+                                                     for sid in chunk]))
+            for search_result in self.adq.iter_search(self.base_dn, search_filter,
+                                                      attributes=['objectSid']):
+                for sid in attribute_values(search_result[1], 'objectsid'):
+                    self.sids[sid] = search_result[0]
+
+            # Remember SIDs outside of base_dn as well, to avoid searching for them again
+            for sid in chunk:
+                self.sids.setdefault(sid, None)
+
+        logging.debug('%s - %s SIDs cached', self.__class__.__name__, len(self.sids))
+
+
+class GraphResolver(object):
+    """Resolve nested membership locally.  Every group's direct member list
+    is pulled in a single paged scan of the domain, the first time membership
+    is requested, and nesting is then walked in memory.  Results match those of
+    the chain strategy: only groups located beneath base_dn are listed.
+    """
+
+    def __init__(self, adq, base_dn):
+        """GraphResolver constructor
+
+        :param ADQuery adq: The ADQuery instance used to scan groups
+        :param str base_dn: The base DN to search within
+        """
+        self.adq = adq
+        self.base_dn = base_dn
+        self.graph = None
+        self._suffix = ',' + base_dn.lower()
+
+
+    def memberof(self, distinguished_name):
+        """Determine every group an object is a member of, directly or through nesting
+
+        :param str distinguished_name: The DN of the member object
+
+        :return: A list of group DistinguishedNames
+        :rtype: list
+        """
+        if self.graph is None:
+            self.graph = GroupGraph()
+            self.graph.load(self.adq, naming_context(self.base_dn))
+
+        return [dn for dn in self.graph.memberof(distinguished_name)
+                if dn.lower().endswith(self._suffix) or dn.lower() == self._suffix[1:]]
+
+
+    def memberships(self, distinguished_names):
+        """Determine nested membership for many objects
+
+        :param list distinguished_names: The DNs of the member objects
+
+        :return: Key/value pairs mapping each DN to a list of group DNs
+        :rtype: dict
+        """
+        return {dn: self.memberof(dn) for dn in distinguished_names}
+
+
+class GroupGraph(object):
+    """A graph of direct group membership, keyed by lowercase DN, from which
+    nested membership may be computed.  Membership cycles are tolerated.
+    """
+
+    def __init__(self):
+        """GroupGraph constructor"""
+        # Lowercase group DN to the DN as returned by the server
+        self.groups = {}
+        # Lowercase group DN to the position the group was added in, so results
+        # are returned in a stable order
+        self.order = {}
+        # Lowercase member DN to a list of lowercase DNs of groups it directly belongs to
+        self.parents = {}
+        # Lowercase group DN to a list of its direct member DNs
+        self.children = {}
+        # Memoized transitive closures, lowercase group DN to a set of lowercase group DNs
+        self._closures = {}
+
+
+    def load(self, adq, base_dn):
+        """Populate the graph with every object that has direct members
+
+        :param ADQuery adq: The ADQuery instance used to search
+        :param str base_dn: The base DN to search within
+        """
+        logging.debug('%s - loading group membership graph beneath %s',
+                      self.__class__.__name__, base_dn)
+        for search_result in adq.iter_search(base_dn, GRAPH_FILTER, attributes=['member']):
+            self.add_group(search_result[0], attribute_values(search_result[1], 'member'))
+
+        logging.debug('%s - loaded %s groups', self.__class__.__name__, len(self.groups))
+
+
+    def add_group(self, distinguished_name, members):
+        """Add a group and its direct members to the graph
+
+        :param str distinguished_name: The group's DN
+        :param list members: DNs of the group's direct members
+        """
+        group = distinguished_name.lower()
+        if group not in self.groups:
+            self.order[group] = len(self.order)
+        self.groups[group] = distinguished_name
+        self.children[group] = list(members)
+        for member in members:
+            self.parents.setdefault(member.lower(), []).append(group)
+
+        self._closures = {}
+
+
+    def memberof(self, distinguished_name, nested=True):
+        """Compute the nested group membership of any object in the graph
+
+        :param str distinguished_name: The DN of the member object
+        :param bool nested: If set False, only groups the object is a direct
+            member of are listed
+
+        :return: A list of group DNs the object belongs to, directly or
+            through nesting
+        :rtype: list
+        """
+        closure = set()
+        for group in self.parents.get(distinguished_name.lower(), ()):
+            if group not in closure:
+                closure.add(group)
+                if nested:
+                    closure.update(self._closure(group))
+
+        return [self.groups[group] for group in sorted(closure, key=self.order.get)]
+
+
+    def members(self, distinguished_name):
+        """Compute the nested members of a group in the graph
+
+        :param str distinguished_name: The group's DN
+
+        :return: A list of the DNs of every object that is a member of the group,
+            directly or through nesting
+        :rtype: list
+        """
+        members = []
+        seen = set()
+        pending = [distinguished_name.lower()]
+        while pending:
+            for member in self.children.get(pending.pop(0), ()):
+                if member.lower() not in seen:
+                    seen.add(member.lower())
+                    members.append(member)
+                    if member.lower() in self.children:
+                        pending.append(member.lower())
+
+        return members
+
+
+    def _closure(self, group):
+        """Every group that a group is nested beneath, walking parents breadth first.
+        Visited groups are tracked, so cycles terminate.
+
+        :param str group: A lowercase group DN
+
+        :return: A set of lowercase group DNs
+        :rtype: set
+        """
+        try:
+            return self._closures[group]
+        except KeyError:
+            pass
+
+        closure = set()
+        pending = [group]
+        while pending:
+            for parent in self.parents.get(pending.pop(), ()):
+                if parent not in closure:
+                    closure.add(parent)
+                    if parent in self._closures:
+                        closure.update(self._closures[parent])
+                    else:
+                        pending.append(parent)
+
+        self._closures[group] = closure
+        return closure
+
+
+def escape_binary(value):
+    """Escape every byte of a binary value for use in a search filter
+
+    :param str value: A binary value, such as an objectSid
+
+    :return: The value escaped, such as *\\01\\05\\00...*
+    :rtype: str
+    """
+    return ''.join(['\\{0:02x}'.format(byte) for byte in bytearray(value)])
@@ -0,0 +1,341 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ad_notify - an in-process cache of AD objects kept current by change notifications"""
+
+import logging
+import threading
+
+import ldap
+
+from pudl.ad_computer import ADComputer, COMPUTER_FILTER
+from pudl.ad_group import ADGroup, GROUP_FILTER
+from pudl.ad_membership import naming_context
+from pudl.ad_query import ADQuery
+from pudl.ad_user import ADUser, USER_FILTER
+from pudl.helper import attribute_values, is_beneath
+
+# Seconds to wait before subscribing again after the connection fails
+RETRY_INTERVAL = 30
+
+# Attributes always requested, to identify, classify and order changes to objects
+REQUIRED_ATTRIBUTES = ('objectGUID', 'objectClass', 'sAMAccountName', 'uSNChanged')
+
+
+class ADChangeCache(object):
+    """An in-process cache of the ADUser, ADGroup and ADComputer objects beneath a
+    base DN.  All objects are loaded once, then a background thread applies AD
+    change notifications as they arrive, so lookups are answered from memory
+    and stay consistent with the directory to within seconds.
+
+    Notifications are subscribed to for the whole naming context of the base
+    DN, as AD only reports deletions and moves out of the base DN there, and
+    changes to objects outside the base DN are ignored.
+
+    Cached groups' member values are kept current.  Cached users' memberof
+    values are not, as memberOf is a back-link: adding a user to a group
+    changes the group, and no notification is sent for the user.  Membership
+    should be read from the groups.
+
+    The listener holds its own connection for as long as the cache runs, as a
+    subscribed connection may not be used for anything else.
+    """
+
+    def __init__(self, adq, base_dn, attributes=(), listener_adq=None,
+                 retry_interval=RETRY_INTERVAL):
+        """ADChangeCache constructor
+
+        :param ADQuery adq: The ADQuery instance used to load objects, and passed
+            to the objects created
+        :param str base_dn: The base DN to watch
+        :param list attributes: Object attributes to populate, defaults to all
+        :param ADQuery listener_adq: A separate ADQuery instance dedicated to
+            receiving notifications.  If not specified, a connection is opened
+            with the credentials of adq, which must then be an ADQuery
+        :param int retry_interval: Seconds to wait before subscribing again if the
+            listener connection fails, defaults to *{0}*
+        """.format(RETRY_INTERVAL)
+        self.logger = logging.getLogger(__name__)
+
+        self.adq = adq
+        if listener_adq is adq:
+            raise ValueError('The listener needs a connection of its own')
+        # Whether the listener connection was opened here, and so is closed by stop()
+        self._own_listener = listener_adq is None
+        self._listener_closed = False
+        if listener_adq is None:
+            if not isinstance(adq, ADQuery):
+                raise ValueError('A listener_adq is required unless adq is an ADQuery')
+            listener_adq = ADQuery(adq.user, adq.password, ldap_url=adq.ldap_url,
+                                   tls_no_verify=adq.tls_no_verify)
+        self.listener_adq = listener_adq
+        self.base_dn = base_dn
+        self.attributes = list(attributes)
+        if self.attributes:
+            self.attributes += [a for a in REQUIRED_ATTRIBUTES
+                                if a.lower() not in [b.lower() for b in self.attributes]]
+        self.retry_interval = retry_interval
+
+        # Object type to the finder used to load and create objects, and its search filter
+        self._finders = {'user': (ADUser(adq), USER_FILTER),
+                         'group': (ADGroup(adq), GROUP_FILTER),
+                         'computer': (ADComputer(adq), COMPUTER_FILTER)}
+        # Object type to the intern table and record layout objects are created with,
+        # kept for as long as the cache, so every change does not need a record class
+        #pylint: disable=protected-access
+        self._layouts = {object_type: (finder._intern_table(), finder._record_layout())
+                         for object_type, (finder, _) in self._finders.items()}
+        #pylint: enable=protected-access
+        # objectGUID to a tuple of object type, uSNChanged, lowercase sAMAccountNames and object
+        self._objects = {}
+        # Object type and lowercase sAMAccountName to objectGUID
+        self._names = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        """Subscribe to change notifications, load all objects and begin applying
+        changes in a background thread.  Notifications are subscribed to first, so
+        changes made while loading are not missed.
+        """
+        self._stop.clear()
+        if self._listener_closed:
+            self.listener_adq.reconnect()
+            self._listener_closed = False
+        subscribed = threading.Event()
+        self._thread = threading.Thread(target=self._listen, args=(subscribed,),
+                                        name='pudl-notify')
+        self._thread.daemon = True
+        self._thread.start()
+        subscribed.wait()
+        self.load()
+
+
+    def stop(self):
+        """Stop applying changes, abandoning the notification subscription.  A
+        listener connection opened by the cache is closed.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._own_listener and not self._listener_closed:
+            self.listener_adq.close()
+            self._listener_closed = True
+
+
+    def load(self):
+        """Load every user, group and computer beneath the base DN into the cache"""
+        for object_type, (finder, search_filter) in self._finders.items():
+            count = 0
+            #pylint: disable=protected-access
+            for data in finder._iter_search_pages(self.base_dn, search_filter, (),
+                                                  self.attributes):
+            #pylint: enable=protected-access
+                for search_result in data:
+                    self.apply(search_result, object_type)
+                    count += 1
+            logging.debug('%s - loaded %s %s objects', self.__class__.__name__, count,
+                          object_type)
+
+
+    def apply(self, search_result, object_type=None):
+        """Apply a search result or change notification to the cache.  Results
+        older than the cached object, by uSNChanged, are ignored.
+
+        :param tuple search_result: A (DN, attributes) tuple
+        :param str object_type: One of *user*, *group* or *computer*, determined from
+            objectClass if not specified
+        """
+        distinguished_name, values = search_result
+        guids = attribute_values(values, 'objectguid')
+        if not guids:
+            return
+        guid = guids[0]
+        usns = attribute_values(values, 'usnchanged')
+        usn = int(usns[0]) if usns else 0
+        if object_type is None:
+            object_type = _object_type(attribute_values(values, 'objectclass'))
+
+        departed = [value for value in attribute_values(values, 'isdeleted')
+                    if value.upper() == 'TRUE'] or \
+                   not is_beneath(distinguished_name, self.base_dn) or object_type is None
+
+        with self._lock:
+            cached = self._objects.get(guid)
+            if cached is not None and cached[1] > usn:
+                return
+            if cached is not None:
+                self._remove(guid)
+            if not departed:
+                table, layout = self._layouts[object_type]
+                #pylint: disable=protected-access
+                ado = self._finders[object_type][0]._object_factory(search_result, table,
+                                                                    layout)
+                #pylint: enable=protected-access
+                names = [name.lower() for name in attribute_values(values, 'samaccountname')]
+                self._objects[guid] = (object_type, usn, names, ado)
+                for name in names:
+                    self._names[(object_type, name)] = guid
+
+
+    def user(self, samaccountname):
+        """Retrieve a cached ADUser
+
+        :param str samaccountname: The user's sAMAccountName
+
+        :return: The ADUser, or None if not found
+        :rtype: ADUser
+        """
+        return self._lookup('user', samaccountname)
+
+
+    def group(self, samaccountname):
+        """Retrieve a cached ADGroup
+
+        :param str samaccountname: The group's sAMAccountName
+
+        :return: The ADGroup, or None if not found
+        :rtype: ADGroup
+        """
+        return self._lookup('group', samaccountname)
+
+
+    def computer(self, samaccountname):
+        """Retrieve a cached ADComputer
+
+        :param str samaccountname: The computer's sAMAccountName
+
+        :return: The ADComputer, or None if not found
+        :rtype: ADComputer
+        """
+        return self._lookup('computer', samaccountname)
+
+
+    def users(self):
+        """All cached ADUser objects
+
+        :return: A list of ADUser objects
+        :rtype: list
+        """
+        return self._all('user')
+
+
+    def groups(self):
+        """All cached ADGroup objects
+
+        :return: A list of ADGroup objects
+        :rtype: list
+        """
+        return self._all('group')
+
+
+    def computers(self):
+        """All cached ADComputer objects
+
+        :return: A list of ADComputer objects
+        :rtype: list
+        """
+        return self._all('computer')
+
+
+    def _lookup(self, object_type, samaccountname):
+        """Retrieve a cached object by type and sAMAccountName"""
+        with self._lock:
+            guid = self._names.get((object_type, samaccountname.lower()))
+            if guid is None:
+                return None
+            return self._objects[guid][3]
+
+
+    def _all(self, object_type):
+        """Retrieve all cached objects of a type"""
+        with self._lock:
+            return [cached[3] for cached in self._objects.values() if cached[0] == object_type]
+
+
+    def _remove(self, guid):
+        """Remove an object and its name from the cache, the lock must be held"""
+        object_type, _, names, _ = self._objects.pop(guid)
+        for name in names:
+            if self._names.get((object_type, name)) == guid:
+                del self._names[(object_type, name)]
+
+
+    def _listen(self, subscribed):
+        """Apply change notifications until stopped, subscribing again after any
+        connection failure.  After a failure, all objects are loaded again, as
+        changes may have been missed.
+
+        :param threading.Event subscribed: Set once the first subscription is made
+        """
+        reload_objects = False
+        while not self._stop.is_set():
+            # Deletions and moves out of base_dn are only reported for the naming context
+            notifications = self.listener_adq.iter_notifications(naming_context(self.base_dn),
+                                                                 self.attributes)
+            try:
+                # The first poll sends the subscription request
+                notification = next(notifications)
+                subscribed.set()
+                if reload_objects:
+                    self.load()
+                    reload_objects = False
+                while not self._stop.is_set():
+                    if notification is not None:
+                        logging.debug('%s - change notification for %s',
+                                      self.__class__.__name__, notification[0])
+                        self.apply(notification)
+                    notification = next(notifications)
+            except StopIteration:
+                reload_objects = True
+            #pylint: disable=no-member
+            except ldap.LDAPError as err:
+            #pylint: enable=no-member
+                logging.error('%s - change notifications failed, retrying in %s seconds: %s',
+                              self.__class__.__name__, self.retry_interval, err)
+                subscribed.set()
+                reload_objects = True
+                if self._stop.wait(self.retry_interval):
+                    break
+                try:
+                    self.listener_adq.reconnect()
+                #pylint: disable=no-member
+                except ldap.LDAPError:
+                #pylint: enable=no-member
+                    continue
+            finally:
+                notifications.close()
+
+
+def _object_type(object_classes):
+    """Classify an object as a user, group or computer by its objectClass values,
+    as the object factories' search filters do
+
+    :param list object_classes: The objectClass values
+
+    :return: One of *user*, *group* or *computer*, or None
+    :rtype: str
+    """
+    object_classes = [object_class.lower() for object_class in object_classes]
+    if 'computer' in object_classes:
+        return 'computer'
+    elif 'group' in object_classes:
+        return 'group'
+    elif 'user' in object_classes:
+        return 'user'
+
+    return None
+
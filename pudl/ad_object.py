@@ -13,20 +13,122 @@
 # limitations under the License.
 """ad_object"""
 
-import copy
-import importlib
 import logging
+import weakref
+
+import ldap
+import ldap.filter
+
+from pudl.ad_schema import DN_SYNTAX
+from pudl.cache import TTLCache
+from pudl.helper import guid_string, parse_where, sid_string
+
+# Server URL, base DN and DistinguishedName (all lowercase) to sAMAccountName mappings,
+# shared by all instances.  DNs not found beneath the base DN map to None
+SAMACCOUNTNAME_CACHE = TTLCache()
+
+# The number of DistinguishedNames to look up with a single search filter
+DN_CHUNK_SIZE = 200
+
+# The number of sAMAccountNames to look up with a single search filter
+SAMACCOUNTNAME_CHUNK_SIZE = 500
+
+# The number of record classes kept for reuse, the least recently used are discarded
+RECORD_CLASSES_SIZE = 1000
+
+# Record classes, keyed by object class and tuple of lowercase attribute names
+_RECORD_CLASSES = TTLCache(maxsize=RECORD_CLASSES_SIZE)
+
+# The number of distinct sets of attribute names a query keeps the record class and
+# plans of, beyond which they are worked out again
+LAYOUT_SIZE = 1000
+
+# Binary attributes converted to their string forms when read, lowercase names
+# to the function that converts each value
+DECODED_ATTRIBUTES = {'objectsid': sid_string, 'sidhistory': sid_string,
+                      'tokengroups': sid_string, 'objectguid': guid_string}
+
+# The attributes lazy objects are created with, any others are loaded on first use
+LAZY_ATTRIBUTES = ('distinguishedName', 'sAMAccountName', 'cn', 'objectClass')
+
+# Lazy subclasses, keyed by object class
+_LAZY_CLASSES = {}
+
+# Attributes whose values repeat across many objects.  Within a query, equal values
+# of these attributes share a single string, see intern_values().  With a schema,
+# every attribute holding DNs is interned as well
+INTERN_ATTRIBUTES = ('objectclass', 'objectcategory', 'memberof', 'member', 'manager',
+                     'directreports', 'department', 'company', 'division', 'title',
+                     'physicaldeliveryofficename', 'l', 'st', 'co', 'c', 'countrycode',
+                     'useraccountcontrol', 'primarygroupid', 'samaccounttype', 'instancetype')
+
+# The number of distinct values an intern table holds, beyond which it is emptied
+# and starts over, so streaming a large directory does not keep every value seen
+INTERN_TABLE_SIZE = 100000
+
+# Marks a deleted attribute value, or a value not found in a cache
+_MISSING = object()
 
 
 class ADObject(object):
-    """A base class for AD objects."""
+    """A base class for AD objects.
+
+    Objects are compact records: attribute values are held in a single list,
+    and a generated subclass has class-level descriptors that map names to
+    positions in that list.  Within a query, each attribute name is given one
+    position, so objects holding different sets of attributes share a few
+    subclasses, and positions an object has no value for are left empty, see
+    _RecordLayout.  Assigning an attribute the record does not have moves the
+    object to the subclass for the extended set of names.
+
+    Attributes with a single value are held as a plain value and others as a
+    list, unless the ADQuery has an ADSchema, in which case multi-valued
+    attributes are always lists.
+
+    Binary SIDs and GUIDs, see DECODED_ATTRIBUTES, are held as returned by the
+    server, and converted to their string forms each time they are read or
+    serialized, rather than as every object is created.
+
+    When the attributes to populate are not specified, the attributes the
+    ADQuery excludes, such as large photos and certificates, are left out
+    if the ADQuery has an ADSchema to list the remaining attributes with.
+    """
+
+    __slots__ = ('adq', '_values')
+
+    # Setup logging, assumes a root logger already exists with handlers
+    logger = logging.getLogger(__name__)
+
+    # Lists of sAMAccountNames are split into search filters of at most this many names
+    samaccountname_chunk_size = SAMACCOUNTNAME_CHUNK_SIZE
+
+    # Whether repeated values are shared within each query, see INTERN_ATTRIBUTES
+    intern_values = True
+
+    # The object class searched for, used to list the attributes it may hold
+    object_class = None
+
+    # The lowercase attribute names held, in the order of the values list
+    _fields = ()
+
+    # The lowercase names and decoding functions of any DECODED_ATTRIBUTES held
+    _decoders = ()
 
     def __init__(self, adq):
         """ADObject constructor"""
-        # Setup logging, assumes a root logger already exists with handlers
-        self.logger = logging.getLogger(__name__)
-
         self.adq = adq
+        self._values = []
+
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            # Not an attribute of this record yet, move to a record class that has it
+            record_class = _record_class(getattr(type(self), '_record_base', type(self)),
+                                         self._fields + (name,))
+            self._values.append(value)
+            object.__setattr__(self, '__class__', record_class)
 
 
     def to_dict(self):
@@ -34,16 +136,13 @@ class ADObject(object):
         the current instance.
 
         """
-        o_copy = copy.copy(self)
-        # Remove some stuff that is not likely related to AD attributes
-        for attribute in dir(self):
-            if attribute == 'logger' or attribute == 'adq':
-                try:
-                    delattr(o_copy, attribute)
-                except AttributeError:
-                    pass
+        ad_dict = {name: value for name, value in zip(self._fields, self._values)
+                   if value is not _MISSING}
+        for name, decode in self._decoders:
+            if name in ad_dict:
+                ad_dict[name] = decode(ad_dict[name])
 
-        return o_copy.__dict__
+        return ad_dict
 
 
     def samaccountname(self, base_dn, distinguished_name):
@@ -67,7 +166,11 @@ class ADObject(object):
 
 
     def samaccountnames(self, base_dn, distinguished_names):
-        """Retrieve the sAMAccountNames for the specified DNs
+        """Retrieve the sAMAccountNames for the specified DNs.  Mappings are cached
+        across all instances, for each server and base DN, and DNs not yet cached
+        are looked up in chunks of up to DN_CHUNK_SIZE, with the chunks searched
+        concurrently.  DNs that are not found are cached too, and left out of the
+        mappings returned.
 
         :param str base_dn: The base DN to search within
         :param list distinguished_name: A list of distinguished names for which to
@@ -76,61 +179,734 @@ class ADObject(object):
         :return: Key/value pairs mapping DistinguishedName to sAMAccountName
         :rtype: dict
         """
-        attributes = ['sAMAccountName']
-        search_filter = '(|{0})'.format(''.join(['(DistinguishedName={0})'.format(dn)
-                                                 for dn in distinguished_names]))
-        logging.debug('%s Search filter: %s', self.__class__.__name__, search_filter)
+        mappings = {}
+        scope = ((getattr(self.adq, 'ldap_url', None) or '').lower(), base_dn.lower())
+        # Lowercase DN to the DN as provided, for any DNs not yet cached
+        missing = {}
+        for distinguished_name in distinguished_names:
+            samaccountname = SAMACCOUNTNAME_CACHE.get(scope + (distinguished_name.lower(),),
+                                                      _MISSING)
+            if samaccountname is _MISSING:
+                missing[distinguished_name.lower()] = distinguished_name
+            elif samaccountname is not None:
+                mappings[distinguished_name] = samaccountname
+
+        logging.debug('%s - %s of %s DNs found in the sAMAccountName cache',
+                      self.__class__.__name__, len(mappings), len(distinguished_names))
 
-        results = self.adq.search(base_dn, search_filter, attributes)
+        lookups = list(missing.values())
+        searches = []
+        for index in range(0, len(lookups), DN_CHUNK_SIZE):
+            chunk = lookups[index:index + DN_CHUNK_SIZE]
+            search_filter = '(|{0})'.format(''.join(['(DistinguishedName={0})'.\
+                                                     format(ldap.filter.escape_filter_chars(dn))
+                                                     for dn in chunk]))
+            logging.debug('%s Search filter: %s', self.__class__.__name__, search_filter)
+            searches.append((index, base_dn, search_filter, ['sAMAccountName']))
 
-        mappings = {result[0]: result[1]['sAMAccountName'][0] for result in results}
+        for _, results in self.adq.multi_search(searches):
+            for result in results:
+                for key, values in result[1].items():
+                    if key.lower() == 'samaccountname':
+                        SAMACCOUNTNAME_CACHE.set(scope + (result[0].lower(),), values[0])
+                        # Return the DN as the caller provided it
+                        mappings[missing.pop(result[0].lower(), result[0])] = values[0]
+
+        # Not found beneath the base DN, so not searched for again
+        for lowercase_dn in missing:
+            SAMACCOUNTNAME_CACHE.set(scope + (lowercase_dn,), None)
 
         return mappings
 
 
-    def _object_factory(self, search_result):
+    def iter_entries(self, base_dn, search_filter, samaccountnames=(), attributes=(),
+                     extra_filter='', limit=0):
+        """Generate raw search results for objects by sAMAccountName, without
+        creating objects.  Pass each result's attributes to flatten() for the
+        values an object would hold.
+
+        :param str base_dn: The base DN to search within
+        :param str search_filter: A filter with a {0} placeholder for the sAMAccountName
+            clause, such as USER_FILTER
+        :param list samaccountnames: sAMAccountNames to find, or all objects if empty
+        :param list attributes: Object attributes to populate, defaults to all
+        :param str extra_filter: Further LDAP filter clauses objects must match, ANDed
+            into the search filter, such as *(department=Eng*)*, see where_filter()
+        :param int limit: The maximum number of results, defaults to 0 for all
+
+        :return: A generator of (DN, attributes) tuples, as returned by ADQuery searches
+        :rtype: generator
+        """
+        for data in self._iter_search_pages(base_dn, search_filter, samaccountnames,
+                                            attributes, extra_filter, limit):
+            for search_result in data:
+                yield search_result
+
+
+    def _search_filters(self, search_filter, samaccountnames, extra_filter=''):
+        """Plan the search filters needed to find objects by sAMAccountName.  Long
+        lists of names are split into chunks, to keep each filter to a size the
+        server handles well.
+
+        :param str search_filter: A filter with a {0} placeholder for the sAMAccountName
+            clause, such as *(&(objectClass=user){0})*
+        :param list samaccountnames: sAMAccountNames to find, or all objects if empty
+        :param str extra_filter: Further filter clauses objects must match
+
+        :return: A list of search filters
+        :rtype: list
+        """
+        # If no samaccountnames specified, filter will pull all objects under base_dn
+        if not samaccountnames:
+            return [search_filter.format('(sAMAccountName=*)' + extra_filter)]
+
+        search_filters = []
+        for index in range(0, len(samaccountnames), self.samaccountname_chunk_size):
+            chunk = samaccountnames[index:index + self.samaccountname_chunk_size]
+            # Extensible filter: http://bit.ly/1Qh4eyV
+            if len(chunk) == 1:
+                account_names = '(sAMAccountName={0})'.format(chunk[0])
+            else:
+                account_names = '(|{0})'.format(''.join(['(sAMAccountName={0})'.format(name)
+                                                         for name in chunk]))
+            search_filters.append(search_filter.format(account_names + extra_filter))
+
+        return search_filters
+
+
+    def _iter_search_pages(self, base_dn, search_filter, samaccountnames, attributes,
+                           extra_filter='', limit=0):
+        """Search for objects by sAMAccountName, yielding lists of search results.
+        When the names span several search filters, the searches run concurrently
+        and results are yielded per filter, with any duplicates dropped.  Searches
+        are abandoned once limit results have been yielded.
+
+        :param str base_dn: The base DN to search within
+        :param str search_filter: A filter with a {0} placeholder for the sAMAccountName
+            clause
+        :param list samaccountnames: sAMAccountNames to find, or all objects if empty
+        :param list attributes: Object attributes to populate, defaults to all
+        :param str extra_filter: Further filter clauses objects must match
+        :param int limit: The maximum number of results, defaults to 0 for all
+
+        :return: A generator of lists of search results
+        :rtype: generator
+        """
+        search_filters = self._search_filters(search_filter, samaccountnames, extra_filter)
+        attributes = attributes or self._default_attributes()
+        for planned_filter in search_filters:
+            logging.debug('%s Search filter: %s', self.__class__.__name__, planned_filter)
+
+        if len(search_filters) == 1:
+            for data in self.adq.iter_pages(base_dn, search_filters[0], attributes,
+                                            limit=limit):
+                yield data
+        else:
+            # Wildcards in the names may match the same object from several filters
+            seen = set()
+            searches = [(index, base_dn, planned_filter, attributes)
+                        for index, planned_filter in enumerate(search_filters)]
+            multi_search = self.adq.multi_search(searches)
+            for _, results in multi_search:
+                data = []
+                for search_result in results:
+                    if search_result[0].lower() not in seen:
+                        seen.add(search_result[0].lower())
+                        data.append(search_result)
+                if limit and len(seen) >= limit:
+                    # Closing the generator abandons the searches still in flight
+                    multi_search.close()
+                    yield data[:len(data) - (len(seen) - limit)]
+                    break
+                yield data
+
+
+    def _default_attributes(self):
+        """The attributes to request when none are specified: every attribute the
+        object class may hold, less those the ADQuery excludes.  LDAP has no way
+        to request all attributes but a few, so this needs the ADQuery's schema.
+
+        :return: A list of attribute names, or an empty list for all attributes
+        :rtype: list
+        """
+        schema = getattr(self.adq, 'schema', None)
+        exclude = getattr(self.adq, 'exclude_attributes', ())
+        if schema is None or not exclude or self.object_class is None:
+            return []
+
+        excluded = set(name.lower() for name in exclude)
+        return [name for name in schema.class_attributes(self.object_class)
+                if name.lower() not in excluded]
+
+
+    def _object_factory(self, search_result, table=None, layout=None):
         """Given a single search result, create and return an object
 
         :param tuple search_result: a single search result returned by an LDAP query,
             position 0 is the DN and position 1 is a dictionary of key/value pairs
+        :param dict table: If provided, values of INTERN_ATTRIBUTES are interned in
+            this table, see _objects_factory()
+        :param _RecordLayout layout: The record layout to create the object with,
+            see _record_layout().  Callers creating many objects one at a time
+            should keep one, so the objects share record classes
 
         :return: A single AD object instance
         :rtype: Object (ADUser, ADGroup, etc.)
 
         """
-        class_name = self.__class__.__name__
-        module = self.__module__
-        logging.debug('Creating object of type %s for DN: %s', class_name, search_result[0])
-        module = importlib.import_module('{0}'.format(module))
-        class_ = getattr(module, class_name)
-        ado = class_(self.adq)
-
-        # A unique set of all attribute names found
-        attribute_names = set()
-        # A unique set
-        multiples = set()
-        for k in search_result[1].keys():
-            if k not in attribute_names:
-                attribute_names.add(k)
-            else:
-                multiples.add(k)
-        for k, val in search_result[1].iteritems():
-            if k in multiples and not hasattr(ado, k):
-                setattr(ado, k.lower(), list())
-            if hasattr(ado, k):
-                value = getattr(ado, k)
-                if len(val) == 1:
-                    value.append(val[0])
-                else:
-                    value.append(val)
+        return self._objects_factory([search_result], table=table, layout=layout)[0]
+
+
+    def _objects_factory(self, data, loader=None, table=None, layout=None):
+        """Given a page of search results, create and return objects.  The object
+        class is resolved once, and results sharing a set of attribute names
+        share the lowercase names, record class and schema lookups computed for
+        the first, see _RecordLayout.
+
+        :param list data: search results returned by an LDAP query, each a tuple
+            of the DN and a dictionary of key/value pairs
+        :param LazyLoader loader: If provided, lazy objects are created and added
+            to the loader's result set
+        :param dict table: If provided, values of INTERN_ATTRIBUTES are interned in
+            this table, which should be shared by every page of a query, see
+            intern_values()
+        :param _RecordLayout layout: The record layout of the query, see
+            _record_layout(), which should be shared by every page of a query.
+            Defaults to a layout for this page only
+
+        :return: A list of AD object instances
+        :rtype: list
+
+        """
+        class_ = getattr(type(self), '_record_base', type(self))
+        if loader is not None:
+            class_ = _lazy_class(class_)
+        logging.debug('Creating %s objects of type %s', len(data), class_.__name__)
+
+        new = object.__new__
+        set_adq = ADObject.adq.__set__  #pylint: disable=no-member
+        set_values = ADObject._values.__set__  #pylint: disable=no-member,protected-access
+        adq = self.adq
+        if layout is None:
+            layout = self._record_layout()
+        plans = layout.plans
+        intern = None
+        if table is not None:
+            if len(table) >= INTERN_TABLE_SIZE:
+                table.clear()
+            intern = table.setdefault
+        objects = []
+        for _, attributes in data:
+            keys = tuple(attributes)
+            try:
+                record_class, plan, interned, positions = plans[(class_, keys)]
+            except KeyError:
+                record_class, plan, interned, positions = layout.plan(class_, keys)
+            ado = new(record_class)
+            set_adq(ado, adq)
+            values = list(attributes.values())
+            if intern is not None:
+                for index in interned:
+                    values[index] = [intern(value, value) for value in values[index]]
+            if plan is None:
+                values = [val[0] if len(val) == 1 else val for val in values]
             else:
-                if len(val) == 1:
-                    setattr(ado, k.lower(), val[0])
-                else:
-                    setattr(ado, k.lower(), val)
+                # _typed_values(), inlined as it runs for every object
+                for index in plan[0]:
+                    values[index] = values[index][0]
+                for index in plan[1]:
+                    if len(values[index]) == 1:
+                        values[index] = values[index][0]
+            if positions is not None:
+                # Not in the order of the record's fields, or some are missing
+                #pylint: disable=protected-access
+                record = [_MISSING] * len(record_class._fields)
+                #pylint: enable=protected-access
+                for index, value in zip(positions, values):
+                    record[index] = value
+                values = record
+            set_values(ado, values)
+            objects.append(ado)
+
+        if loader is not None:
+            loader.add(objects, [search_result[0] for search_result in data])
+
+        return objects
+
+
+    def _record_layout(self):
+        """Create the record layout a query's objects are created with, see
+        _RecordLayout
+
+        :return: An empty layout
+        :rtype: _RecordLayout
+        """
+        return _RecordLayout(getattr(self.adq, 'schema', None))
+
+
+    def _intern_table(self):
+        """Create the table a query interns repeated values in, see intern_values()
+
+        :return: An empty dictionary, or None if values are not interned
+        :rtype: dict
+        """
+        return {} if self.intern_values else None
+
+
+    def _lazy_loader(self, attributes, expand=None):
+        """Prepare to create lazy objects, see LazyLoader
+
+        :param list attributes: The attributes the caller asked to populate
+        :param callable expand: Called with the attribute name and a list of
+            (object, DN) tuples after an attribute is loaded, see LazyLoader
+
+        :return: The loader, and the attributes to search for
+        :rtype: tuple
+        """
+        requested = set(name.lower() for name in attributes)
+        attributes = list(attributes) + [name for name in LAZY_ATTRIBUTES
+                                         if name.lower() not in requested]
+
+        return LazyLoader(self.adq, expand), attributes
+
+
+class _RecordLayout(object):
+    """The record classes and plans for typing and interning values that a query's
+    objects are created with, for each distinct set of attribute names returned
+    by the server.  Layouts are kept for the duration of a single query, so
+    nothing is held on to once its objects are gone, and hold at most
+    LAYOUT_SIZE sets of names.
+
+    Each attribute name is given a position the first time the query sees it,
+    and every record class of the query holds the names in that order, up to
+    the last name its objects hold.  The number of record classes is then
+    bounded by the number of attribute names, however much the sets of names
+    held vary from object to object.
+    """
+
+    __slots__ = ('schema', 'plans', 'fields', 'positions')
+
+    def __init__(self, schema=None):
+        """_RecordLayout constructor
+
+        :param ADSchema schema: If provided, values are typed by the attribute
+            definitions, see ADSchema
+        """
+        self.schema = schema
+        # Object class and tuple of attribute names as returned by the server, to a
+        # tuple of the record class, typing plan, positions of values to intern and
+        # positions of values in the record
+        self.plans = {}
+        # Lowercase attribute names, in the order they were first seen
+        self.fields = ()
+        # Lowercase attribute name to its position in fields
+        self.positions = {}
+
+
+    def plan(self, class_, keys):
+        """Work out, and keep, the record class and plans for a set of attribute names
+
+        :param type class_: The object class, such as ADUser
+        :param tuple keys: Attribute names, as returned by the server
+
+        :return: A tuple of the record class, the typing plan, see _typing_plan(),
+            or None without a schema, the positions of values to intern, and the
+            position in the record of each value, or None if the values are
+            already in the order of the record's fields
+        :rtype: tuple
+        """
+        if len(self.plans) >= LAYOUT_SIZE:
+            self.plans.clear()
+        schema = self.schema
+        names = tuple([key.lower() for key in keys])
+        for name in names:
+            if name not in self.positions:
+                self.positions[name] = len(self.fields)
+                self.fields += (name,)
+        positions = tuple([self.positions[name] for name in names])
+        record_class = _record_class(class_, self.fields[:max(positions) + 1] if positions else ())
+        if positions == tuple(range(len(positions))):
+            positions = None
+        plan = _typing_plan(schema.single_valued(keys)) if schema is not None else None
+        self.plans[(class_, keys)] = (record_class, plan, _intern_plan(names, schema), positions)
+
+        return self.plans[(class_, keys)]
+
+
+class LazyLoader(object):
+    """Loads attributes missing from the lazy objects of a result set.  The first
+    time an attribute that a lazy object does not hold is read, the attribute is
+    read for every object in the result set that does not hold it yet, with
+    base scope reads that are all in flight together.  Objects without a value
+    for the attribute in AD then raise AttributeError as usual.
+
+    Objects are added a page at a time, and the attributes loaded are tracked per
+    page, so pages added later load an attribute again when it is read.  The
+    loader only holds weak references to objects, so objects that are no longer
+    in use, such as those already handled by a consumer of iter_users(), are
+    released.
+    """
+
+    def __init__(self, adq, expand=None):
+        """LazyLoader constructor
+
+        :param ADQuery adq: The ADQuery instance used to read attributes
+        :param callable expand: Called with the lowercase attribute name and a list of
+            (object, DN) tuples after an attribute is loaded, so that derived
+            values such as nested membership can be filled in
+        """
+        self.adq = adq
+        self.expand = expand
+        # A tuple per page of objects added: a list of (weak reference to an object,
+        # DN) tuples, and a set of the lowercase names of the attributes loaded for it
+        self.pages = []
+        # Lowercase names of the attributes being loaded, which are not loaded
+        # again if read while their searches are in flight
+        self.loading = set()
+
+
+    def add(self, objects, distinguished_names):
+        """Add lazy objects to the result set
+
+        :param list objects: Lazy objects, created by ADObject._objects_factory()
+        :param list distinguished_names: The DN of each object
+        """
+        for ado in objects:
+            # Bypasses ADObject.__setattr__, the slot always exists
+            object.__setattr__(ado, '_loader', self)
+        # Forget pages whose objects have all been released
+        self.pages = [page for page in self.pages
+                      if any(reference() is not None for reference, _ in page[0])]
+        self.pages.append(([(weakref.ref(ado), dn)
+                            for ado, dn in zip(objects, distinguished_names)], set()))
+
+
+    def load(self, name):
+        """Read an attribute for every object in the result set that does not hold it.
+        Each attribute is only loaded once for each page of objects, it is loaded
+        again the next time it is read if any of the searches fail.
+
+        :param str name: The lowercase attribute name
+        """
+        if name in self.loading:
+            return
+        schema = getattr(self.adq, 'schema', None)
+        if schema is not None and schema.definition(name) is None:
+            return
+        pages = [page for page in self.pages if name not in page[1]]
+        if not pages:
+            return
+
+        pending = []
+        for references, _ in pages:
+            for reference, distinguished_name in references:
+                ado = reference()
+                if ado is not None and not is_loaded(ado, name):
+                    pending.append((ado, distinguished_name))
+
+        self.loading.add(name)
+        try:
+            loaded = self._load(name, schema, pending)
+        finally:
+            self.loading.discard(name)
+        for _, names in pages:
+            names.add(name)
+
+        if self.expand is not None and loaded:
+            self.expand(name, loaded)
+
+
+    def _load(self, name, schema, pending):
+        """Read an attribute for a list of objects
+
+        :param str name: The lowercase attribute name
+        :param ADSchema schema: The schema values are typed by, or None
+        :param list pending: (object, DN) tuples of the objects to read it for
+
+        :return: A list of (object, DN) tuples for the objects that have a value
+        :rtype: list
+        """
+        logging.debug('%s - loading %s for %s objects', self.__class__.__name__, name,
+                      len(pending))
+        searches = [(index, dn, '(objectClass=*)', [name]) for index, (_, dn) in enumerate(pending)]
+        loaded = []
+        #pylint: disable=no-member
+        for index, results in self.adq.multi_search(searches, scope=ldap.SCOPE_BASE):
+        #pylint: enable=no-member
+            for _, attributes in results[:1]:
+                for key, value in _flat_values(attributes, schema).items():
+                    setattr(pending[index][0], key, value)
+                if attributes:
+                    loaded.append(pending[index])
+
+        return loaded
+
+
+def intern_values(table, values):
+    """Replace each of a list of values with an equal value already in a table,
+    adding those that are not, so that equal values share a single string.  Once
+    the table holds INTERN_TABLE_SIZE values it is emptied, so memory use is
+    bounded however many objects a query generates.
+
+    :param dict table: The intern table, or None to leave the values as they are
+    :param list values: The values
+
+    :return: A list of the interned values
+    :rtype: list
+    """
+    if table is None:
+        return values
+    if len(table) >= INTERN_TABLE_SIZE:
+        table.clear()
+    intern = table.setdefault
+
+    return [intern(value, value) for value in values]
+
+
+def is_loaded(ado, name):
+    """Whether an object holds an attribute, without loading it when the object
+    is lazy
+
+    :param ADObject ado: The object
+    :param str name: The lowercase attribute name
+
+    :return: True if the attribute is held
+    :rtype: bool
+    """
+    try:
+        object.__getattribute__(ado, name)
+    except AttributeError:
+        return False
+
+    return True
+
+
+def flatten(attributes, schema=None):
+    """Flatten a search result's attributes the way AD objects hold them, with
+    lowercase names, single values unwrapped from their lists and binary SIDs
+    and GUIDs converted to strings
+
+    :param dict attributes: The attributes of a single search result
+    :param ADSchema schema: If provided, only single-valued attributes are unwrapped
+
+    :return: Key/value pairs of attribute names and values
+    :rtype: dict
+    """
+    flat = _flat_values(attributes, schema)
+    for name, decode in DECODED_ATTRIBUTES.items():
+        if name in flat:
+            flat[name] = decode(flat[name])
+
+    return flat
+
+
+def _flat_values(attributes, schema):
+    """Flatten attributes as flatten() does, without converting binary values
+
+    :param dict attributes: The attributes of a single search result
+    :param ADSchema schema: If provided, only single-valued attributes are unwrapped
+
+    :return: Key/value pairs of attribute names and values
+    :rtype: dict
+    """
+    if schema is None:
+        return {key.lower(): value[0] if len(value) == 1 else value
+                for key, value in attributes.items()}
+
+    keys = tuple(attributes)
+    return dict(zip([key.lower() for key in keys],
+                    _typed_values(_typing_plan(schema.single_valued(keys)),
+                                  attributes.values())))
+
+
+def _typing_plan(single_valued):
+    """Plan which values of a set of attributes to unwrap from their lists
+
+    :param tuple single_valued: True, False or None for each attribute, see
+        ADSchema.single_valued()
+
+    :return: A tuple of the positions of single-valued attributes, and of
+        attributes the schema does not define
+    :rtype: tuple
+    """
+    return (tuple([index for index, flag in enumerate(single_valued) if flag]),
+            tuple([index for index, flag in enumerate(single_valued) if flag is None]))
+
+
+def _intern_plan(fields, schema):
+    """Plan which values of a set of attributes to intern, see INTERN_ATTRIBUTES
+
+    :param tuple fields: Lowercase attribute names
+    :param ADSchema schema: If provided, attributes holding DNs are included
+
+    :return: The positions of attributes to intern
+    :rtype: tuple
+    """
+    positions = []
+    for index, name in enumerate(fields):
+        definition = schema.definition(name) if schema is not None else None
+        # Every object has its own distinguishedName, nothing would be shared
+        if name in INTERN_ATTRIBUTES or \
+           (definition and definition[2] == DN_SYNTAX and name != 'distinguishedname'):
+            positions.append(index)
+
+    return tuple(positions)
+
+
+def _typed_values(plan, values):
+    """Unwrap the values of single-valued attributes from their lists, keeping
+    multi-valued attributes as lists.  Attributes the schema does not define
+    are unwrapped when they hold a single value.  Only the positions to unwrap
+    are visited, as multi-valued attributes are kept as they are.
+
+    :param tuple plan: The typing plan for the attributes, see _typing_plan()
+    :param iterable values: The lists of values of each attribute
+
+    :return: A list of values
+    :rtype: list
+    """
+    values = list(values)
+    for index in plan[0]:
+        values[index] = values[index][0]
+    for index in plan[1]:
+        if len(values[index]) == 1:
+            values[index] = values[index][0]
+
+    return values
+
+
+def where_filter(expressions):
+    r"""Translate attribute comparisons into LDAP filter clauses, for the
+    extra_filter argument of the finders.  Values are escaped, except for *
+    wildcards with = and !=.
+
+    :param list expressions: Comparisons as accepted by parse_where(), such as
+        *department=Eng** or *title!=\*manager\**
+
+    :return: The LDAP filter clauses, such as *(department=Eng*)(!(title=*manager*))*
+    :rtype: str
+    """
+    clauses = []
+    for expression in expressions:
+        name, operator, value = parse_where(expression)
+        if operator in ('=', '!='):
+            value = '*'.join([ldap.filter.escape_filter_chars(part) for part in value.split('*')])
+            clause = '({0}={1})'.format(name, value)
+            clauses.append(clause if operator == '=' else '(!{0})'.format(clause))
+        else:
+            clauses.append('({0}{1}{2})'.format(name, operator,
+                                                ldap.filter.escape_filter_chars(value)))
+
+    return ''.join(clauses)
+
+
+class _Field(object):
+    """A descriptor for one attribute of a record class, stored at a fixed
+    position in the instance's values list
+    """
+
+    __slots__ = ('name', 'index')
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance._values[self.index]  #pylint: disable=protected-access
+        if value is _MISSING:
+            raise AttributeError(self.name)
+        return value
+
+
+    def __set__(self, instance, value):
+        instance._values[self.index] = value  #pylint: disable=protected-access
+
+
+    def __delete__(self, instance):
+        #pylint: disable=protected-access
+        if instance._values[self.index] is _MISSING:
+            raise AttributeError(self.name)
+        instance._values[self.index] = _MISSING
+
+
+class _DecodedField(_Field):
+    """A descriptor for a binary attribute, see DECODED_ATTRIBUTES, holding the
+    value as returned by the server and converting it each time it is read
+    """
+
+    __slots__ = ('decode',)
+
+    def __init__(self, name, index, decode):
+        super(_DecodedField, self).__init__(name, index)
+        self.decode = decode
+
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return self.decode(super(_DecodedField, self).__get__(instance, owner))
+
+
+def _lazy_getattr(self, name):
+    """Load an attribute a lazy object does not hold, see LazyLoader"""
+    if name.startswith('_') or name != name.lower():
+        raise AttributeError(name)
+    self._loader.load(name)  #pylint: disable=protected-access
+
+    return object.__getattribute__(self, name)
+
+
+def _lazy_class(base):
+    """Retrieve, or create, the lazy subclass of an object class.  Lazy objects
+    hold the LazyLoader of their result set, and load attributes they do not
+    hold when they are read.
+
+    :param type base: The object class, such as ADUser
+
+    :return: A subclass of base, with the same name
+    :rtype: type
+    """
+    try:
+        return _LAZY_CLASSES[base]
+    except KeyError:
+        pass
+
+    # Weak references are held by the LazyLoader
+    lazy_class = type(base.__name__, (base,), {'__slots__': ('_loader', '__weakref__'),
+                                               '__module__': base.__module__,
+                                               '__getattr__': _lazy_getattr})
+    lazy_class._record_base = lazy_class  #pylint: disable=protected-access
+    _LAZY_CLASSES[base] = lazy_class
+
+    return lazy_class
+
+
+def _record_class(base, fields):
+    """Retrieve, or create, the record class for an object class and set of
+    attribute names.  Record classes keep the name of the object class they
+    extend, and add no per-instance storage.
+
+    :param type base: The object class, such as ADUser
+    :param tuple fields: Lowercase attribute names, in the order of the values list
 
+    :return: A subclass of base with a descriptor for each attribute
+    :rtype: type
+    """
+    record_class = _RECORD_CLASSES.get((base, fields))
+    if record_class is not None:
+        return record_class
 
-        logging.debug('Attributes and values for %s object (DN: %s): %s', class_name,
-                      search_result[0], ado.__dict__)
+    namespace = {name: _DecodedField(name, index, DECODED_ATTRIBUTES[name])
+                      if name in DECODED_ATTRIBUTES else _Field(name, index)
+                 for index, name in enumerate(fields)}
+    namespace.update({'__slots__': (), '__module__': base.__module__,
+                      '_fields': fields, '_record_base': base,
+                      '_decoders': tuple([(name, DECODED_ATTRIBUTES[name]) for name in fields
+                                          if name in DECODED_ATTRIBUTES])})
+    record_class = type(base.__name__, (base,), namespace)
+    _RECORD_CLASSES.set((base, fields), record_class)
 
-        return ado
+    return record_class
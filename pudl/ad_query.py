@@ -13,7 +13,15 @@
 # limitations under the License.
 """ad_query"""
 
+import contextlib
 import logging
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 import ldap
 
 # Set a default LDAP URL, port 389 as we are using LDAP+TLS and not LDAPS
@@ -27,6 +35,9 @@ LDAP_OPTIONS = ((ldap.OPT_PROTOCOL_VERSION, ldap.VERSION3),
 LDAP_OPTIONS_TLS_NO_VERIFY = ((ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_ALLOW),
                               (ldap.OPT_PROTOCOL_VERSION, ldap.VERSION3),
                               (ldap.OPT_REFERRALS, 0))
+
+# Search the full subtree beneath the base DN by default
+SEARCH_SCOPE = ldap.SCOPE_SUBTREE
 #pylint: enable=no-member
 
 # Limit the number of results per page, with a default that should generally
@@ -36,16 +47,52 @@ PAGE_SIZE = 300
 # Require identity trust is established with the server by default
 TLS_NO_VERIFY = False
 
+# The number of searches multi_search() keeps in flight on a single connection
+MAX_OUTSTANDING = 10
+
+# The number of values requested per read of a ranged attribute, such as the member
+# attribute of a large group.  AD returns at most MaxValRange values (1500 by default)
+# per read, whatever is requested
+RANGE_STEP = 1500
+
+# Large binary attributes left out when objects are searched for without naming the
+# attributes to populate, which needs an ADSchema to list the attributes that remain
+EXCLUDE_ATTRIBUTES = ('thumbnailPhoto', 'jpegPhoto', 'photo', 'audio', 'userCertificate',
+                      'userSMIMECertificate', 'userPKCS12', 'mSMQSignCertificates',
+                      'mSMQDigests', 'msExchSafeSendersHash', 'msExchBlockedSendersHash',
+                      'msExchSafeRecipientsHash', 'msExchUMSpokenName',
+                      'msPKIAccountCredentials', 'msPKIDPAPIMasterKeys')
+
+# LDAP_SERVER_NOTIFICATION, requests a persistent search reporting each change
+NOTIFICATION_OID = '1.2.840.113556.1.4.528'
+
+# LDAP_SERVER_SHOW_DELETED, includes deleted objects (tombstones) in results
+SHOW_DELETED_OID = '1.2.840.113556.1.4.417'
+
+# Seconds to wait for each change notification before yielding control to the caller
+NOTIFICATION_TIMEOUT = 1
+
+# The number of connections kept open by an ADQueryPool
+POOL_SIZE = 4
+
+# Pooled connections idle for longer than this many seconds are checked before reuse
+HEALTH_CHECK_INTERVAL = 60
+
 class ADQuery(object):  #pylint: disable=too-few-public-methods
     """Query Active directory with python-ldap.  May be used directly, but is most
     commonly used indirectly via ADObject-based classes.  All connections
     require TLS.
+
+    Set schema to a loaded ADSchema for objects to be typed by the attribute
+    definitions, see ADSchema.
     """
 
     def __init__(self, user, password,
                  ldap_url=LDAP_URL,
                  tls_no_verify=TLS_NO_VERIFY,
-                 page_size=PAGE_SIZE):
+                 page_size=PAGE_SIZE,
+                 range_step=RANGE_STEP,
+                 exclude_attributes=EXCLUDE_ATTRIBUTES):
         """The ADQuery constructor
 
         :param str user: The LDAP user to connect as
@@ -54,7 +101,11 @@ class ADQuery(object):  #pylint: disable=too-few-public-methods
         :param bool tls_no_verify: If True, connect to servers with certificates not signed
             by an authority we trust, defaults to False
         :param int page_size: The max result set size, per page, defaults to *{1}*
-        """.format(LDAP_URL, PAGE_SIZE)
+        :param int range_step: The number of values requested per read of a ranged
+            attribute, defaults to *{2}*
+        :param list exclude_attributes: Attributes left out of objects when the
+            attributes to populate are not specified, defaults to EXCLUDE_ATTRIBUTES
+        """.format(LDAP_URL, PAGE_SIZE, RANGE_STEP)
         if tls_no_verify:
             ldap_options = LDAP_OPTIONS_TLS_NO_VERIFY
         else:
@@ -68,39 +119,335 @@ class ADQuery(object):  #pylint: disable=too-few-public-methods
             ldap.set_option(setting[0], setting[1])
 
         self.ldap = ldap.initialize(ldap_url)
-        self.sprc = ldap.controls.SimplePagedResultsControl(True, page_size, '')
+        self.ldap_url = ldap_url
+        self.tls_no_verify = tls_no_verify
         self.user = user
         self.password = password
         self.page_size = page_size
+        self.range_step = range_step
+        self.exclude_attributes = exclude_attributes
+        self.schema = None
+        # Message id to the results and server controls of a reply multi_search() read
+        # for another search on the connection, kept until that search reads it
+        self._unclaimed = {}
 
         # Open the connection
         self._open()
 
 
-    def search(self, base_dn, search_filter, attributes=()):
+    def search(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE, serverctrls=(),
+               limit=0):
         """Perform an AD search
 
         :param str base_dn: The base DN to search within
         :param str search_filter: The search filter to apply, such as:
           *objectClass=person*
         :param list attributes: Object attributes to populate, defaults to all
+        :param int scope: The search scope, defaults to a subtree search
+        :param list serverctrls: Any additional LDAP controls to send with the search
+        :param int limit: The maximum number of results, defaults to all, see iter_pages()
+
+        :return: A list of search results, each a (DN, attributes) tuple
+        :rtype: list
+        """
+        return list(self.iter_search(base_dn, search_filter, attributes, scope, serverctrls,
+                                     limit))
+
+
+    def iter_search(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE,
+                    serverctrls=(), limit=0):
+        """Perform an AD search, yielding results as each page arrives rather
+        than accumulating the full result set.  Only a single page of results
+        is held at a time.
+
+        :param str base_dn: The base DN to search within
+        :param str search_filter: The search filter to apply, such as:
+          *objectClass=person*
+        :param list attributes: Object attributes to populate, defaults to all
+        :param int scope: The search scope, defaults to a subtree search
+        :param list serverctrls: Any additional LDAP controls to send with the search
+        :param int limit: The maximum number of results, defaults to all, see iter_pages()
+
+        :return: A generator of search results, each a (DN, attributes) tuple
+        :rtype: generator
+        """
+        for data in self.iter_pages(base_dn, search_filter, attributes, scope, serverctrls,
+                                    limit):
+            for search_result in data:
+                yield search_result
+
+
+    def iter_pages(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE,
+                   serverctrls=(), limit=0):
+        """Perform an AD search, yielding one list of results per page
+
+        Paging state is kept per call, so several searches may be iterated
+        over at the same time with a single ADQuery instance.  Attributes the
+        server only returns a range of values for are completed, see merge_ranges().
+
+        With a limit, no page asks for more results than are still wanted, and
+        the search ends as soon as the limit is reached.  The server's paging
+        state is released whenever a search ends early, including when the
+        caller stops iterating, see release_pages().
+
+        :param str base_dn: The base DN to search within
+        :param str search_filter: The search filter to apply, such as:
+          *objectClass=person*
+        :param list attributes: Object attributes to populate, defaults to all
+        :param int scope: The search scope, defaults to a subtree search
+        :param list serverctrls: Any additional LDAP controls to send with the search
+        :param int limit: The maximum number of results, defaults to 0 for all
+
+        :return: A generator of lists of search results
+        :rtype: generator
         """
-        results = []
+        sprc = ldap.controls.SimplePagedResultsControl(True, self.page_size, '')
         page = 0
-        while page == 0 or self.sprc.cookie:
-            page += 1
+        remaining = limit
+        try:
+            while page == 0 or sprc.cookie:
+                page += 1
+                if limit:
+                    sprc.size = min(self.page_size, remaining)
+                message_id = self.ldap.search_ext(base_dn, scope, search_filter, attributes,
+                                                  serverctrls=[sprc] + list(serverctrls))
+                data, server_controls = self._result(message_id)
+                sprc.cookie = server_controls[0].cookie
+                logging.debug('%s - Page %s results: %s',  \
+                              self.__class__.__name__, page, ', '.join(k[0] for k in data))
+                if limit:
+                    data = data[:remaining]
+                    remaining -= len(data)
+                yield self.merge_ranges(data)
+                if limit and not remaining:
+                    break
+        finally:
+            if sprc.cookie:
+                self.release_pages(base_dn, search_filter, scope, sprc, serverctrls)
+
+
+    def release_pages(self, base_dn, search_filter, scope, sprc, serverctrls=()):
+        """Release the server's state for a paged search that ends before its last
+        page, by sending the search again with the cookie and a page size of 0.  The
+        server returns no further results, and forgets the search.
+
+        :param str base_dn: The base DN of the search
+        :param str search_filter: The search filter of the search
+        :param int scope: The search scope
+        :param SimplePagedResultsControl sprc: The paging control, holding the cookie
+            returned with the last page
+        :param list serverctrls: Any additional LDAP controls sent with the search
+        """
+        sprc.size = 0
+        try:
+            message_id = self.ldap.search_ext(base_dn, scope, search_filter, ['1.1'],
+                                              serverctrls=[sprc] + list(serverctrls))
+            self._result(message_id)
+        except ldap.LDAPError as err:
+            logging.debug('%s - Unable to release paged search: %s',
+                          self.__class__.__name__, err)
+        sprc.cookie = ''
+
+
+    def multi_search(self, searches, scope=SEARCH_SCOPE, max_outstanding=MAX_OUTSTANDING):
+        """Perform many AD searches concurrently on this connection, rather than
+        waiting on each in turn.  Up to max_outstanding searches are in flight at
+        once, and each is yielded once all of its pages have arrived, so results
+        are generally not in the order the searches were provided.
+
+        Replies are read as they arrive, whichever search they belong to.  Replies
+        to other searches on the connection are set aside until those searches
+        read them, so the connection may be used for other searches while results
+        are iterated over, such as the range reads of merge_ranges().
+
+        :param iterable searches: (key, base_dn, search_filter, attributes) tuples,
+            where key is any value used to identify the search in the results
+        :param int scope: The search scope, defaults to a subtree search
+        :param int max_outstanding: The maximum number of searches in flight,
+            defaults to *{0}*
+
+        :return: A generator of (key, results) tuples, where results is a list of
+            (DN, attributes) tuples
+        :rtype: generator
+        """.format(MAX_OUTSTANDING)
+        for key, results in self._multi_search(searches, scope, max_outstanding):
+            yield key, self.merge_ranges(results)
+
+
+    def merge_ranges(self, data):
+        """Complete the attributes the server only returned a range of values for,
+        such as *member;range=0-1499* for a large group.  The remaining ranges are
+        read range_step values at a time, with the reads for every attribute in
+        flight together, and the values are merged into the plain attribute name.
+
+        :param list data: Search results, each a (DN, attributes) tuple, which are
+            updated in place
+
+        :return: The search results
+        :rtype: list
+        """
+        incomplete = []
+        for distinguished_name, attributes in data:
+            # Referrals have no DN
+            if distinguished_name is not None:
+                incomplete += _merge_range(distinguished_name, attributes, attributes)
+
+        while incomplete:
+            logging.debug('%s - reading %s further attribute ranges',
+                          self.__class__.__name__, len(incomplete))
+            searches = [(index, distinguished_name, '(objectClass=*)',
+                         ['{0};range={1}-{2}'.format(name, start, start + self.range_step - 1)])
+                        for index, (distinguished_name, _, name, start) in enumerate(incomplete)]
+            reads, incomplete = incomplete, []
             #pylint: disable=no-member
-            message_id = self.ldap.search_ext(base_dn, ldap.SCOPE_SUBTREE,
-                                              search_filter, attributes,
-                                              serverctrls=[self.sprc])
+            for index, results in self._multi_search(searches, ldap.SCOPE_BASE):
             #pylint: enable=no-member
-            data, server_controls = self.ldap.result3(message_id)[1::2]
-            self.sprc.cookie = server_controls[0].cookie
-            logging.debug('%s - Page %s results: %s',  \
-                          self.__class__.__name__, page, ', '.join(k[0] for k in data))
-            results += [u for u in data]
+                distinguished_name, attributes = reads[index][:2]
+                for _, values in results[:1]:
+                    incomplete += _merge_range(distinguished_name, attributes, values)
+
+        return data
+
+
+    def _multi_search(self, searches, scope, max_outstanding=MAX_OUTSTANDING):
+        """Perform many AD searches concurrently, see multi_search().  Ranged
+        attributes are returned as they are.
+
+        :param iterable searches: (key, base_dn, search_filter, attributes) tuples
+        :param int scope: The search scope
+        :param int max_outstanding: The maximum number of searches in flight
+
+        :return: A generator of (key, results) tuples
+        :rtype: generator
+        """
+        searches = iter(searches)
+        # Message id to the search and its results gathered so far
+        pending = {}
+        try:
+            while True:
+                while len(pending) < max_outstanding:
+                    try:
+                        key, base_dn, search_filter, attributes = next(searches)
+                    except StopIteration:
+                        break
+                    sprc = ldap.controls.SimplePagedResultsControl(True, self.page_size, '')
+                    search = (key, base_dn, search_filter, attributes, sprc, [])
+                    pending[self._search_ext(search, scope)] = search
+
+                if not pending:
+                    break
+
+                message_id, data, server_controls = self._any_result(pending)
+                search = pending.pop(message_id)
+                search[5].extend(data)
+                search[4].cookie = server_controls[0].cookie
+                if search[4].cookie:
+                    pending[self._search_ext(search, scope)] = search
+                else:
+                    logging.debug('%s - Search %s complete with %s results',
+                                  self.__class__.__name__, search[0], len(search[5]))
+                    yield search[0], search[5]
+        finally:
+            # Searches still in flight when the caller stops iterating are not needed
+            for message_id in pending:
+                self._unclaimed.pop(message_id, None)
+                self.ldap.abandon_ext(message_id)
+
+
+    def iter_notifications(self, base_dn, attributes=(), timeout=NOTIFICATION_TIMEOUT):
+        """Subscribe to change notifications for every object beneath a base DN, with
+        the LDAP_SERVER_NOTIFICATION control.  The search never completes on its own,
+        the current state of each object is yielded as it is added, modified, moved
+        or deleted, until the generator is closed.  Deleted objects have an
+        isDeleted attribute of TRUE.
+
+        None is yielded whenever timeout seconds pass without a change, so callers
+        can check whether to stop.  The connection should not be used for
+        anything else while subscribed.
 
-        return results
+        :param str base_dn: The base DN to watch, deletions are generally only
+            reported when this is the root of a naming context
+        :param list attributes: Object attributes to populate, defaults to all
+        :param float timeout: Seconds to wait for each notification, defaults to *{0}*
+
+        :return: A generator of (DN, attributes) tuples, or None
+        :rtype: generator
+        """.format(NOTIFICATION_TIMEOUT)
+        serverctrls = [ldap.controls.LDAPControl(NOTIFICATION_OID, True, None),
+                       ldap.controls.LDAPControl(SHOW_DELETED_OID, True, None)]
+        #pylint: disable=no-member
+        message_id = self.ldap.search_ext(base_dn, ldap.SCOPE_SUBTREE, '(objectClass=*)',
+                                          attributes, serverctrls=serverctrls)
+        try:
+            while True:
+                try:
+                    result_type, data = self.ldap.result3(message_id, 0, timeout)[:2]
+                except ldap.TIMEOUT:
+                    yield None
+                    continue
+                if result_type == ldap.RES_SEARCH_RESULT:
+                    # The server ended the subscription
+                    logging.info('%s - change notifications for %s ended by the server',
+                                 self.__class__.__name__, base_dn)
+                    message_id = None
+                    return
+                for search_result in data:
+                    yield search_result
+        #pylint: enable=no-member
+        finally:
+            if message_id is not None:
+                self.ldap.abandon_ext(message_id)
+
+
+    def _result(self, message_id):
+        """Wait for the reply to a search, which multi_search() may already have
+        read while waiting on its own searches
+
+        :param int message_id: The LDAP message id of the search
+
+        :return: A tuple of the results and server controls
+        :rtype: tuple
+        """
+        try:
+            return self._unclaimed.pop(message_id)
+        except KeyError:
+            return tuple(self.ldap.result3(message_id)[1::2])
+
+
+    def _any_result(self, message_ids):
+        """Wait for the reply to whichever of several searches completes first.
+        Replies to other searches on the connection are set aside, see _result().
+
+        :param container message_ids: The LDAP message ids of the searches
+
+        :return: A tuple of the message id, results and server controls
+        :rtype: tuple
+        """
+        for message_id in message_ids:
+            if message_id in self._unclaimed:
+                return (message_id,) + self._unclaimed.pop(message_id)
+
+        while True:
+            #pylint: disable=no-member
+            data, message_id, server_controls = self.ldap.result3(ldap.RES_ANY)[1:]
+            #pylint: enable=no-member
+            if message_id in message_ids:
+                return message_id, data, server_controls
+            self._unclaimed[message_id] = (data, server_controls)
+
+
+    def _search_ext(self, search, scope):
+        """Send the next page request for a search started by multi_search()
+
+        :param tuple search: key, base_dn, search_filter, attributes, paged results control
+            and results
+        :param int scope: The search scope
+
+        :return: The LDAP message id
+        :rtype: int
+        """
+        return self.ldap.search_ext(search[1], scope, search[2], search[3],
+                                    serverctrls=[search[4]])
 
 
     def _open(self):
@@ -117,3 +464,299 @@ class ADQuery(object):  #pylint: disable=too-few-public-methods
 
         self.ldap.simple_bind_s(self.user, self.password)
 
+
+    def is_alive(self):
+        """Health check the connection with a lightweight whoami request
+
+        :return: True if the server responded
+        :rtype: bool
+        """
+        try:
+            self.ldap.whoami_s()
+        #pylint: disable=no-member
+        except ldap.LDAPError:
+        #pylint: enable=no-member
+            logging.info('%s - connection to %s is not healthy',
+                         self.__class__.__name__, self.ldap_url)
+            return False
+
+        return True
+
+
+    def reconnect(self):
+        """Discard the current connection, then open and bind a new one"""
+        self.close()
+        self._unclaimed = {}
+        self.ldap = ldap.initialize(self.ldap_url)
+        self._open()
+
+
+    def close(self):
+        """Unbind, ignoring any errors from a connection that is already down"""
+        try:
+            self.ldap.unbind_s()
+        #pylint: disable=no-member
+        except ldap.LDAPError:
+        #pylint: enable=no-member
+            pass
+
+
+def _merge_range(distinguished_name, attributes, values):
+    """Move ranged attribute values, such as those of *member;range=0-1499*, into
+    the plain attribute name
+
+    :param str distinguished_name: The DN of the object
+    :param dict attributes: The object's attributes, to merge values into
+    :param dict values: Attributes returned by a read, which may be attributes itself
+
+    :return: A list of (DN, attributes, name, start) tuples, for each attribute with
+        further values to read, starting from index start
+    :rtype: list
+    """
+    remaining = []
+    for key in list(values):
+        index = key.lower().find(';range=')
+        if index < 0:
+            continue
+        name, end = key[:index], key[index + len(';range='):].partition('-')[2]
+        attributes.setdefault(name, []).extend(values.pop(key))
+        # The last range ends with *
+        if end != '*':
+            remaining.append((distinguished_name, attributes, name, int(end) + 1))
+
+    return remaining
+
+
+class ADQueryPool(object):
+    """A thread-safe pool of bound, TLS-established ADQuery connections.  Connections
+    are checked out for the duration of each search, and idle connections are
+    health checked and reconnected as needed before reuse.
+
+    ADQueryPool provides the same search methods as ADQuery, so may be
+    passed to ADUser, ADGroup and ADComputer in place of an ADQuery instance.
+    Each checkout, including each search generator, is given its own connection
+    while any are idle.  When none are, a thread that already holds a connection
+    shares it rather than waiting, so object factories that search while
+    iterating results do not deadlock a small pool.  Searches only read the
+    responses to their own requests, so a shared connection is safe to use even
+    when the generator holding it is resumed in another thread.  As with
+    ADQuery, schema may be set to a loaded ADSchema.
+    """
+
+    def __init__(self, user, password,
+                 ldap_url=LDAP_URL,
+                 tls_no_verify=TLS_NO_VERIFY,
+                 page_size=PAGE_SIZE,
+                 size=POOL_SIZE,
+                 health_check_interval=HEALTH_CHECK_INTERVAL,
+                 range_step=RANGE_STEP,
+                 exclude_attributes=EXCLUDE_ATTRIBUTES):
+        """The ADQueryPool constructor, opens all connections up front
+
+        :param str user: The LDAP user to connect as
+        :param str password: The LDAP user's password
+        :param str ldap_url: The url, defaults to *{0}*
+        :param bool tls_no_verify: If True, connect to servers with certificates not signed
+            by an authority we trust, defaults to False
+        :param int page_size: The max result set size, per page, defaults to *{1}*
+        :param int size: The number of connections to keep open, defaults to *{2}*
+        :param int health_check_interval: Connections idle for longer than this many
+            seconds are health checked when checked out, defaults to *{3}*
+        :param int range_step: The number of values requested per read of a ranged
+            attribute, defaults to *{4}*
+        :param list exclude_attributes: Attributes left out of objects when the
+            attributes to populate are not specified, defaults to EXCLUDE_ATTRIBUTES
+        """.format(LDAP_URL, PAGE_SIZE, POOL_SIZE, HEALTH_CHECK_INTERVAL, RANGE_STEP)
+        self.logger = logging.getLogger(__name__)
+
+        self.ldap_url = ldap_url
+        self.page_size = page_size
+        self.exclude_attributes = exclude_attributes
+        self.schema = None
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self._idle = queue.Queue()
+        # Thread identity to a list of the connections it has checked out, a
+        # connection shared by several checkouts appears once for each
+        self._held = {}
+        self._lock = threading.Lock()
+
+        for _ in range(size):
+            self._idle.put((time.time(), ADQuery(user, password, ldap_url=ldap_url,
+                                                 tls_no_verify=tls_no_verify,
+                                                 page_size=page_size,
+                                                 range_step=range_step,
+                                                 exclude_attributes=exclude_attributes)))
+
+
+    def checkout(self, timeout=None):
+        """Check out a connection, waiting for one to be returned if all are in use,
+        unless the thread already holds one, which is then shared.  Every checkout
+        must be paired with a call to checkin().
+
+        :param float timeout: The maximum number of seconds to wait, defaults to
+            waiting indefinitely
+
+        :return: A bound ADQuery instance
+        :rtype: ADQuery
+        """
+        ident = threading.current_thread().ident
+        try:
+            last_used, adq = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                # Waiting while holding a connection could wait forever, when the
+                # holder is a generator suspended until this checkout completes
+                if self._held.get(ident):
+                    adq = self._held[ident][-1]
+                    self._held[ident].append(adq)
+                    return adq
+
+            try:
+                last_used, adq = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                logging.error('%s - no connection was returned to the pool within %s seconds',
+                              self.__class__.__name__, timeout)
+                raise
+
+        if time.time() - last_used > self.health_check_interval and not adq.is_alive():
+            try:
+                adq.reconnect()
+            except Exception:
+                # Keep the pool at full size, the connection will be retried next time
+                self._idle.put((0, adq))
+                raise
+
+        with self._lock:
+            self._held.setdefault(ident, []).append(adq)
+
+        return adq
+
+
+    def checkin(self, adq, ident=None):
+        """Return a checked out connection to the pool
+
+        :param ADQuery adq: The connection returned by checkout()
+        :param int ident: The identity of the thread that checked out the connection,
+            defaults to the current thread
+        """
+        if ident is None:
+            ident = threading.current_thread().ident
+        with self._lock:
+            held = self._held.get(ident, [])
+            positions = [index for index, connection in enumerate(held) if connection is adq]
+            if not positions:
+                raise ValueError('Connection was not checked out by this thread')
+            del held[positions[-1]]
+            if len(positions) > 1:
+                # Still shared by another checkout
+                return
+            if not held:
+                del self._held[ident]
+
+        self._idle.put((time.time(), adq))
+
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """A context manager that checks out a connection and returns it on exit
+
+        :param float timeout: The maximum number of seconds to wait for a connection
+
+        :return: A bound ADQuery instance
+        :rtype: ADQuery
+        """
+        ident = threading.current_thread().ident
+        adq = self.checkout(timeout=timeout)
+        try:
+            yield adq
+        finally:
+            # Generators may be resumed, and so finish, in another thread
+            self.checkin(adq, ident=ident)
+
+
+    def search(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE, serverctrls=(),
+               limit=0):
+        """Perform an AD search with a pooled connection, see ADQuery.search()
+
+        :param str base_dn: The base DN to search within
+        :param str search_filter: The search filter to apply
+        :param list attributes: Object attributes to populate, defaults to all
+        :param int scope: The search scope, defaults to a subtree search
+        :param list serverctrls: Any additional LDAP controls to send with the search
+        :param int limit: The maximum number of results, defaults to all
+
+        :return: A list of search results, each a (DN, attributes) tuple
+        :rtype: list
+        """
+        with self.connection() as adq:
+            return adq.search(base_dn, search_filter, attributes, scope, serverctrls, limit)
+
+
+    def iter_search(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE,
+                    serverctrls=(), limit=0):
+        """Perform an AD search with a pooled connection, see ADQuery.iter_search().
+        The connection is held until the generator is exhausted or closed.
+
+        :param str base_dn: The base DN to search within
+        :param str search_filter: The search filter to apply
+        :param list attributes: Object attributes to populate, defaults to all
+        :param int scope: The search scope, defaults to a subtree search
+        :param list serverctrls: Any additional LDAP controls to send with the search
+        :param int limit: The maximum number of results, defaults to all
+
+        :return: A generator of search results, each a (DN, attributes) tuple
+        :rtype: generator
+        """
+        for data in self.iter_pages(base_dn, search_filter, attributes, scope, serverctrls,
+                                    limit):
+            for search_result in data:
+                yield search_result
+
+
+    def iter_pages(self, base_dn, search_filter, attributes=(), scope=SEARCH_SCOPE,
+                   serverctrls=(), limit=0):
+        """Perform an AD search with a pooled connection, see ADQuery.iter_pages().
+        The connection is held until the generator is exhausted or closed.
+
+        :param str base_dn: The base DN to search within
+        :param str search_filter: The search filter to apply
+        :param list attributes: Object attributes to populate, defaults to all
+        :param int scope: The search scope, defaults to a subtree search
+        :param list serverctrls: Any additional LDAP controls to send with the search
+        :param int limit: The maximum number of results, defaults to all
+
+        :return: A generator of lists of search results
+        :rtype: generator
+        """
+        with self.connection() as adq:
+            for data in adq.iter_pages(base_dn, search_filter, attributes, scope, serverctrls,
+                                       limit):
+                yield data
+
+
+    def multi_search(self, searches, scope=SEARCH_SCOPE, max_outstanding=MAX_OUTSTANDING):
+        """Perform many AD searches concurrently on one pooled connection, see
+        ADQuery.multi_search().  The connection is held until the generator is
+        exhausted or closed.
+
+        :param iterable searches: (key, base_dn, search_filter, attributes) tuples
+        :param int scope: The search scope, defaults to a subtree search
+        :param int max_outstanding: The maximum number of searches in flight
+
+        :return: A generator of (key, results) tuples
+        :rtype: generator
+        """
+        with self.connection() as adq:
+            for key_results in adq.multi_search(searches, scope, max_outstanding):
+                yield key_results
+
+
+    def close(self):
+        """Unbind all idle connections, any checked out are left untouched"""
+        while True:
+            try:
+                adq = self._idle.get_nowait()[1]
+            except queue.Empty:
+                break
+            adq.close()
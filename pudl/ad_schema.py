@@ -0,0 +1,274 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ad_schema - attribute definitions read from the AD schema, cached on disk"""
+
+import json
+import logging
+import os
+import time
+
+import ldap
+
+from pudl.helper import attribute_values
+
+# The default location of the schema cache
+SCHEMA_FILE = os.path.join(os.path.expanduser('~'), '.pudl', 'schema.json')
+
+# Seconds before the schema cache is read from the directory again
+SCHEMA_TTL = 86400
+
+# Matches every attribute definition in the schema naming context
+ATTRIBUTE_SCHEMA_FILTER = '(objectClass=attributeSchema)'
+
+# The attributeSchema attributes read for each definition
+DEFINITION_ATTRIBUTES = ['lDAPDisplayName', 'isSingleValued', 'attributeSyntax', 'systemFlags']
+
+# Matches every object class definition in the schema naming context
+CLASS_SCHEMA_FILTER = '(objectClass=classSchema)'
+
+# The classSchema attributes read for each object class
+CLASS_ATTRIBUTES = ['lDAPDisplayName', 'subClassOf', 'auxiliaryClass', 'systemAuxiliaryClass',
+                    'mayContain', 'mustContain', 'systemMayContain', 'systemMustContain']
+
+# The systemFlags bit of attributes computed by the server, which are only returned
+# when requested by name, and some only with a base scope
+FLAG_ATTR_IS_CONSTRUCTED = 0x4
+
+# Attribute names with special meaning in a search request, never validated
+SPECIAL_ATTRIBUTES = ('*', '+', '1.1')
+
+# The attributeSyntax of attributes holding DNs
+DN_SYNTAX = '2.5.5.1'
+
+
+class ADSchema(object):
+    """The attribute definitions of the AD schema: whether each attribute is
+    single-valued, and its syntax.  Definitions are read from the directory
+    once, then cached on disk for ttl seconds, as they rarely change.
+
+    Set as the schema of an ADQuery, object values are typed by definition
+    rather than by how many values an entry happens to hold: single-valued
+    attributes are always a plain value, and multi-valued attributes always a
+    list, even with a single value.
+
+    The attributes each object class may hold are also read, so that searches
+    can request every attribute except a few, see class_attributes().
+    """
+
+    def __init__(self, adq, path=SCHEMA_FILE, ttl=SCHEMA_TTL):
+        """ADSchema constructor
+
+        :param ADQuery adq: The ADQuery instance used to read the schema
+        :param str path: The schema cache file, defaults to *{0}*
+        :param int ttl: Seconds before the cache is read again, defaults to *{1}*
+        """.format(SCHEMA_FILE, SCHEMA_TTL)
+        self.logger = logging.getLogger(__name__)
+
+        self.adq = adq
+        self.path = path
+        self.ttl = ttl
+        # Lowercase attribute name to a tuple of lDAPDisplayName, single-valued, syntax
+        # and whether the attribute is constructed
+        self.definitions = {}
+        # Lowercase object class name to a tuple of the lowercase superclass name, a list
+        # of lowercase auxiliary class names, and a list of attribute names
+        self.classes = {}
+        # Tuples of attribute names to their single-valued flags
+        self._single_valued = {}
+        # Lowercase object class name to the attributes it may hold
+        self._class_attributes = {}
+
+
+    def load(self):
+        """Load definitions from the cache file, or from the directory if the cache
+        is missing, has expired or describes another schema
+
+        :return: This instance, for chaining
+        :rtype: ADSchema
+        """
+        #pylint: disable=no-member
+        root_dse = self.adq.search('', '(objectClass=*)', ['schemaNamingContext'],
+                                   scope=ldap.SCOPE_BASE)[0][1]
+        #pylint: enable=no-member
+        schema_dn = attribute_values(root_dse, 'schemanamingcontext')[0]
+
+        try:
+            with open(self.path) as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            cache = {}
+
+        if cache.get('schema_dn') == schema_dn and 'classes' in cache and \
+           cache.get('fetched', 0) + self.ttl > time.time():
+            logging.debug('%s - using cached schema from %s', self.__class__.__name__,
+                          self.path)
+            self._set_definitions({name: tuple(definition) for name, definition
+                                   in cache['definitions'].items()},
+                                  {name: tuple(object_class) for name, object_class
+                                   in cache['classes'].items()})
+        else:
+            self.refresh(schema_dn)
+
+        return self
+
+
+    def refresh(self, schema_dn):
+        """Read every attribute and object class definition from the directory, and
+        write the cache file
+
+        :param str schema_dn: The schema naming context
+        """
+        logging.info('%s - reading attribute definitions from %s', self.__class__.__name__,
+                     schema_dn)
+        definitions = {}
+        #pylint: disable=no-member
+        for _, values in self.adq.iter_search(schema_dn, ATTRIBUTE_SCHEMA_FILTER,
+                                              DEFINITION_ATTRIBUTES, scope=ldap.SCOPE_ONELEVEL):
+        #pylint: enable=no-member
+            names = attribute_values(values, 'ldapdisplayname')
+            if not names:
+                continue
+            single_valued = [value.upper() for value in attribute_values(values, 'issinglevalued')]
+            syntax = attribute_values(values, 'attributesyntax')
+            flags = int((attribute_values(values, 'systemflags') or [0])[0])
+            definitions[names[0].lower()] = (names[0], single_valued == ['TRUE'],
+                                             syntax[0] if syntax else None,
+                                             bool(flags & FLAG_ATTR_IS_CONSTRUCTED))
+
+        classes = {}
+        #pylint: disable=no-member
+        for _, values in self.adq.iter_search(schema_dn, CLASS_SCHEMA_FILTER, CLASS_ATTRIBUTES,
+                                              scope=ldap.SCOPE_ONELEVEL):
+        #pylint: enable=no-member
+            names = attribute_values(values, 'ldapdisplayname')
+            if not names:
+                continue
+            superclass = attribute_values(values, 'subclassof')
+            auxiliary = attribute_values(values, 'auxiliaryclass') + \
+                        attribute_values(values, 'systemauxiliaryclass')
+            attributes = []
+            for name in ('maycontain', 'mustcontain', 'systemmaycontain', 'systemmustcontain'):
+                attributes += attribute_values(values, name)
+            classes[names[0].lower()] = (superclass[0].lower() if superclass else None,
+                                         [name.lower() for name in auxiliary], attributes)
+        self._set_definitions(definitions, classes)
+
+        if not os.path.isdir(os.path.dirname(os.path.abspath(self.path))):
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)))
+        with open(self.path, 'w') as cache_file:
+            json.dump({'schema_dn': schema_dn, 'fetched': time.time(),
+                       'definitions': definitions, 'classes': classes}, cache_file)
+
+
+    def definition(self, name):
+        """Look up the definition of an attribute, ignoring any options such
+        as *;binary*
+
+        :param str name: The attribute name, in any case
+
+        :return: A tuple of the lDAPDisplayName, whether the attribute is single-valued,
+            its attributeSyntax and whether it is constructed, or None if the attribute
+            is not defined
+        :rtype: tuple
+        """
+        return self.definitions.get(name.split(';')[0].lower())
+
+
+    def single_valued(self, names):
+        """Whether each of a set of attributes is single-valued.  Results are kept
+        for each distinct tuple of names, as the object factory sees the same
+        few sets of names over and over.
+
+        :param tuple names: Attribute names, in any case
+
+        :return: A tuple of True, False, or None for attributes that are not defined
+        :rtype: tuple
+        """
+        try:
+            return self._single_valued[names]
+        except KeyError:
+            pass
+
+        flags = []
+        for name in names:
+            definition = self.definition(name)
+            flags.append(definition[1] if definition else None)
+        self._single_valued[names] = tuple(flags)
+
+        return self._single_valued[names]
+
+
+    def class_attributes(self, object_class):
+        """The attributes an object class may hold, including those of its
+        superclasses and auxiliary classes.  Constructed attributes are left
+        out, as they are not returned when all attributes are requested either.
+
+        :param str object_class: The object class, such as *user*
+
+        :return: A sorted list of lDAPDisplayNames, empty if the class is not defined
+        :rtype: list
+        """
+        object_class = object_class.lower()
+        try:
+            return self._class_attributes[object_class]
+        except KeyError:
+            pass
+
+        names = set()
+        pending, seen = [object_class], set()
+        while pending:
+            name = pending.pop()
+            if name in seen or name not in self.classes:
+                continue
+            seen.add(name)
+            superclass, auxiliary, attributes = self.classes[name]
+            names.update(attributes)
+            # top is its own superclass
+            pending += [superclass] + auxiliary if superclass else auxiliary
+
+        attributes = []
+        for name in names:
+            definition = self.definition(name)
+            if definition is not None and not definition[3]:
+                attributes.append(definition[0])
+        self._class_attributes[object_class] = sorted(attributes)
+
+        return self._class_attributes[object_class]
+
+
+    def validate(self, names):
+        """Check that attributes are defined in the schema, before they are used
+        in a search
+
+        :param list names: Attribute names, in any case
+
+        :raises ValueError: If any of the attributes are not defined
+        """
+        unknown = [name for name in names
+                   if name not in SPECIAL_ATTRIBUTES and self.definition(name) is None]
+        if unknown:
+            raise ValueError('Unknown attribute{0}: {1}'.format('s' if len(unknown) > 1 else '',
+                                                                ', '.join(unknown)))
+
+
+    def _set_definitions(self, definitions, classes):
+        """Replace the definitions, and any results derived from them
+
+        :param dict definitions: Lowercase attribute names to definition tuples
+        :param dict classes: Lowercase object class names to class tuples
+        """
+        self.definitions = definitions
+        self.classes = classes
+        self._single_valued = {}
+        self._class_attributes = {}
@@ -0,0 +1,294 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ad_snapshot - a persistent local copy of AD user, group and computer objects"""
+
+import logging
+import os
+import pickle
+import sqlite3
+
+import ldap
+from ldap.controls import LDAPControl
+
+from pudl.ad_computer import ADComputer, COMPUTER_FILTER
+from pudl.ad_group import ADGroup, GROUP_FILTER
+from pudl.ad_membership import GroupGraph, naming_context
+from pudl.ad_object import is_loaded
+from pudl.ad_query import SHOW_DELETED_OID
+from pudl.ad_user import ADUser, USER_FILTER
+from pudl.helper import attribute_values, is_beneath
+
+# The default location of the snapshot database
+SNAPSHOT_FILE = os.path.join(os.path.expanduser('~'), '.pudl', 'snapshot.db')
+
+# Each object type mirrored, with its class and search filter
+OBJECT_TYPES = (('user', ADUser, USER_FILTER),
+                ('group', ADGroup, GROUP_FILTER),
+                ('computer', ADComputer, COMPUTER_FILTER))
+
+SCHEMA = ('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+          'CREATE TABLE IF NOT EXISTS objects (guid BLOB PRIMARY KEY, dn TEXT, '
+          'object_type TEXT, samaccountname TEXT, usn INTEGER, attributes BLOB)',
+          'CREATE INDEX IF NOT EXISTS objects_name ON objects (object_type, samaccountname)')
+
+
+class ADSnapshot(object):
+    """A local SQLite mirror of the user, group and computer objects beneath a
+    base DN.  The first refresh() downloads every object, while later refreshes
+    only fetch objects with a uSNChanged above the highest seen so far, and
+    remove objects deleted or moved out of the base DN since.
+
+    Objects are served with the same attribute flattening as ADUser, ADGroup and
+    ADComputer.  Nested membership is expanded from the group memberships held
+    in the snapshot, so only groups within the snapshot's base DN are
+    considered.
+    """
+
+    def __init__(self, adq, path=SNAPSHOT_FILE):
+        """ADSnapshot constructor
+
+        :param ADQuery adq: The ADQuery instance used to refresh the snapshot, and
+            passed to the objects created.  May be None if only reading
+        :param str path: The snapshot database file, defaults to *{0}*
+        """.format(SNAPSHOT_FILE)
+        self.logger = logging.getLogger(__name__)
+
+        self.adq = adq
+        self.path = path
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        self.db = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+
+    def refresh(self, base_dn):
+        """Bring the snapshot up to date with the directory.  A full download is
+        performed if the snapshot is empty, does not cover base_dn, or was taken
+        from another domain controller, as uSNChanged values are specific to
+        each domain controller.
+
+        :param str base_dn: The base DN to mirror
+        """
+        #pylint: disable=no-member
+        root_dse = self.adq.search('', '(objectClass=*)', ['dsServiceName', 'highestCommittedUSN'],
+                                   scope=ldap.SCOPE_BASE)[0][1]
+        #pylint: enable=no-member
+        server = attribute_values(root_dse, 'dsservicename')[0]
+        # Read before searching, so changes made during the refresh are fetched next time
+        highest_usn = int(attribute_values(root_dse, 'highestcommittedusn')[0])
+
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        if meta.get('server') == server and 'usn' in meta and \
+           is_beneath(base_dn, meta.get('base_dn', '')):
+            base_dn = meta['base_dn']
+            usn = int(meta['usn'])
+            logging.info('%s - fetching changes beneath %s since uSNChanged %s',
+                         self.__class__.__name__, base_dn, usn)
+            self._fetch(base_dn, '(uSNChanged>={0})'.format(usn + 1))
+            self._remove_departed(base_dn, usn)
+        else:
+            logging.info('%s - taking a full snapshot beneath %s', self.__class__.__name__,
+                         base_dn)
+            self.db.execute('DELETE FROM objects')
+            self._fetch(base_dn, '')
+
+        self.db.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                            [('server', server), ('base_dn', base_dn), ('usn', str(highest_usn))])
+        self.db.commit()
+
+
+    def entries(self, object_type, base_dn, samaccountnames=(), attributes=()):
+        """Read raw search results from the snapshot
+
+        :param str object_type: One of *user*, *group* or *computer*
+        :param str base_dn: The base DN to search within
+        :param list samaccountnames: sAMAccountNames to find, which may include * wildcards,
+            defaults to all objects
+        :param list attributes: Attributes to include, defaults to all
+
+        :return: A generator of (DN, attributes) tuples, as returned by ADQuery searches
+        :rtype: generator
+        """
+        query = 'SELECT dn, attributes FROM objects WHERE object_type = ?'
+        parameters = [object_type]
+        if samaccountnames:
+            query += ' AND ({0})'.format(' OR '.join(['samaccountname GLOB ?'] *
+                                                     len(samaccountnames)))
+            parameters += [name.lower() for name in samaccountnames]
+        wanted = set(attribute.lower() for attribute in attributes or ())
+
+        for distinguished_name, pickled in self.db.execute(query + ' ORDER BY dn', parameters):
+            if not is_beneath(distinguished_name, base_dn):
+                continue
+            values = pickle.loads(bytes(pickled))
+            if wanted:
+                values = {key: value for key, value in values.items() if key.lower() in wanted}
+            yield distinguished_name, values
+
+
+    def users(self, base_dn, samaccountnames=(), attributes=(), explicit_membership_only=False):
+        """Gathers a list of ADUser objects from the snapshot, see ADUser.users()
+
+        memberOf is a back-link: adding a user to a group changes the group's
+        uSNChanged, not the user's, so the memberOf values stored for a user go
+        stale between full snapshots.  memberof is instead built from the member
+        values of the snapshot's groups, which are kept current, so only groups
+        within the snapshot are listed.
+
+        :param str base_dn: The base DN to search within
+        :param list samaccountnames: A list of usernames, defaults to all users
+        :param list attributes: Object attributes to populate, defaults to all
+        :param bool explicit_membership_only: If set True, memberof will only
+            list groups for which users are directly referenced members
+
+        :return: A list of populated ADUser objects
+        :rtype: list
+        """
+        wanted = not attributes or 'memberof' in [name.lower() for name in attributes]
+        graph = self._graph() if wanted else None
+        data = list(self.entries('user', base_dn, samaccountnames, attributes))
+        #pylint: disable=protected-access
+        ad_users = ADUser(self.adq)._objects_factory(data, table={})
+        #pylint: enable=protected-access
+        for adu, search_result in zip(ad_users, data):
+            if graph is None:
+                continue
+            if explicit_membership_only:
+                memberof = graph.memberof(search_result[0], nested=False)
+                # Typed as the stored value would be, see ADObject
+                if len(memberof) == 1 and getattr(self.adq, 'schema', None) is None:
+                    memberof = memberof[0]
+            else:
+                memberof = [dn for dn in graph.memberof(search_result[0])
+                            if is_beneath(dn, base_dn)]
+            # As with AD, users without groups have no memberof attribute
+            if memberof:
+                adu.memberof = memberof
+            elif is_loaded(adu, 'memberof'):
+                del adu.memberof
+
+        return ad_users
+
+
+    def groups(self, base_dn, samaccountnames=(), attributes=(), explicit_membership_only=False):
+        """Gathers a list of ADGroup objects from the snapshot, see ADGroup.groups()
+
+        :param str base_dn: The base DN to search within
+        :param list samaccountnames: A list of group names, defaults to all groups
+        :param list attributes: Object attributes to populate, defaults to all
+
+        :return: A list of populated ADGroup objects
+        :rtype: list
+        """
+        graph = None if explicit_membership_only else self._graph()
+        data = list(self.entries('group', base_dn, samaccountnames, attributes))
+        #pylint: disable=protected-access
+        ad_groups = ADGroup(self.adq)._objects_factory(data, table={})
+        #pylint: enable=protected-access
+        for adg, search_result in zip(ad_groups, data):
+            if graph is not None and hasattr(adg, 'member'):
+                adg.member = [dn for dn in graph.members(search_result[0])
+                              if is_beneath(dn, base_dn)]
+
+        return ad_groups
+
+
+    def computers(self, base_dn, samaccountnames=(), attributes=()):
+        """Gathers a list of ADComputer objects from the snapshot, see ADComputer.computers()
+
+        :param str base_dn: The base DN to search within
+        :param list samaccountnames: A list of computer names, defaults to all computers
+        :param list attributes: Object attributes to populate, defaults to all
+
+        :return: A list of populated ADComputer objects
+        :rtype: list
+        """
+        data = list(self.entries('computer', base_dn, samaccountnames, attributes))
+        #pylint: disable=protected-access
+        return ADComputer(self.adq)._objects_factory(data, table={})
+
+
+    def close(self):
+        """Close the snapshot database"""
+        self.db.close()
+
+
+    def _fetch(self, base_dn, clause):
+        """Download objects of each type into the snapshot
+
+        :param str base_dn: The base DN to search within
+        :param str clause: A further filter clause objects must match, may be empty
+        """
+        for object_type, object_class, search_filter in OBJECT_TYPES:
+            count = 0
+            # Leaves out any attributes the ADQuery excludes
+            #pylint: disable=protected-access
+            attributes = object_class(self.adq)._default_attributes()
+            #pylint: enable=protected-access
+            for data in self.adq.iter_pages(base_dn, search_filter.format(clause), attributes):
+                rows = []
+                for distinguished_name, values in data:
+                    names = attribute_values(values, 'samaccountname')
+                    rows.append((sqlite3.Binary(attribute_values(values, 'objectguid')[0]),
+                                 distinguished_name, object_type,
+                                 names[0].lower() if names else None,
+                                 int(attribute_values(values, 'usnchanged')[0]),
+                                 sqlite3.Binary(pickle.dumps(values, 2))))
+                self.db.executemany('INSERT OR REPLACE INTO objects (guid, dn, object_type, '
+                                    'samaccountname, usn, attributes) VALUES (?, ?, ?, ?, ?, ?)',
+                                    rows)
+                count += len(rows)
+            logging.debug('%s - stored %s %s objects', self.__class__.__name__, count,
+                          object_type)
+
+
+    def _remove_departed(self, base_dn, usn):
+        """Remove objects that have been deleted, or moved out of base_dn, since
+        the last refresh.  Deleted objects are only returned with the show
+        deleted control, and both cases are found by searching the whole domain.
+
+        :param str base_dn: The base DN the snapshot mirrors
+        :param int usn: The uSNChanged of the last refresh
+        """
+        departed = []
+        for distinguished_name, values in self.adq.iter_search(
+                naming_context(base_dn), '(uSNChanged>={0})'.format(usn + 1),
+                ['objectGUID', 'isDeleted'], serverctrls=[LDAPControl(SHOW_DELETED_OID, True)]):
+            deleted = [value for value in attribute_values(values, 'isdeleted')
+                       if value.upper() == 'TRUE']
+            guids = attribute_values(values, 'objectguid')
+            if guids and (deleted or not is_beneath(distinguished_name, base_dn)):
+                departed.append((sqlite3.Binary(guids[0]),))
+
+        self.db.executemany('DELETE FROM objects WHERE guid = ?', departed)
+        logging.debug('%s - removed up to %s departed objects', self.__class__.__name__,
+                      len(departed))
+
+
+    def _graph(self):
+        """Build a group membership graph from the groups in the snapshot
+
+        :return: A populated group graph
+        :rtype: GroupGraph
+        """
+        graph = GroupGraph()
+        for distinguished_name, pickled in self.db.execute(
+                "SELECT dn, attributes FROM objects WHERE object_type = 'group' ORDER BY dn"):
+            graph.add_group(distinguished_name,
+                            attribute_values(pickle.loads(bytes(pickled)), 'member'))
+
+        return graph
+
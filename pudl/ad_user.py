@@ -15,7 +15,11 @@
 
 import logging
 
-from pudl.ad_object import ADObject
+from pudl.ad_membership import MEMBERSHIP_STRATEGY, membership_resolver
+from pudl.ad_object import ADObject, intern_values, is_loaded
+
+# Matches user objects, {0} is replaced with any further clauses
+USER_FILTER = '(&(objectClass=user)(!(objectClass=group))(!(objectClass=computer)){0})'
 
 class ADUser(ADObject):
     """A class to represent AD user objects.  Includes a number of
@@ -26,6 +30,10 @@ class ADUser(ADObject):
     on the results returned by the LDAP query.
     """
 
+    __slots__ = ()
+
+    object_class = 'user'
+
     # Some refactoring may be considered in the future that would
     # involve passing the sAMAccountName to a contstructor override,
     # and possibly moving users() to become static.  Otherwise,
@@ -35,7 +43,8 @@ class ADUser(ADObject):
 
 
 
-    def user(self, base_dn, samaccountname, attributes=(), explicit_membership_only=False):
+    def user(self, base_dn, samaccountname, attributes=(), explicit_membership_only=False,
+             membership_strategy=MEMBERSHIP_STRATEGY):
         """Produces a single, populated ADUser object through the object factory.
         Does not populate attributes for the caller instance.
 
@@ -44,13 +53,15 @@ class ADUser(ADObject):
         :param list attributes: Object attributes to populate, defaults to all
         :param bool explicit_membership_only: If set True, memberof will only
             list groups for which the user is a directly referenced member
+        :param str membership_strategy: How nested membership is expanded, see users()
 
         :return: A populated ADUser object
         :rtype: ADUser
         """
 
         users = self.users(base_dn, samaccountnames=[samaccountname],
-                           attributes=attributes, explicit_membership_only=explicit_membership_only)
+                           attributes=attributes, explicit_membership_only=explicit_membership_only,
+                           membership_strategy=membership_strategy, limit=1)
 
         try:
             # Usually we will find a match, but perhaps not always
@@ -60,7 +71,8 @@ class ADUser(ADObject):
 
 
 
-    def users(self, base_dn, samaccountnames=(), attributes=(), explicit_membership_only=False):
+    def users(self, base_dn, samaccountnames=(), attributes=(), explicit_membership_only=False,
+              membership_strategy=MEMBERSHIP_STRATEGY, extra_filter='', lazy=False, limit=0):
         """Gathers a list of ADUser objects
 
         :param str base_dn: The base DN to search within
@@ -69,45 +81,94 @@ class ADUser(ADObject):
             created, defaults to all users if unspecified
         :param bool explicit_membership_only: If set True, memberof will only
             list groups for which users are directly referenced members
+        :param str membership_strategy: How nested membership is expanded. *chain*
+            (the default) runs an LDAP_MATCHING_RULE_IN_CHAIN search per user, while
+            *graph* pulls every group's direct members in one paged scan and walks
+            the nesting in memory, which is far faster for large result sets
+        :param str extra_filter: Further LDAP filter clauses objects must match, ANDed
+            into the search filter, such as *(department=Eng*)*, see where_filter()
+        :param bool lazy: If set True, users are lazy objects created with only
+            LAZY_ATTRIBUTES and any attributes specified.  Other attributes are
+            read for all of the users the first time any of them is read, see LazyLoader
+        :param int limit: The maximum number of users to return, defaults to 0 for all,
+            the search is abandoned once enough have arrived
 
         :return: A list of populated ADUser objects
         :rtype: list
         """
-        ad_users = []
-
-        search_filter = '(&(objectClass=user)(!(objectClass=group))(!(objectClass=computer)){0})'
-        # If no samaccountnames specified, filter will pull all user objects under
-        # base_dn
-        if not samaccountnames:
-            search_filter = search_filter.format('(sAMAccountName=*)')
-        else:
-            # Extensible filter: http://bit.ly/1Qh4eyV
-            if len(samaccountnames) == 1:
-                account_names = '(sAMAccountName={0})'.format(samaccountnames[0])
-            else:
-                account_names = '(|{0})'.format(''.join(['(sAMAccountName={0})'.format(username) \
-                                                for username in samaccountnames]))
-
-            search_filter = search_filter.format(account_names)
-
-
-        logging.debug('%s Search filter: %s', self.__class__.__name__, search_filter)
-
-        results = self.adq.search(base_dn, search_filter, attributes)
+        return list(self.iter_users(base_dn, samaccountnames=samaccountnames,
+                                    attributes=attributes,
+                                    explicit_membership_only=explicit_membership_only,
+                                    membership_strategy=membership_strategy,
+                                    extra_filter=extra_filter, lazy=lazy, limit=limit))
 
-        for search_result in results:
-            adu = self._object_factory(search_result)
-            # Each results index 0 of the tuple is the DN
-            if not explicit_membership_only and 'memberof' in dir(adu):
-                memberof = [g[0] for g in self.adq.search(base_dn,
-                                                          '(member:1.2.840.113556.1.4.1941:={0})'.\
-                                                          format(search_result[0]),
-                                                          attributes=['memberof'])]
-                adu.memberof = memberof
-            ad_users.append(adu)
 
+    def iter_users(self, base_dn, samaccountnames=(), attributes=(),
+                   explicit_membership_only=False, membership_strategy=MEMBERSHIP_STRATEGY,
+                   extra_filter='', lazy=False, limit=0):
+        """Generates ADUser objects as each page of search results arrives,
+        rather than gathering every user before returning
 
-        return ad_users
+        :param str base_dn: The base DN to search within
+        :param list attributes: Object attributes to populate, defaults to all
+        :param list samaccountnames: A list of usernames for which objects will be
+            created, defaults to all users if unspecified
+        :param bool explicit_membership_only: If set True, memberof will only
+            list groups for which users are directly referenced members
+        :param str membership_strategy: How nested membership is expanded. *chain*
+            (the default) runs an LDAP_MATCHING_RULE_IN_CHAIN search per user, while
+            *graph* pulls every group's direct members in one paged scan and walks
+            the nesting in memory, which is far faster for large result sets
+        :param str extra_filter: Further LDAP filter clauses objects must match, ANDed
+            into the search filter, such as *(department=Eng*)*, see where_filter()
+        :param bool lazy: If set True, users are lazy objects created with only
+            LAZY_ATTRIBUTES and any attributes specified.  Other attributes are
+            read for all users generated so far and still in use the first time
+            any of them is read, see LazyLoader
+        :param int limit: The maximum number of users to return, defaults to 0 for all,
+            the search is abandoned once enough have arrived
+
+        :return: A generator of populated ADUser objects
+        :rtype: generator
+        """
+        search_filter = USER_FILTER
+        resolver = membership_resolver(membership_strategy, self.adq, base_dn)
+        table = self._intern_table()
+        layout = self._record_layout()
+
+        def expand(name, users):
+            """Expand nested membership when memberof is loaded lazily"""
+            if name == 'memberof' and not explicit_membership_only:
+                self._expand_memberof(resolver, users, table)
+
+        loader = None
+        if lazy:
+            loader, attributes = self._lazy_loader(attributes, expand)
+
+        for data in self._iter_search_pages(base_dn, search_filter, samaccountnames,
+                                            attributes, extra_filter, limit):
+            ad_users = self._objects_factory(data, loader, table, layout)
+            # Each results index 0 of the tuple is the DN.  Membership for a page
+            # of users is expanded together, so the searches may overlap
+            if not explicit_membership_only:
+                self._expand_memberof(resolver, [(adu, search_result[0]) for adu, search_result
+                                                 in zip(ad_users, data)
+                                                 if is_loaded(adu, 'memberof')], table)
+            for adu in ad_users:
+                yield adu
+
+
+    @staticmethod
+    def _expand_memberof(resolver, users, table=None):
+        """Replace the memberof values of users with their nested membership
+
+        :param resolver: A resolver returned by membership_resolver()
+        :param list users: (ADUser, DN) tuples
+        :param dict table: If provided, the group DNs are interned in this table
+        """
+        memberships = resolver.memberships([dn for _, dn in users])
+        for adu, distinguished_name in users:
+            adu.memberof = intern_values(table, memberships[distinguished_name])
 
 
     def is_member(self, group_distinguishedname):
@@ -145,12 +206,46 @@ class ADUser(ADObject):
             current ADUser instance is a member, sAMAccountNames
         :rtype: list
         """
-        #pylint: disable=no-member
-        mappings = self.samaccountnames(base_dn, self.memberof)
-        #pylint: enable=no-member
-        groups = [samaccountname for samaccountname in mappings.values()]
-        if not groups:
-            logging.info("%s - unable to retrieve any groups for the current ADUser instance",
-                         self.samaccountname)
-        return groups
+        return self.group_samaccountnames_for(base_dn, [self])[0]
+
+
+    def group_samaccountnames_for(self, base_dn, users):
+        """Determine the group sAMAccountNames for many ADUser instances at once.
+        The union of all of the users' group DistinguishedNames is resolved together,
+        rather than once per user.
+
+        :param str base_dn: The base DN to search within
+        :param list users: ADUser instances, populated with memberof
+
+        :return: A list of group sAMAccountName lists, in the same order as users
+        :rtype: list
+        """
+        memberships = [_memberof(adu) for adu in users]
+        mappings = self.samaccountnames(base_dn, list(set(dn for memberof in memberships
+                                                          for dn in memberof)))
+
+        user_groups = []
+        for adu, memberof in zip(users, memberships):
+            groups = [mappings[dn] for dn in memberof if dn in mappings]
+            if not groups:
+                logging.info("%s - unable to retrieve any groups for the current ADUser instance",
+                             getattr(adu, 'samaccountname', None))
+            user_groups.append(groups)
+
+        return user_groups
+
+
+def _memberof(adu):
+    """The memberof values of an ADUser as a list, as a single group
+    may have been populated as a string
+
+    :param ADUser adu: An ADUser instance
+
+    :return: A list of group DistinguishedNames
+    :rtype: list
+    """
+    memberof = getattr(adu, 'memberof', [])
+    if isinstance(memberof, list):
+        return memberof
 
+    return [memberof]
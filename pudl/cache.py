@@ -0,0 +1,86 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""cache - in-process caching of directory lookups"""
+
+import collections
+import threading
+import time
+
+# The maximum number of entries held, and how long in seconds each remains valid
+CACHE_SIZE = 100000
+CACHE_TTL = 900
+
+
+class TTLCache(object):
+    """A thread-safe, least recently used cache whose entries also expire after
+    a fixed time to live
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        """TTLCache constructor
+
+        :param int maxsize: The maximum number of entries, the least recently used
+            are evicted first, defaults to *{0}*
+        :param int ttl: Seconds before an entry expires, defaults to *{1}*
+        """.format(CACHE_SIZE, CACHE_TTL)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Key to a tuple of expiry time and value, least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        """Retrieve a value, if present and not expired
+
+        :param key: The key to look up
+        :param default: The value returned on a miss, defaults to None
+
+        :return: The cached value or default
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                return default
+            if expires < time.time():
+                return default
+            # Re-insert to mark the entry as the most recently used
+            self._entries[key] = (expires, value)
+
+        return value
+
+
+    def set(self, key, value):
+        """Add or replace a value, evicting the least recently used entries
+        if the cache is full
+
+        :param key: The key to store the value under
+        :param value: The value
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+
+    def __len__(self):
+        return len(self._entries)
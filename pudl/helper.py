@@ -13,43 +13,358 @@
 # limitations under the License.
 """helper - a module containing a collection useful object manipulations"""
 
+import csv
+import itertools
 import json
+import logging
+import multiprocessing
 import re
+import struct
+import uuid
 import yaml
 
-def object_filter(objects, grep):
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+# Output formats with a fixed set of columns, parquet and arrow require pyarrow
+COLUMNAR_FORMATS = ('csv', 'parquet', 'arrow')
+
+# Supported output formats.  ndjson writes one JSON object per line, and
+# yaml-stream one YAML document per object
+OUTPUT_FORMATS = ('json', 'yaml', 'ndjson', 'yaml-stream') + COLUMNAR_FORMATS
+
+# Output formats written as bytes rather than text
+BINARY_FORMATS = ('parquet', 'arrow')
+
+# The number of objects written at a time, as a record batch, by the columnar formats
+BATCH_SIZE = 1000
+
+# Characters that make a grep pattern a regular expression rather than a literal
+GREP_METACHARACTERS = '.^$*+?{}[]\\|()'
+
+# An attribute comparison for --where, such as department=Eng*
+WHERE_EXPRESSION = re.compile(r'^\s*([A-Za-z][A-Za-z0-9-]*)\s*(!=|>=|<=|=)(.+)$')
+
+# The number of objects handed to worker processes at a time, when grep uses them
+GREP_CHUNK_SIZE = 10000
+
+# Attribute values that grep patterns are matched against
+STRING_TYPES = (str, type(u''))
+
+# The ObjectFilter used by a grep worker process
+_WORKER_FILTER = None
+
+# The libyaml emitter when available, many times faster than the pure python
+# one and producing identical output
+YAML_DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+
+def attribute_values(attributes, name):
+    """Retrieve the values of an attribute from a search result's attributes,
+    regardless of the case of the attribute name returned by the server
+
+    :param dict attributes: The attributes of a single search result
+    :param str name: The lowercase attribute name
+
+    :return: A list of values, empty if the attribute is not present
+    :rtype: list
+    """
+    for key, values in attributes.items():
+        if key.lower() == name:
+            return values
+
+    return []
+
+
+def is_beneath(distinguished_name, base_dn):
+    """Determine whether a DN is at or beneath a base DN
+
+    :param str distinguished_name: The DN to check
+    :param str base_dn: The base DN
+
+    :return: True if the DN is within the base DN
+    :rtype: bool
+    """
+    distinguished_name = distinguished_name.lower()
+    base_dn = base_dn.lower()
+
+    return distinguished_name == base_dn or distinguished_name.endswith(',' + base_dn)
+
+
+def sid_string(value):
+    """Convert a binary security identifier, such as an objectSid value, to its
+    string form, such as *S-1-5-21-1004336348-1177238915-682003330-512*.  Lists
+    are converted item by item, and values already in string form are returned
+    unchanged.
+
+    :param value: A binary SID, or a list of them
+
+    :return: The SID string, or a list of them, values that are not a valid
+        binary SID are returned unchanged
+    """
+    if isinstance(value, list):
+        return [sid_string(item) for item in value]
+    data = bytearray(value) if not isinstance(value, type(u'')) else None
+    if data is None or len(data) < 8 or len(data) != 8 + 4 * data[1]:
+        return value
+
+    authority = struct.unpack('>Q', b'\x00\x00' + bytes(data[2:8]))[0]
+    sub_authorities = struct.unpack('<{0}I'.format(data[1]), bytes(data[8:8 + 4 * data[1]]))
+
+    return 'S-{0}-{1}'.format(data[0], '-'.join(str(part) for part in
+                                                (authority,) + sub_authorities))
+
+
+def guid_string(value):
+    """Convert a binary GUID, such as an objectGUID value, to its string form,
+    such as *8e5f0b4d-3a7c-4c1e-9f0a-2b6d1c3e4f50*.  Lists are converted item by
+    item, and values already in string form are returned unchanged.
+
+    :param value: A binary GUID, or a list of them
+
+    :return: The GUID string, or a list of them
+    """
+    if isinstance(value, list):
+        return [guid_string(item) for item in value]
+    if isinstance(value, type(u'')) or len(value) != 16:
+        return value
+
+    # AD stores the first three fields little-endian
+    return str(uuid.UUID(bytes_le=bytes(value)))
+
+
+def parse_where(expression):
+    r"""Parse an attribute comparison, as accepted by where_filter() and ObjectFilter.
+    The operator is one of =, !=, >= or <=, and values compared with = or != may
+    include * wildcards, as in LDAP filters.
+
+    :param str expression: The comparison, such as *department=Eng** or
+        *title!=\*manager\**
+
+    :return: A tuple of the lowercase attribute name, operator and value
+    :rtype: tuple
+    """
+    match = WHERE_EXPRESSION.match(expression)
+    if match is None:
+        raise ValueError('Expected attribute=value, attribute!=value, attribute>=value or '
+                         'attribute<=value, got: {0}'.format(expression))
+
+    return match.group(1).lower(), match.group(2), match.group(3)
+
+
+def object_filter(objects, grep, attribute_grep=(), processes=None):
     """Filter out any objects that do not have attributes with values matching
     *all* regular expressions present in grep (AND, essentially)
 
     :param objects ADObject: A list of ADObjects
     :param grep list: A list of regular expressions that must match for filtering
+    :param attribute_grep list: A list of *attribute=regex* expressions, that must
+        match a value of the named attribute
+    :param processes int: Match in this many worker processes, see iter_filter()
 
     :return: A list of filtered ADObjects
     :rtype: list
     """
-    filtered = []
-    if grep:
+    if grep or attribute_grep:
+        return list(iter_filter(objects, grep, attribute_grep, processes))
+    else:
+        return objects
+
+
+def iter_filter(objects, grep, attribute_grep=(), processes=None, where=()):
+    """Lazily filter objects as object_filter() does, so only one object, or one
+    chunk of GREP_CHUNK_SIZE objects when matching in worker processes, is held at a
+    time.  The patterns are compiled once, see ObjectFilter.
+
+    :param objects iterable: ADObjects, or dictionaries of their attributes
+    :param grep list: A list of regular expressions that must match for filtering
+    :param attribute_grep list: A list of *attribute=regex* expressions, that must
+        match a value of the named attribute
+    :param processes int: If greater than one, objects are matched in a pool of
+        this many worker processes.  Objects are copied to the workers, so this
+        only pays off when matching is expensive, such as many complex patterns
+    :param where list: Attribute comparisons that must hold, see parse_where()
+
+    :return: A generator of the matching objects
+    :rtype: generator
+    """
+    matcher = ObjectFilter(grep, attribute_grep, where)
+    if not matcher.tests and not matcher.conditions:
         for ad_object in objects:
-            o_string = ' '.join([value for value in ad_object.to_dict().values()
-                                 if isinstance(value, str)])
-            skip = False
-            for regex in grep:
-                if not re.search(regex, o_string, re.M|re.S|re.I):
-                    skip = True
+            yield ad_object
+    elif processes is not None and processes > 1:
+        pool = multiprocessing.Pool(processes, _init_worker, (matcher,))
+        try:
+            objects = iter(objects)
+            while True:
+                chunk = list(itertools.islice(objects, GREP_CHUNK_SIZE))
+                if not chunk:
                     break
-            if not skip:
-                filtered.append(ad_object)
-
-        return filtered
+                matches = pool.map(_worker_match, [_to_dict(ad_object) for ad_object in chunk])
+                for ad_object, matched in zip(chunk, matches):
+                    if matched:
+                        yield ad_object
+        finally:
+            pool.terminate()
     else:
-        return objects
+        for ad_object in objects:
+            if matcher(ad_object):
+                yield ad_object
+
+
+class ObjectFilter(object):
+    """Compiled grep patterns, callable with an ADObject or dictionary of its
+    attributes to determine whether every pattern matches.
+
+    Plain patterns are matched against all of an object's string values,
+    including each value of multi-valued attributes, joined by spaces.
+    *attribute=regex* patterns must match at least one value of the named
+    attribute.  Matching is case insensitive, and patterns are tried cheapest
+    first: targeted before untargeted, and patterns without regular expression
+    syntax by substring search.
+
+    Attribute comparisons, as parsed by parse_where(), are evaluated first, the
+    way the server would evaluate them in a search filter.
+    """
+
+    def __init__(self, grep=(), attribute_grep=(), where=()):
+        """ObjectFilter constructor
+
+        :param list grep: Regular expressions matched against all values
+        :param list attribute_grep: *attribute=regex* expressions
+        :param list where: Attribute comparisons, such as *department=Eng**
+        """
+        # Each condition is a tuple of lowercase attribute name, operator, value and,
+        # for = and !=, a compiled regular expression equivalent to the wildcard value
+        self.conditions = []
+        for expression in where or ():
+            name, operator, value = parse_where(expression)
+            regex = None
+            if operator in ('=', '!='):
+                regex = re.compile('^' + '.*'.join([re.escape(part) for part in value.split('*')])
+                                   + '$', re.S|re.I)
+            self.conditions.append((name, operator, value, regex))
+
+        tests = [_grep_test(None, pattern) for pattern in grep or ()]
+        for expression in attribute_grep or ():
+            name, separator, pattern = expression.partition('=')
+            if not separator or not name:
+                raise ValueError('Expected attribute=regex, got: {0}'.format(expression))
+            tests.append(_grep_test(name.lower(), pattern))
+        # Each test is a tuple of cost, lowercase attribute name or None, and either
+        # a lowercase literal or a compiled regular expression
+        self.tests = sorted(tests, key=lambda test: test[0])
+
+
+    def __call__(self, ad_object):
+        values = _to_dict(ad_object)
+        for name, operator, value, regex in self.conditions:
+            candidates = _strings([values.get(name)])
+            if operator == '=':
+                if not any(regex.search(candidate) for candidate in candidates):
+                    return False
+            elif operator == '!=':
+                if any(regex.search(candidate) for candidate in candidates):
+                    return False
+            elif not any(_compare(candidate, value, operator) for candidate in candidates):
+                return False
+
+        # All values joined, and its lowercase form, are built on first use
+        joined = lowered = None
+        for _, name, literal, regex in self.tests:
+            if name is None:
+                if joined is None:
+                    joined = ' '.join(_strings(values.values()))
+                if literal is not None:
+                    if lowered is None:
+                        lowered = joined.lower()
+                    if literal not in lowered:
+                        return False
+                elif not regex.search(joined):
+                    return False
+            else:
+                candidates = _strings([values.get(name)])
+                if literal is not None:
+                    if not any(literal in candidate.lower() for candidate in candidates):
+                        return False
+                elif not any(regex.search(candidate) for candidate in candidates):
+                    return False
+
+        return True
+
+
+def _grep_test(name, pattern):
+    """Compile a grep pattern into a test for ObjectFilter
+
+    :param str name: The lowercase attribute name to match, or None for all
+    :param str pattern: The regular expression
+
+    :return: A tuple of cost, name, lowercase literal or None, and compiled regex or None
+    :rtype: tuple
+    """
+    cost = 0 if name is not None else 2
+    if not set(pattern) & set(GREP_METACHARACTERS):
+        return (cost, name, pattern.lower(), None)
+
+    return (cost + 1, name, None, re.compile(pattern, re.M|re.S|re.I))
+
+
+def _compare(candidate, value, operator):
+    """Compare an attribute value for >= or <=, as integers when both are numeric,
+    otherwise as case insensitive strings
+
+    :param str candidate: The attribute value
+    :param str value: The value compared against
+    :param str operator: *>=* or *<=*
+
+    :return: Whether the comparison holds
+    :rtype: bool
+    """
+    try:
+        candidate, value = int(candidate), int(value)
+    except ValueError:
+        candidate, value = candidate.lower(), value.lower()
+
+    return candidate >= value if operator == '>=' else candidate <= value
+
+
+def _strings(values):
+    """Every string in a list of attribute values, including the members of lists
+
+    :param values iterable: Attribute values, strings or lists
+
+    :return: A list of strings
+    :rtype: list
+    """
+    strings = []
+    for value in values:
+        if isinstance(value, list):
+            strings += [item for item in value if isinstance(item, STRING_TYPES)]
+        elif isinstance(value, STRING_TYPES):
+            strings.append(value)
+
+    return strings
+
+
+def _init_worker(matcher):
+    """Set the ObjectFilter used by a worker process"""
+    global _WORKER_FILTER  #pylint: disable=global-statement
+    _WORKER_FILTER = matcher
+
+
+def _worker_match(values):
+    """Match a dictionary of attributes in a worker process"""
+    return _WORKER_FILTER(values)
 
 
 def serialize(ad_objects, output_format='json', indent=2, attributes_only=False):
     """Serialize the object to the specified format
 
-    :param ad_objects list: A list of ADObjects to serialize
-    :param output_format str: The output format, json or yaml.  Defaults to json
+    :param ad_objects list: A list of ADObjects, or of dictionaries such as those
+        returned by ADObject.to_dict(), to serialize.  ADObjects are converted by the
+        serializer as it reaches them, with no intermediate list of dictionaries
+    :param output_format str: The output format, one of OUTPUT_FORMATS.  Defaults to json
     :param indent int: The number of spaces to indent, defaults to 2
     :param attributes only: Only serialize the attributes found in the first record of the list
         of ADObjects
@@ -62,12 +377,242 @@ def serialize(ad_objects, output_format='json', indent=2, attributes_only=False)
     # in the query, overwrite ad_objects with only those attributes present in
     # the first object in the list
     if attributes_only:
-        ad_objects = [key for key in sorted(ad_objects[0].keys())]
+        ad_objects = [key for key in sorted(_to_dict(ad_objects[0]).keys())]
 
     if output_format == 'json':
-        return json.dumps(ad_objects, indent=indent, ensure_ascii=False, sort_keys=True)
+        return json.dumps(ad_objects, indent=indent, ensure_ascii=False, sort_keys=True,
+                          default=_json_default)
     elif output_format == 'yaml':
-        return yaml.dump(sorted(ad_objects), indent=indent)
+        return yaml.dump(sorted([_to_dict(ad_object) for ad_object in ad_objects]),
+                         indent=indent, Dumper=YAML_DUMPER)
+    elif output_format in BINARY_FORMATS:
+        raise ValueError('{0} output is binary, use dump() to write it to a file'.\
+                         format(output_format))
+    else:
+        buf = StringIO()
+        dump(ad_objects, buf, output_format=output_format, indent=indent)
+        return buf.getvalue().rstrip('\n')
+
 
+def dump(ad_objects, stream, output_format='json', indent=2, columns=None):
+    """Serialize objects to a stream as they are generated, rather than
+    gathering them first.  The stream is flushed after each object, or each
+    batch of BATCH_SIZE objects for the columnar formats, so output starts
+    immediately and memory use does not grow with the number of objects.
+    The output matches serialize(), except YAML output is not sorted.
+
+    :param ad_objects iterable: ADObjects, or dictionaries of their attributes
+    :param stream file: A file-like object to write to, such as sys.stdout.  Must
+        accept bytes for the BINARY_FORMATS
+    :param output_format str: The output format, one of OUTPUT_FORMATS.  Defaults to json
+    :param indent int: The number of spaces to indent, defaults to 2
+    :param columns list: Attribute names to write as columns in the COLUMNAR_FORMATS,
+        defaults to every attribute present in the first batch of objects
+    """
+    if output_format in COLUMNAR_FORMATS:
+        return _dump_columnar(ad_objects, stream, output_format, columns)
+
+    flush = getattr(stream, 'flush', lambda: None)
+    if output_format == 'json':
+        encoder = json.JSONEncoder(indent=indent, ensure_ascii=False, sort_keys=True,
+                                   default=_json_default)
+        separator = '['
+        for ad_object in ad_objects:
+            stream.write(separator + '\n' + ' ' * indent +
+                         encoder.encode(_to_dict(ad_object)).replace('\n', '\n' + ' ' * indent))
+            flush()
+            separator = encoder.item_separator
+        stream.write('[]\n' if separator == '[' else '\n]\n')
+    elif output_format == 'yaml':
+        empty = True
+        for ad_object in ad_objects:
+            # Each item is dumped as a list of one, together forming a single list
+            stream.write(yaml.dump([_to_dict(ad_object)], indent=indent, Dumper=YAML_DUMPER))
+            flush()
+            empty = False
+        if empty:
+            stream.write(yaml.dump([], indent=indent, Dumper=YAML_DUMPER))
+    elif output_format == 'ndjson':
+        encoder = json.JSONEncoder(ensure_ascii=False, sort_keys=True, default=_json_default)
+        for ad_object in ad_objects:
+            stream.write(encoder.encode(_to_dict(ad_object)) + '\n')
+            flush()
+    elif output_format == 'yaml-stream':
+        for ad_object in ad_objects:
+            stream.write(yaml.dump(_to_dict(ad_object), indent=indent, explicit_start=True,
+                                   Dumper=YAML_DUMPER))
+            flush()
+    else:
+        raise ValueError('Unknown output format: {0}, expected one of {1}'.\
+                         format(output_format, ', '.join(OUTPUT_FORMATS)))
+    flush()
+
+
+def _dump_columnar(ad_objects, stream, output_format, columns):
+    """Write objects as CSV, Parquet or an Arrow IPC stream, a batch at a time.
+    Multi-valued attributes become JSON encoded lists in CSV, and list columns
+    in Parquet and Arrow.  A column is a list column if any of its values in the
+    first batch is a list.  Attributes without a column are left out, with a warning.
+
+    :param ad_objects iterable: ADObjects, or dictionaries of their attributes
+    :param stream file: A file-like object to write to
+    :param output_format str: One of COLUMNAR_FORMATS
+    :param list columns: Attribute names to write, defaults to every attribute
+        present in the first batch
+    """
+    flush = getattr(stream, 'flush', lambda: None)
+    batches = _batches(ad_objects)
+    first = next(batches, [])
+    if columns:
+        names = [column.lower() for column in columns]
+    else:
+        names = sorted(set(key for row in first for key in row))
+    if not names:
+        return
+
+    if output_format == 'csv':
+        writer = _CSVWriter(stream, names)
+    else:
+        writer = _ArrowWriter(stream, output_format, names, first)
+    dropped = set()
+    for batch in itertools.chain([first], batches):
+        missing = set(key for row in batch for key in row) - set(names) - dropped
+        if missing and columns:
+            logging.warning('Attributes not among the columns are not written: %s',
+                            ', '.join(sorted(missing)))
+        elif missing:
+            logging.warning('Attributes not present in the first %s objects are not written: %s',
+                            BATCH_SIZE, ', '.join(sorted(missing)))
+        dropped.update(missing)
+        writer.write(batch)
+        flush()
+    writer.close()
 
 
+def _batches(ad_objects):
+    """Split objects into lists of up to BATCH_SIZE dictionaries
+
+    :param ad_objects iterable: ADObjects, or dictionaries of their attributes
+
+    :return: A generator of lists of dictionaries
+    :rtype: generator
+    """
+    ad_objects = iter(ad_objects)
+    while True:
+        batch = [_to_dict(ad_object) for ad_object in itertools.islice(ad_objects, BATCH_SIZE)]
+        if not batch:
+            return
+        yield batch
+
+
+class _CSVWriter(object):
+    """Writes batches of objects as CSV rows, with a header row of column names.
+    Lists are JSON encoded and absent attributes are left empty.
+    """
+
+    def __init__(self, stream, names):
+        self.writer = csv.writer(stream)
+        self.names = names
+        self.writer.writerow(names)
+
+
+    def write(self, batch):
+        """Write a batch of objects, as dictionaries"""
+        self.writer.writerows([[_csv_value(row.get(name)) for name in self.names]
+                               for row in batch])
+
+
+    def close(self):
+        """Finish the output, nothing further is written for CSV"""
+        pass
+
+
+def _csv_value(value):
+    """Encode an attribute value for a CSV cell"""
+    if value is None:
+        return ''
+    elif isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False)
+
+    return value
+
+
+class _ArrowWriter(object):
+    """Writes batches of objects as Parquet or an Arrow IPC stream, with a schema
+    of string and list of string columns inferred from the first batch
+    """
+
+    def __init__(self, stream, output_format, names, batch):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('{0} output requires pyarrow, try: pip install pyarrow'.\
+                              format(output_format))
+
+        self.pyarrow = pyarrow
+        self.names = names
+        self.list_columns = set(name for name in names
+                                if any(isinstance(row.get(name), list) for row in batch))
+        self.types = [pyarrow.list_(pyarrow.string()) if name in self.list_columns
+                      else pyarrow.string() for name in names]
+        schema = pyarrow.schema([pyarrow.field(name, column_type)
+                                 for name, column_type in zip(names, self.types)])
+        self.parquet = output_format == 'parquet'
+        if self.parquet:
+            self.writer = pyarrow.parquet.ParquetWriter(stream, schema)
+        else:
+            self.writer = pyarrow.RecordBatchStreamWriter(stream, schema)
+
+
+    def write(self, batch):
+        """Write a batch of objects, as dictionaries"""
+        if not batch:
+            return
+        arrays = []
+        for name, column_type in zip(self.names, self.types):
+            values = [row.get(name) for row in batch]
+            if name in self.list_columns:
+                values = [value if value is None or isinstance(value, list) else [value]
+                          for value in values]
+            else:
+                # Lists in a column that only held single values in the first batch
+                values = [json.dumps(value, ensure_ascii=False) if isinstance(value, list)
+                          else value for value in values]
+            arrays.append(self.pyarrow.array(values, type=column_type))
+        record_batch = self.pyarrow.RecordBatch.from_arrays(arrays, self.names)
+        if self.parquet:
+            self.writer.write_table(self.pyarrow.Table.from_batches([record_batch]))
+        else:
+            self.writer.write_batch(record_batch)
+
+
+    def close(self):
+        """Finish the output"""
+        self.writer.close()
+
+
+def _to_dict(ad_object):
+    """Convert an ADObject to a dictionary for serialization, anything else is
+    passed through unchanged
+
+    :param ad_object: An ADObject, or a value that is already serializable
+
+    :return: A dictionary of the object's attributes, or the value
+    """
+    return ad_object.to_dict() if hasattr(ad_object, 'to_dict') else ad_object
+
+
+def _json_default(ad_object):
+    """The JSON encoder's fallback for values it cannot serialize itself,
+    converting ADObjects to dictionaries
+
+    :param ad_object: An ADObject
+
+    :return: A dictionary of the object's attributes
+    :rtype: dict
+    """
+    if hasattr(ad_object, 'to_dict'):
+        return ad_object.to_dict()
+
+    raise TypeError('{0!r} is not JSON serializable'.format(ad_object))
@@ -19,22 +19,42 @@ from __future__ import print_function
 
 import argparse
 import getpass
+import itertools
 import logging
 import os
 import sys
 
 from pudl import __version__ as pudl_version
-from pudl.ad_computer import ADComputer
-from pudl.ad_group import ADGroup
-from pudl.ad_query import ADQuery
-from pudl.ad_user import ADUser
-from pudl.helper import object_filter, serialize
+from pudl.ad_computer import ADComputer, COMPUTER_FILTER
+from pudl.ad_group import ADGroup, GROUP_FILTER
+from pudl.ad_membership import MEMBERSHIP_STRATEGIES, MEMBERSHIP_STRATEGY
+from pudl.ad_object import flatten, where_filter
+from pudl.ad_query import ADQuery, EXCLUDE_ATTRIBUTES
+from pudl.ad_schema import ADSchema, SCHEMA_FILE
+from pudl.ad_snapshot import ADSnapshot, SNAPSHOT_FILE
+from pudl.ad_user import ADUser, USER_FILTER
+from pudl.helper import BINARY_FORMATS, COLUMNAR_FORMATS, OUTPUT_FORMATS, dump, iter_filter, \
+    parse_where, serialize
+
+# The search filter for each sub-command, used by raw exports
+SEARCH_FILTERS = {'user': USER_FILTER, 'group': GROUP_FILTER, 'computer': COMPUTER_FILTER}
+
+# The object class of each sub-command, used by raw exports
+FINDERS = {'user': ADUser, 'group': ADGroup, 'computer': ADComputer}
+
+# The attribute each sub-command expands nested membership into, which the server
+# only holds explicit values for
+NESTED_ATTRIBUTES = {'user': 'memberof', 'group': 'member'}
 
 
 def main():
     """Do some stuff"""
     # Parse all command line argument
-    args = parse_arguments().parse_args()
+    parser = parse_arguments()
+    args = parser.parse_args()
+    # Sub-commands are optional in python 3
+    if args.subcommand not in FINDERS:
+        parser.error('a sub-command is required: {0}'.format(', '.join(sorted(FINDERS))))
 
     # Setup logging
     configure_logging(args)
@@ -49,31 +69,165 @@ def main():
     # Create an instance of ADQuery which sets up a single
     # connection used for querying, for all AD object types
     ldap_url = 'ldap://{0}:{1}'.format(args.host, args.port)
+    exclude_attributes = EXCLUDE_ATTRIBUTES + tuple(args.exclude_attributes or ())
     adq = ADQuery(user=args.user, password=password, page_size=args.page_size,
-                  ldap_url=ldap_url, tls_no_verify=args.tls_no_verify)
-    if args.subcommand == 'user':
-        adu = ADUser(adq)
-        users = adu.users(base_dn=args.base_dn, attributes=args.attributes,
-                          samaccountnames=args.samaccountnames,
-                          explicit_membership_only=args.explicit_membership_only)
-        users = object_filter(users, args.grep)
-        print(serialize([u.to_dict() for u in users],
-                        output_format=args.output_format, attributes_only=args.attributes_only))
+                  ldap_url=ldap_url, tls_no_verify=args.tls_no_verify,
+                  exclude_attributes=exclude_attributes)
+    # Type attributes by the schema, and reject unknown attribute names before searching
+    if not args.no_schema:
+        adq.schema = ADSchema(adq, path=args.schema_file).load()
+        try:
+            adq.schema.validate((args.attributes or []) + (args.exclude_attributes or []) +
+                                [parse_where(expression)[0] for expression in args.where or ()])
+        except ValueError as err:
+            parser.error(str(err))
+
+    # Optionally answer from a local snapshot, refreshed with any changes first
+    if args.cached:
+        snapshot = ADSnapshot(adq, path=args.snapshot_file)
+        snapshot.refresh(args.base_dn)
+
+    # --where comparisons are added to the search filter where possible
+    server_where, local_where = split_where(args)
+    extra_filter = where_filter(server_where)
+    # Attributes only compared locally are fetched too, and dropped once matched
+    hidden = []
+    if args.attributes and local_where:
+        requested = set(attribute.lower() for attribute in args.attributes)
+        hidden = sorted(set(parse_where(expression)[0] for expression in local_where) -
+                        requested)
+    attributes = args.attributes + hidden if hidden else args.attributes
+    # Without the schema the attributes to fetch can't be narrowed, so excluded
+    # attributes are fetched and dropped instead
+    if args.no_schema and not args.attributes:
+        hidden = sorted(set(name.lower() for name in exclude_attributes))
+
+    # Raw exports stream search results straight to the output, one at a time
+    if args.raw:
+        if args.cached:
+            entries = snapshot.entries(args.subcommand, args.base_dn,
+                                       samaccountnames=args.samaccountnames,
+                                       attributes=attributes)
+        else:
+            finder = FINDERS[args.subcommand](adq)
+            entries = finder.iter_entries(args.base_dn, SEARCH_FILTERS[args.subcommand],
+                                          samaccountnames=args.samaccountnames,
+                                          attributes=attributes, extra_filter=extra_filter)
+        objects = (flatten(values, adq.schema) for _, values in entries)
+    elif args.subcommand == 'user':
+        if args.cached:
+            objects = snapshot.users(base_dn=args.base_dn, attributes=attributes,
+                                     samaccountnames=args.samaccountnames,
+                                     explicit_membership_only=args.explicit_membership_only)
+        else:
+            adu = ADUser(adq)
+            objects = adu.iter_users(base_dn=args.base_dn, attributes=attributes,
+                                     samaccountnames=args.samaccountnames,
+                                     explicit_membership_only=args.explicit_membership_only,
+                                     membership_strategy=args.membership_strategy,
+                                     extra_filter=extra_filter)
     elif args.subcommand == 'group':
-        adg = ADGroup(adq)
-        groups = adg.groups(base_dn=args.base_dn, attributes=args.attributes,
-                            samaccountnames=args.samaccountnames,
-                            explicit_membership_only=args.explicit_membership_only)
-        groups = object_filter(groups, args.grep)
-        print(serialize([g.to_dict() for g in groups],
-                        output_format=args.output_format, attributes_only=args.attributes_only))
-    elif args.subcommand == 'computer':
-        adg = ADComputer(adq)
-        computers = adg.computers(base_dn=args.base_dn, attributes=args.attributes,
-                                  samaccountnames=args.samaccountnames)
-        computers = object_filter(computers, args.grep)
-        print(serialize([c.to_dict() for c in computers],
-                        output_format=args.output_format, attributes_only=args.attributes_only))
+        if args.cached:
+            objects = snapshot.groups(base_dn=args.base_dn, attributes=attributes,
+                                      samaccountnames=args.samaccountnames,
+                                      explicit_membership_only=args.explicit_membership_only)
+        else:
+            adg = ADGroup(adq)
+            objects = adg.iter_groups(base_dn=args.base_dn, attributes=attributes,
+                                      samaccountnames=args.samaccountnames,
+                                      explicit_membership_only=args.explicit_membership_only,
+                                      extra_filter=extra_filter)
+    else:
+        if args.cached:
+            objects = snapshot.computers(base_dn=args.base_dn, attributes=attributes,
+                                         samaccountnames=args.samaccountnames)
+        else:
+            adg = ADComputer(adq)
+            objects = adg.iter_computers(base_dn=args.base_dn, attributes=attributes,
+                                         samaccountnames=args.samaccountnames,
+                                         extra_filter=extra_filter)
+
+    objects = iter_filter(objects, args.grep, args.attribute_grep, args.grep_processes,
+                          where=local_where)
+    output(drop_attributes(objects, hidden), args, columns=output_columns(args, adq))
+
+
+def split_where(args):
+    """Split --where comparisons into those the server can evaluate in the search
+    filter, and those that must be matched locally: every comparison when reading
+    from a snapshot, and comparisons against expanded nested membership
+
+    :return: A tuple of two lists of comparisons, for the server and for local matching
+    :rtype: tuple
+    """
+    server_where, local_where = [], []
+    nested = None
+    if not args.raw and not getattr(args, 'explicit_membership_only', True):
+        nested = NESTED_ATTRIBUTES.get(args.subcommand)
+    for expression in args.where or ():
+        if args.cached or parse_where(expression)[0] == nested:
+            local_where.append(expression)
+        else:
+            server_where.append(expression)
+
+    return server_where, local_where
+
+
+def output_columns(args, adq):
+    """The columns of the columnar output formats: the attributes named with
+    --attribute, or else every attribute the sub-command's object class may hold,
+    less those excluded, so attributes first seen late in the results still have
+    a column.  Without the schema, the columns are left to the first results.
+
+    :return: A list of attribute names, or None
+    :rtype: list
+    """
+    if args.attributes:
+        return args.attributes
+    schema = getattr(adq, 'schema', None)
+    if schema is None or args.output_format not in COLUMNAR_FORMATS:
+        return None
+
+    excluded = set(name.lower() for name in adq.exclude_attributes)
+    return sorted(name.lower() for name in
+                  schema.class_attributes(FINDERS[args.subcommand].object_class)
+                  if name.lower() not in excluded)
+
+
+def drop_attributes(objects, attributes):
+    """Remove attributes that were only fetched for matching from each object
+
+    :param iterable objects: ADObjects, or dictionaries for raw exports
+    :param list attributes: Lowercase attribute names to remove
+
+    :return: A generator of the objects
+    :rtype: generator
+    """
+    for ado in objects:
+        for attribute in attributes:
+            if isinstance(ado, dict):
+                ado.pop(attribute, None)
+            elif hasattr(ado, attribute):
+                delattr(ado, attribute)
+        yield ado
+
+
+def output(objects, args, columns=None):
+    """Write objects to stdout.  Objects are written as they are generated, except
+    for sorted yaml output, or when only listing attributes.  columns are the
+    attribute names written by the columnar formats, see output_columns()"""
+    if args.attributes_only:
+        # Attribute names are listed as json for the columnar formats
+        output_format = 'json' if args.output_format in COLUMNAR_FORMATS else args.output_format
+        print(serialize(list(itertools.islice(objects, 1)), output_format=output_format,
+                        attributes_only=True))
+    elif args.output_format == 'yaml':
+        print(serialize(list(objects), output_format=args.output_format))
+    elif args.output_format in BINARY_FORMATS:
+        dump(objects, getattr(sys.stdout, 'buffer', sys.stdout),
+             output_format=args.output_format, columns=columns)
+    else:
+        dump(objects, sys.stdout, output_format=args.output_format, columns=columns)
 
 
 def configure_logging(args):
@@ -104,6 +258,10 @@ def parse_arguments():
     page_size = os.environ['PUDL_PAGE_SIZE'].upper() if 'PUDL_PAGE_SIZE' in os.environ else 300
     tls_no_verify = bool(os.environ['PUDL_TLS_NO_VERIFY'].lower().capitalize()) \
                     if 'PUDL_TLS_NO_VERIFY' in os.environ else False
+    snapshot_file = os.environ['PUDL_SNAPSHOT_FILE'] if 'PUDL_SNAPSHOT_FILE' in os.environ \
+                    else SNAPSHOT_FILE
+    schema_file = os.environ['PUDL_SCHEMA_FILE'] if 'PUDL_SCHEMA_FILE' in os.environ \
+                  else SCHEMA_FILE
 
     parser = argparse.ArgumentParser(prog='pudl',
                                      description='A script for interacting with Active ' + \
@@ -143,16 +301,49 @@ def parse_arguments():
                                "any nested objects return all attributes.  Maybe be used " + \
                                "multiple times, and if not specified, all " + \
                                "attributes are included in top-level objects")
+    parser_common.add_argument('--exclude-attribute', '-x', action='append',
+                               dest='exclude_attributes', metavar='ATTRIBUTE',
+                               help="Attributes to leave out when --attribute is not " + \
+                               "specified, in addition to large binary attributes such " + \
+                               "as thumbnailPhoto and userCertificate, which are always " + \
+                               "left out unless named with --attribute.  May be used " + \
+                               "multiple times.  With --no-schema, they are still " + \
+                               "fetched and then left out of the output")
     parser_common.add_argument('--grep', '-g', action='append', dest='grep',
                                help='Filter results to only those matching the specified ' + \
                                'regular expression (compares against all attributes). ' + \
                                'May be used multiple times')
+    parser_common.add_argument('--where', '-w', action='append', dest='where',
+                               metavar='ATTRIBUTE=VALUE',
+                               help='Only return objects where the attribute compares ' + \
+                               'as specified, such as department=Eng* or title!=*manager*. ' + \
+                               'Operators are =, !=, >= and <=, and * is a wildcard.  ' + \
+                               'Evaluated by the server where possible, so only matching ' + \
+                               'objects are downloaded.  May be used multiple times')
+    parser_common.add_argument('--grep-attribute', '-G', action='append',
+                               dest='attribute_grep', metavar='ATTRIBUTE=REGEX',
+                               help='Filter results to only those with a value of the ' + \
+                               'attribute matching the regular expression, such as ' + \
+                               'department=^eng.  May be used multiple times')
+    parser_common.add_argument('--grep-processes', action='store', dest='grep_processes',
+                               type=int, default=None,
+                               help='Match --grep and --grep-attribute patterns in this ' + \
+                               'many worker processes, for very large result sets')
     parser_common.add_argument('--attributes-only', '-A', action='store_true',
                                dest='attributes_only', help="Only display a list of attributes " + \
                                "that are present for the object type returned by the LDAP query")
+    parser_common.add_argument('--raw', '-r', action='store_true', dest='raw', default=False,
+                               help="Stream search results straight to the output without " + \
+                               "creating objects, for bulk exports.  Group membership " + \
+                               "is not expanded")
     parser_common.add_argument('--output-format', '-f', action='store', dest='output_format',
-                               choices=['json', 'yaml'], default='json',
-                               help="Output format, defaults to json.")
+                               choices=OUTPUT_FORMATS, default='json',
+                               help="Output format, defaults to json.  ndjson (one " + \
+                               "object per line) and yaml-stream (one document per " + \
+                               "object) are written as results arrive, as is json.  " + \
+                               "csv, parquet and arrow have a column per attribute, " + \
+                               "from --attribute or else the AD schema, and " + \
+                               "parquet and arrow require pyarrow")
     parser_common.add_argument('--verbose', '-v', action='store_true', dest='verbose',
                                help='Turn on verbose output', default=False)
     parser_common.add_argument('--debug', '-d', action='store_true', dest='debug', default=False,
@@ -163,6 +354,24 @@ def parse_arguments():
                                "of the server's certificate, defaults to " + \
                                "{0} and may be overridden with ".format(tls_no_verify) + \
                                "PUDL_TLS_NO_VERIFY")
+    parser_common.add_argument('--cached', '-c', action='store_true', dest='cached',
+                               default=False, help="Answer from a local snapshot of the " + \
+                               "directory, first fetching only what has changed since the " + \
+                               "last run.  The first run with --cached downloads all users, " + \
+                               "groups and computers under the base DN")
+    parser_common.add_argument('--snapshot-file', action='store', dest='snapshot_file',
+                               default=snapshot_file, help="The local snapshot used with " + \
+                               "--cached, defaults to {0} and may be ".format(snapshot_file) + \
+                               "overridden with PUDL_SNAPSHOT_FILE")
+    parser_common.add_argument('--schema-file', action='store', dest='schema_file',
+                               default=schema_file, help="The local cache of attribute " + \
+                               "definitions read from the AD schema, defaults to " + \
+                               "{0} and may be overridden with ".format(schema_file) + \
+                               "PUDL_SCHEMA_FILE")
+    parser_common.add_argument('--no-schema', action='store_true', dest='no_schema',
+                               default=False, help="Don't read the AD schema.  Attribute " + \
+                               "names are not checked before searching, and multi-valued " + \
+                               "attributes with a single value are not shown as lists")
     parser_user = subparsers.add_parser('user', parents=[parser_common], conflict_handler='resolve',
                                         help='Pull user objects from AD')
     parser_user.add_argument(nargs="*", dest='samaccountnames',
@@ -173,6 +382,14 @@ def parse_arguments():
                              dest='explicit_membership_only', default=False,
                              help="Only show membership for users that is explicit, " + \
                              "not taking into account group nesting.  Defaults to False")
+    parser_user.add_argument('--membership-strategy', '-m', action='store',
+                             dest='membership_strategy', choices=MEMBERSHIP_STRATEGIES,
+                             default=MEMBERSHIP_STRATEGY,
+                             help="How nested group membership is expanded: chain searches " + \
+                             "once per user, tokengroups reads each user's tokenGroups " + \
+                             "(security groups only), and graph loads all groups up front, " + \
+                             "which is fastest for large numbers of users.  Defaults " + \
+                             "to {0}".format(MEMBERSHIP_STRATEGY))
     parser_group = subparsers.add_parser('group', parents=[parser_common],
                                          conflict_handler='resolve',
                                          help='Pull group objects from AD')
@@ -0,0 +1,76 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_ad_async"""
+#pylint: disable=missing-docstring
+
+import sys
+import threading
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pudl.ad_query import ADQuery, ADQueryPool
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'ad_async requires python 3.5 or newer')
+class AsyncADQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        #pylint: disable=import-error
+        import asyncio
+        from pudl.ad_async import AsyncADQuery
+        self.asyncio = asyncio
+        self.async_class = AsyncADQuery
+
+
+    def test_single_connection_runs_one_call_at_a_time(self):
+        adq = mock.create_autospec(ADQuery, instance=True)
+        running, overlapped = [0], []
+        lock = threading.Lock()
+
+        def search(*args, **kwargs):
+            #pylint: disable=unused-argument
+            with lock:
+                running[0] += 1
+                overlapped.append(running[0] > 1)
+            threading.Event().wait(0.01)
+            with lock:
+                running[0] -= 1
+            return []
+        adq.search.side_effect = search
+
+        loop = self.asyncio.new_event_loop()
+        aq = self.async_class(adq, concurrency=4, loop=loop)
+        try:
+            loop.run_until_complete(self.asyncio.gather(*[aq.search('DC=example,DC=com', '(cn=*)')
+                                                          for _ in range(8)]))
+        finally:
+            aq.close()
+            loop.close()
+        self.assertEqual(aq.concurrency, 1)
+        self.assertEqual(len(overlapped), 8)
+        self.assertFalse(any(overlapped))
+
+
+    def test_pool_keeps_concurrency(self):
+        pool = mock.create_autospec(ADQueryPool, instance=True)
+        aq = self.async_class(pool, concurrency=4)
+        aq.close()
+        self.assertEqual(aq.concurrency, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
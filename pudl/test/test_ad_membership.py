@@ -0,0 +1,217 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_ad_membership"""
+#pylint: disable=missing-docstring
+
+import itertools
+import re
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import ldap
+import ldap.controls
+
+from pudl.ad_membership import GRAPH_FILTER, GraphResolver, GroupGraph, TokenGroupsResolver, \
+    escape_binary, naming_context
+from pudl.ad_query import ADQuery
+from pudl.helper import is_beneath
+
+DOMAIN = 'DC=example,DC=com'
+GROUPS = 'OU=Groups,' + DOMAIN
+G1 = 'CN=G1,' + GROUPS
+G2 = 'CN=G2,' + GROUPS
+G3 = 'CN=G3,' + GROUPS
+G4 = 'CN=G4,' + GROUPS
+OTHER = 'CN=Other,OU=Elsewhere,' + DOMAIN
+U1 = 'CN=User 1,OU=People,' + DOMAIN
+U2 = 'CN=User 2,OU=People,' + DOMAIN
+U3 = 'CN=User 3,OU=People,' + DOMAIN
+
+# G1 > G2 > G3 > G1 is a cycle, and Other, outside of OU=Groups, holds G1.  Member
+# DNs are not always in the case the server returns the group's own DN in.
+MEMBERS = {
+    G1: [U1, G2.lower()],
+    G2: [G3],
+    G3: [G1.upper(), U2],
+    G4: [U3],
+    OTHER: [G1],
+}
+
+# What LDAP_MATCHING_RULE_IN_CHAIN searches beneath OU=Groups return, by hand
+CHAIN = {
+    U1: [G1, G2, G3],
+    U2: [G1, G2, G3],
+    U3: [G4],
+    G1: [G1, G2, G3],
+    G4: [],
+    'CN=Nobody,OU=People,' + DOMAIN: [],
+}
+
+
+class FakeQuery(object):
+    """Answers the group graph's scan of every object with direct members"""
+
+    def __init__(self):
+        self.searches = []
+
+
+    def iter_search(self, base_dn, search_filter, attributes):
+        self.searches.append((base_dn, search_filter, attributes))
+        for distinguished_name in sorted(MEMBERS):
+            if is_beneath(distinguished_name, base_dn):
+                yield distinguished_name, {'member': list(MEMBERS[distinguished_name])}
+
+
+class GroupGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = GroupGraph()
+        self.graph.load(FakeQuery(), DOMAIN)
+
+
+    def test_nested_membership_terminates_on_cycles(self):
+        self.assertEqual(sorted(self.graph.memberof(U1)), sorted([G1, G2, G3, OTHER]))
+        self.assertEqual(sorted(self.graph.memberof(U2.lower())), sorted([G1, G2, G3, OTHER]))
+        # Each group of the cycle is nested beneath itself
+        self.assertEqual(sorted(self.graph.memberof(G2)), sorted([G1, G2, G3, OTHER]))
+
+
+    def test_direct_membership(self):
+        self.assertEqual(self.graph.memberof(U2, nested=False), [G3])
+        self.assertEqual(sorted(self.graph.memberof(G1, nested=False)), sorted([G3, OTHER]))
+        self.assertEqual(self.graph.memberof(U3, nested=False), [G4])
+
+
+    def test_nested_members(self):
+        self.assertEqual(sorted(member.lower() for member in self.graph.members(G2)),
+                         sorted(dn.lower() for dn in [G1, G2, G3, U1, U2]))
+        self.assertEqual(self.graph.members(U1), [])
+
+
+class GraphResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.adq = FakeQuery()
+        self.resolver = GraphResolver(self.adq, GROUPS)
+
+
+    def test_matches_chain_results_beneath_base_dn(self):
+        for distinguished_name, expected in CHAIN.items():
+            self.assertEqual(sorted(self.resolver.memberof(distinguished_name)), expected,
+                             distinguished_name)
+
+
+    def test_memberships_loads_the_naming_context_once(self):
+        self.assertEqual(self.resolver.memberships(list(CHAIN)), CHAIN)
+        self.resolver.memberof(U1)
+        self.assertEqual(self.adq.searches, [(naming_context(GROUPS), GRAPH_FILTER, ['member'])])
+
+
+# Binary SIDs, such as the tokenGroups of a user hold
+SIDS = {G1: b'\x01\x01\x00\x00\x00\x00\x00\x05\x01\x00\x00\x00',
+        G2: b'\x01\x01\x00\x00\x00\x00\x00\x05\x02\x00\x00\x00',
+        G3: b'\x01\x01\x00\x00\x00\x00\x00\x05\x28\x29\x2a\x5c',
+        OTHER: b'\x01\x01\x00\x00\x00\x00\x00\x05\x04\x00\x00\x00'}
+
+# Domain Users, the primary group, is not a group the directory lists
+DOMAIN_USERS = b'\x01\x01\x00\x00\x00\x00\x00\x05\x01\x02\x00\x00'
+
+TOKEN_GROUPS = {U1: [SIDS[G1], SIDS[G3], SIDS[OTHER], DOMAIN_USERS],
+                U2: [SIDS[G2], SIDS[G3], DOMAIN_USERS]}
+
+
+class TokenGroupsConnection(object):
+    """A connection to a fake server, which answers base scope reads of
+    tokenGroups and searches for objectSid values, each with a single page
+    """
+
+    def __init__(self):
+        self.filters = []
+        self.responses = {}
+        self.message_ids = itertools.count(1)
+
+
+    def search_ext(self, base_dn, scope, search_filter, attributes, serverctrls=()):
+        #pylint: disable=unused-argument
+        if scope == ldap.SCOPE_BASE:
+            data = [(base_dn, {'tokenGroups': TOKEN_GROUPS[base_dn]})]
+        else:
+            self.filters.append(search_filter)
+            sids = [bytes(bytearray(int(byte, 16) for byte in value.split('\\')[1:]))
+                    for value in re.findall(r'\(objectSid=([^)]*)\)', search_filter)]
+            data = [(dn, {'objectSid': [sid]}) for dn, sid in sorted(SIDS.items())
+                    if sid in sids and is_beneath(dn, base_dn)]
+        message_id = next(self.message_ids)
+        self.responses[message_id] = (data, [ldap.controls.SimplePagedResultsControl(
+            True, 0, '')])
+
+        return message_id
+
+
+    def result3(self, message_id=ldap.RES_ANY, all=1, timeout=None):
+        #pylint: disable=redefined-builtin,unused-argument
+        if message_id == ldap.RES_ANY:
+            message_id = min(self.responses)
+        data, server_controls = self.responses.pop(message_id)
+
+        return ldap.RES_SEARCH_RESULT, data, message_id, server_controls
+
+
+class TokenGroupsResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = TokenGroupsConnection()
+        with mock.patch('ldap.initialize', return_value=self.connection), \
+             mock.patch('ldap.set_option'), \
+             mock.patch.object(self.connection, 'start_tls_s', create=True), \
+             mock.patch.object(self.connection, 'simple_bind_s', create=True):
+            self.resolver = TokenGroupsResolver(ADQuery('user', 'password'), GROUPS)
+
+
+    def test_escape_binary(self):
+        self.assertEqual(escape_binary(b'\x01\x28\x29\x2a\x5c\xff'), '\\01\\28\\29\\2a\\5c\\ff')
+        self.assertEqual(escape_binary(b''), '')
+
+
+    def test_groups_outside_the_base_dn_are_left_out(self):
+        self.assertEqual(self.resolver.memberof(U1), [G1, G3])
+        self.assertEqual(len(self.connection.filters), 1)
+        self.assertIn('(objectSid={0})'.format(escape_binary(SIDS[G3])),
+                      self.connection.filters[0])
+
+
+    def test_sids_are_resolved_once(self):
+        self.assertEqual(self.resolver.memberof(U1), [G1, G3])
+        # Only G2 is not known yet, SIDs outside the base DN are remembered
+        self.assertEqual(self.resolver.memberof(U2), [G2, G3])
+        self.assertEqual(len(self.connection.filters), 2)
+        self.assertEqual(self.connection.filters[1],
+                         '(|(objectSid={0}))'.format(escape_binary(SIDS[G2])))
+        self.assertEqual(self.resolver.memberships([U1, U2]), {U1: [G1, G3], U2: [G2, G3]})
+        self.assertEqual(len(self.connection.filters), 2)
+
+
+    @mock.patch('pudl.ad_membership.SID_CHUNK_SIZE', 2)
+    def test_unknown_sids_are_resolved_together_in_chunks(self):
+        self.assertEqual(self.resolver.memberships([U1, U2]), {U1: [G1, G3], U2: [G2, G3]})
+        # Five distinct SIDs, in chunks of two
+        self.assertEqual(len(self.connection.filters), 3)
+        self.assertEqual(self.resolver.sids[DOMAIN_USERS], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
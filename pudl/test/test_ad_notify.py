@@ -0,0 +1,98 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_ad_notify"""
+#pylint: disable=missing-docstring,protected-access
+
+import itertools
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pudl.ad_notify import ADChangeCache
+from pudl.ad_query import ADQuery
+
+BASE_DN = 'OU=People,DC=example,DC=com'
+
+
+def _user(distinguished_name, usn, deleted=False):
+    values = {'objectGUID': ['guid-1'], 'objectClass': ['top', 'person', 'user'],
+              'sAMAccountName': ['bhodges'], 'uSNChanged': [str(usn)]}
+    if deleted:
+        values['isDeleted'] = ['TRUE']
+    return distinguished_name, values
+
+
+class ADChangeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.adq = mock.create_autospec(ADQuery, instance=True)
+        self.listener_adq = mock.create_autospec(ADQuery, instance=True)
+        self.cache = ADChangeCache(self.adq, BASE_DN, listener_adq=self.listener_adq)
+
+
+    def test_listener_needs_its_own_connection(self):
+        self.assertRaises(ValueError, ADChangeCache, self.adq, BASE_DN, listener_adq=self.adq)
+
+
+    def test_subscribes_to_the_naming_context(self):
+        def notifications(base_dn, attributes):
+            #pylint: disable=unused-argument
+            self.cache._stop.set()
+            yield None
+        self.listener_adq.iter_notifications.side_effect = notifications
+        self.cache._listen(mock.Mock())
+        self.listener_adq.iter_notifications.assert_called_once_with('DC=example,DC=com', [])
+
+
+    def test_deleted_objects_are_removed(self):
+        self.cache.apply(_user('CN=Bob,' + BASE_DN, 10))
+        self.assertEqual(self.cache.user('bhodges').samaccountname, 'bhodges')
+        self.cache.apply(_user('CN=Bob\\0ADEL:guid-1,CN=Deleted Objects,DC=example,DC=com', 11,
+                               deleted=True))
+        self.assertIsNone(self.cache.user('bhodges'))
+        self.assertEqual(self.cache.users(), [])
+
+
+    def test_objects_moved_out_of_the_base_dn_are_removed(self):
+        self.cache.apply(_user('CN=Bob,' + BASE_DN, 10))
+        self.cache.apply(_user('CN=Bob,OU=Departed,DC=example,DC=com', 11))
+        self.assertIsNone(self.cache.user('bhodges'))
+
+
+    def test_older_changes_are_ignored(self):
+        self.cache.apply(_user('CN=Bob,' + BASE_DN, 10))
+        self.cache.apply(_user('CN=Bob,OU=Departed,DC=example,DC=com', 9))
+        self.assertEqual(self.cache.user('bhodges').samaccountname, 'bhodges')
+
+
+    def test_changes_share_record_classes(self):
+        # Every order of the names, so no two changes hold the same attributes
+        orders = itertools.permutations(['title', 'department', 'mail', 'manager'])
+        for usn, names in enumerate(orders):
+            distinguished_name, values = _user('CN=User {0},{1}'.format(usn, BASE_DN), usn)
+            values['objectGUID'] = ['guid-{0}'.format(usn)]
+            values['sAMAccountName'] = ['user{0}'.format(usn)]
+            for name in names:
+                values[name] = [name]
+            self.cache.apply((distinguished_name, values))
+        users = self.cache.users()
+        self.assertEqual(len(users), 24)
+        self.assertEqual(users[0].title, 'title')
+        self.assertLessEqual(len(set(type(adu) for adu in users)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,291 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_ad_object"""
+#pylint: disable=missing-docstring,protected-access
+
+import gc
+import itertools
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pudl.ad_object import SAMACCOUNTNAME_CACHE, LazyLoader, intern_values, where_filter
+from pudl.ad_user import ADUser
+
+
+class FakeQuery(object):
+    schema = None
+
+
+class RecordLayoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.adu = ADUser(FakeQuery())
+        names = ['attribute{0}'.format(index) for index in range(6)]
+        # Every ordered choice of three names, so no two objects hold the same tuple
+        self.data = [('CN=User {0}'.format(index),
+                      {name: ['{0} of {1}'.format(name, index)] for name in chosen})
+                     for index, chosen in enumerate(itertools.permutations(names, 3))]
+        for dn, attributes in self.data:
+            attributes['sAMAccountName'] = [dn]
+
+
+    def test_varied_attributes_share_record_classes(self):
+        layout = self.adu._record_layout()
+        objects = []
+        for index in range(0, len(self.data), 50):
+            objects += self.adu._objects_factory(self.data[index:index + 50], layout=layout)
+        self.assertEqual(len(objects), len(self.data))
+        self.assertLessEqual(len(set(type(ado) for ado in objects)), len(layout.fields))
+
+        for ado, (dn, attributes) in zip(objects, self.data):
+            self.assertEqual(ado.to_dict(), {name.lower(): values[0]
+                                             for name, values in attributes.items()})
+            self.assertEqual(ado.samaccountname, dn)
+            held = set(name.lower() for name in attributes)
+            for name in layout.fields:
+                self.assertEqual(hasattr(ado, name), name in held)
+
+
+    def test_missing_attributes_can_be_set_and_deleted(self):
+        ado = self.adu._objects_factory(self.data)[-1]
+        missing = [name for name in type(ado)._fields if not hasattr(ado, name)]
+        self.assertTrue(missing)
+        setattr(ado, missing[0], 'set')
+        self.assertEqual(getattr(ado, missing[0]), 'set')
+        ado.title = 'Engineer'
+        self.assertEqual(ado.to_dict()['title'], 'Engineer')
+        del ado.title
+        self.assertFalse(hasattr(ado, 'title'))
+        self.assertRaises(AttributeError, delattr, ado, 'title')
+
+
+class LazyLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.adq = FakeQuery()
+        self.adq.multi_search = mock.Mock()
+        self.loader = LazyLoader(self.adq)
+        data = [('CN=User {0}'.format(index), {'cn': ['User {0}'.format(index)]})
+                for index in range(3)]
+        self.objects = ADUser(self.adq)._objects_factory(data, loader=self.loader)
+
+
+    @staticmethod
+    def _results(searches, scope):
+        #pylint: disable=unused-argument
+        for index, distinguished_name, _, _ in searches:
+            yield index, [(distinguished_name, {'title': ['Title of ' + distinguished_name]})]
+
+
+    def test_attribute_is_loaded_again_after_a_failed_search(self):
+        def fail(searches, scope):
+            #pylint: disable=unused-argument
+            raise IOError('connection lost')
+            yield  #pylint: disable=unreachable
+
+        self.adq.multi_search.side_effect = fail
+        self.assertRaises(IOError, getattr, self.objects[0], 'title')
+        self.assertEqual(self.loader.pages[0][1], set())
+        self.assertEqual(self.loader.loading, set())
+
+        self.adq.multi_search.side_effect = self._results
+        self.assertEqual(self.objects[0].title, 'Title of CN=User 0')
+        self.assertEqual(self.objects[2].title, 'Title of CN=User 2')
+        self.assertEqual(self.adq.multi_search.call_count, 2)
+
+
+    def test_attribute_read_while_loading_is_not_loaded_again(self):
+        def results(searches, scope):
+            for result in self._results(searches, scope):
+                # Read before the searches reach the object, without searching again
+                self.assertRaises(AttributeError, getattr, self.objects[2], 'title')
+                yield result
+
+        self.adq.multi_search.side_effect = results
+        self.assertEqual(self.objects[1].title, 'Title of CN=User 1')
+        self.assertEqual(self.objects[2].title, 'Title of CN=User 2')
+        self.assertEqual(self.adq.multi_search.call_count, 1)
+
+
+    def test_pages_added_later_load_the_attribute_again(self):
+        self.adq.multi_search.side_effect = self._results
+        self.assertEqual(self.objects[0].title, 'Title of CN=User 0')
+        later = ADUser(self.adq)._objects_factory([('CN=User 3', {'cn': ['User 3']})],
+                                                  loader=self.loader)
+        self.assertEqual(later[0].title, 'Title of CN=User 3')
+        self.assertEqual(self.objects[2].title, 'Title of CN=User 2')
+        self.assertEqual([len(call[0][0]) for call in self.adq.multi_search.call_args_list],
+                         [3, 1])
+
+
+    def test_released_objects_are_not_loaded(self):
+        self.adq.multi_search.side_effect = self._results
+        del self.objects[1:]
+        gc.collect()
+        self.assertEqual(self.objects[0].title, 'Title of CN=User 0')
+        self.assertEqual(len(self.adq.multi_search.call_args[0][0]), 1)
+        del self.objects[:]
+        gc.collect()
+        ADUser(self.adq)._objects_factory([('CN=User 3', {'cn': ['User 3']})],
+                                          loader=self.loader)
+        self.assertEqual(len(self.loader.pages), 1)
+
+
+class LazyIterUsersTest(unittest.TestCase):
+
+    def test_every_page_loads_attributes(self):
+        adq = FakeQuery()
+        # One user per page
+        adq.iter_pages = mock.Mock(return_value=iter(
+            [[('CN=u{0}'.format(index), {'sAMAccountName': ['u{0}'.format(index)]})]
+             for index in range(3)]))
+        adq.multi_search = mock.Mock(side_effect=LazyLoaderTest._results)
+        users = ADUser(adq).iter_users('DC=example,DC=com', lazy=True,
+                                       explicit_membership_only=True)
+        titles = [adu.title for adu in users]
+        self.assertEqual(titles, ['Title of CN=u0', 'Title of CN=u1', 'Title of CN=u2'])
+        self.assertEqual(adq.multi_search.call_count, 3)
+
+
+def _string(value):
+    # A new string, rather than the one constant every use of a literal shares
+    return ''.join(list(value))
+
+
+class InternTest(unittest.TestCase):
+
+    def setUp(self):
+        self.adu = ADUser(FakeQuery())
+        self.pages = [[('CN=User {0},OU={1}'.format(index, page),
+                        {'department': [_string('Engineering')],
+                         'memberOf': [_string('CN=Staff,DC=example,DC=com')],
+                         'description': [_string('Engineering')]})
+                       for index in range(2)] for page in range(2)]
+
+
+    def test_values_are_shared_across_pages(self):
+        table = self.adu._intern_table()
+        layout = self.adu._record_layout()
+        users = [adu for page in self.pages
+                 for adu in self.adu._objects_factory(page, table=table, layout=layout)]
+        for adu in users[1:]:
+            self.assertIs(adu.department, users[0].department)
+            self.assertIs(adu.memberof, users[0].memberof)
+            # Not one of INTERN_ATTRIBUTES
+            self.assertIsNot(adu.description, users[0].description)
+        self.assertIsNot(users[0].description, users[0].department)
+
+        memberof = intern_values(table, [_string('CN=Staff,DC=example,DC=com')])
+        self.assertIs(memberof[0], users[0].memberof)
+
+
+    def test_values_are_not_shared_without_a_table(self):
+        users = self.adu._objects_factory(self.pages[0])
+        self.assertIsNot(users[1].department, users[0].department)
+        self.assertEqual(intern_values(None, ['a']), ['a'])
+
+
+    @mock.patch('pudl.ad_object.INTERN_TABLE_SIZE', 2)
+    def test_table_is_bounded(self):
+        table = self.adu._intern_table()
+        first = self.adu._objects_factory(self.pages[0], table=table)
+        self.assertEqual(len(table), 2)
+        second = self.adu._objects_factory(self.pages[1], table=table)
+        self.assertEqual(len(table), 2)
+        # Shared within a page, but the table started over for the second
+        self.assertIs(second[1].department, second[0].department)
+        self.assertIsNot(second[0].department, first[0].department)
+        intern_values(table, ['CN=Other,DC=example,DC=com'])
+        self.assertEqual(table, {'CN=Other,DC=example,DC=com': 'CN=Other,DC=example,DC=com'})
+
+
+class SamAccountNamesTest(unittest.TestCase):
+
+    def setUp(self):
+        SAMACCOUNTNAME_CACHE.clear()
+        self.addCleanup(SAMACCOUNTNAME_CACHE.clear)
+        self.adu = ADUser(self._query('ldap://dc1.example.com:389'))
+
+
+    @staticmethod
+    def _query(ldap_url):
+        def results(searches):
+            for key, base_dn, _, _ in searches:
+                if base_dn == 'DC=example,DC=com':
+                    yield key, [('CN=Bob,OU=People,DC=example,DC=com',
+                                 {'sAMAccountName': ['bhodges']})]
+                else:
+                    yield key, []
+
+        adq = FakeQuery()
+        adq.ldap_url = ldap_url
+        adq.multi_search = mock.Mock(side_effect=results)
+        return adq
+
+
+    @staticmethod
+    def _searches(adq):
+        return sum(len(call[0][0]) for call in adq.multi_search.call_args_list)
+
+
+    def test_found_and_missing_dns_are_cached(self):
+        dns = ['cn=bob,ou=people,dc=example,dc=com', 'CN=Gone,DC=example,DC=com']
+        for _ in range(2):
+            self.assertEqual(self.adu.samaccountnames('DC=example,DC=com', dns),
+                             {'cn=bob,ou=people,dc=example,dc=com': 'bhodges'})
+        self.assertEqual(self._searches(self.adu.adq), 1)
+
+
+    def test_cache_is_scoped_to_the_server_and_base_dn(self):
+        dns = ['CN=Bob,OU=People,DC=example,DC=com']
+        self.assertEqual(self.adu.samaccountnames('DC=example,DC=com', dns),
+                         {dns[0]: 'bhodges'})
+        self.assertEqual(self.adu.samaccountnames('OU=Groups,DC=example,DC=com', dns), {})
+        self.assertEqual(self._searches(self.adu.adq), 2)
+
+        other = ADUser(self._query('ldap://dc1.example.org:389'))
+        self.assertEqual(other.samaccountnames('DC=example,DC=com', dns), {dns[0]: 'bhodges'})
+        self.assertEqual(self._searches(other.adq), 1)
+
+
+class WhereFilterTest(unittest.TestCase):
+
+    def test_comparisons(self):
+        self.assertEqual(where_filter(['department=Eng*', 'title!=*manager*']),
+                         '(department=Eng*)(!(title=*manager*))')
+        self.assertEqual(where_filter(['logonCount>=10', ' badPwdCount <=3']),
+                         '(logoncount>=10)(badpwdcount<=3)')
+        self.assertEqual(where_filter([]), '')
+
+
+    def test_values_are_escaped(self):
+        self.assertEqual(where_filter(['cn=Smith, John (Contractor)*']),
+                         r'(cn=Smith, John \28Contractor\29*)')
+        self.assertEqual(where_filter(['description!=a\\b*']), r'(!(description=a\5cb*))')
+        # Wildcards are only kept for = and !=
+        self.assertEqual(where_filter(['cn>=a*(']), r'(cn>=a\2a\28)')
+        self.assertEqual(where_filter(['title=x=y)(objectClass=*']),
+                         r'(title=x=y\29\28objectClass=*)')
+
+
+    def test_invalid_comparison(self):
+        self.assertRaises(ValueError, where_filter, ['department'])
+        self.assertRaises(ValueError, where_filter, ['=Eng'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_ad_query"""
+#pylint: disable=missing-docstring,protected-access
+
+import itertools
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import ldap
+import ldap.controls
+
+from pudl.ad_query import ADQuery, ADQueryPool, _merge_range
+
+BASE_DN = 'DC=example,DC=com'
+
+# The number of values the fake server returns per read of an attribute
+MAX_VALUES = 1500
+
+
+class FakeConnection(object):
+    """A connection to a fake server holding a few entries, which returns ranges
+    of values for attributes with more than MAX_VALUES values, as AD does.
+    Responses are queued until read, and result3(RES_ANY) returns the oldest,
+    whichever search it belongs to.
+
+    Searches are answered with a single page, unless paged is set, when pages of
+    the size requested are returned, or of server_page_size entries whatever
+    size is requested.  The size and cookie of each paged request are recorded.
+    """
+
+    def __init__(self, entries, paged=False, server_page_size=None):
+        self.entries = entries
+        self.paged = paged
+        self.server_page_size = server_page_size
+        self.requests = []
+        self.responses = {}
+        self.message_ids = itertools.count(1)
+
+
+    def search_ext(self, base_dn, scope, search_filter, attributes, serverctrls=()):
+        #pylint: disable=unused-argument
+        if scope == ldap.SCOPE_BASE:
+            matches = [dn for dn in self.entries if dn == base_dn]
+        else:
+            matches = [dn for dn in sorted(self.entries) if search_filter in dn]
+        sprc = [control for control in serverctrls
+                if isinstance(control, ldap.controls.SimplePagedResultsControl)]
+        cookie = ''
+        if self.paged and sprc:
+            self.requests.append((sprc[0].size, sprc[0].cookie))
+            start = int(sprc[0].cookie or 0)
+            # A page size of 0 releases the search
+            end = start + (sprc[0].size and (self.server_page_size or sprc[0].size))
+            matches = matches[start:end]
+            if sprc[0].size and end < len(self.entries):
+                cookie = str(end)
+        data = [(dn, self._values(self.entries[dn], attributes)) for dn in matches]
+        message_id = next(self.message_ids)
+        self.responses[message_id] = (data, [ldap.controls.SimplePagedResultsControl(
+            True, sprc[0].size if sprc else 0, cookie)])
+
+        return message_id
+
+
+    def result3(self, message_id=ldap.RES_ANY, all=1, timeout=None):
+        #pylint: disable=redefined-builtin,unused-argument
+        if message_id == ldap.RES_ANY:
+            message_id = min(self.responses)
+        data, server_controls = self.responses.pop(message_id)
+
+        return ldap.RES_SEARCH_RESULT, data, message_id, server_controls
+
+
+    def abandon_ext(self, message_id):
+        self.responses.pop(message_id, None)
+
+
+    @staticmethod
+    def _values(attributes, requested):
+        values = {}
+        for name, value in attributes.items():
+            for request in requested:
+                if request.split(';')[0] != name:
+                    continue
+                if ';range=' in request:
+                    start = int(request.split('=')[1].split('-')[0])
+                elif len(value) <= MAX_VALUES:
+                    values[name] = list(value)
+                    continue
+                else:
+                    start = 0
+                end = min(start + MAX_VALUES, len(value))
+                values['{0};range={1}-{2}'.format(name, start, '*' if end == len(value)
+                                                  else end - 1)] = value[start:end]
+
+        return values
+
+
+class ReorderingConnection(FakeConnection):
+    """A fake connection where later searches complete first"""
+
+    def result3(self, message_id=ldap.RES_ANY, all=1, timeout=None):
+        #pylint: disable=redefined-builtin
+        if message_id == ldap.RES_ANY:
+            message_id = max(self.responses)
+        return super(ReorderingConnection, self).result3(message_id, all, timeout)
+
+
+def _members(count, group):
+    return ['CN=Member {0} of {1},{2}'.format(index, group, BASE_DN) for index in range(count)]
+
+
+class ADQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.entries = {
+            'CN=Large,OU=Groups,' + BASE_DN: {'member': _members(2500, 'Large')},
+            'CN=Larger,OU=Groups,' + BASE_DN: {'member': _members(4000, 'Larger')},
+            'CN=Small,OU=Groups,' + BASE_DN: {'member': _members(3, 'Small')},
+        }
+        self._connect(FakeConnection(self.entries))
+
+
+    def _connect(self, connection):
+        self.connection = connection
+        with mock.patch('ldap.initialize', return_value=self.connection), \
+             mock.patch('ldap.set_option'), \
+             mock.patch.object(self.connection, 'start_tls_s', create=True), \
+             mock.patch.object(self.connection, 'simple_bind_s', create=True):
+            self.adq = ADQuery('user', 'password')
+
+
+    def test_merge_range(self):
+        attributes = {'cn': ['Large'], 'member;range=0-1499': ['a', 'b']}
+        remaining = _merge_range('CN=Large', attributes, attributes)
+        self.assertEqual(attributes, {'cn': ['Large'], 'member': ['a', 'b']})
+        self.assertEqual(remaining, [('CN=Large', attributes, 'member', 1500)])
+
+        values = {'member;range=1500-*': ['c']}
+        self.assertEqual(_merge_range('CN=Large', attributes, values), [])
+        self.assertEqual(attributes['member'], ['a', 'b', 'c'])
+
+
+    def test_iter_pages_merges_ranges(self):
+        data = list(self.adq.iter_search(BASE_DN, 'CN=Large,', ['member']))
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0][1], {'member': self.entries[data[0][0]]['member']})
+
+
+    def test_multi_search_merges_ranges_with_searches_in_flight(self):
+        searches = [(name, BASE_DN, 'CN={0},'.format(name), ['member'])
+                    for name in ('Large', 'Larger', 'Small')]
+        results = dict(self.adq.multi_search(searches, max_outstanding=2))
+        self.assertEqual(sorted(results), ['Large', 'Larger', 'Small'])
+        for name, data in results.items():
+            distinguished_name = 'CN={0},OU=Groups,{1}'.format(name, BASE_DN)
+            self.assertEqual(data, [(distinguished_name,
+                                     {'member': self.entries[distinguished_name]['member']})])
+        self.assertEqual(self.connection.responses, {})
+
+
+    def test_multi_search_yields_searches_as_they_complete(self):
+        self._connect(ReorderingConnection(self.entries))
+        searches = [(name, BASE_DN, 'CN={0},'.format(name), ['member'])
+                    for name in ('Large', 'Larger', 'Small')]
+        self.assertEqual([key for key, _ in self.adq.multi_search(searches)],
+                         ['Small', 'Larger', 'Large'])
+
+
+    def test_multi_search_sets_aside_replies_to_other_searches(self):
+        message_id = self.connection.search_ext(BASE_DN, ldap.SCOPE_SUBTREE, 'CN=Small,',
+                                                ['member'])
+        searches = [(name, BASE_DN, 'CN={0},'.format(name), ['member'])
+                    for name in ('Large', 'Larger')]
+        self.assertEqual(sorted(key for key, _ in self.adq.multi_search(searches)),
+                         ['Large', 'Larger'])
+        data = self.adq._result(message_id)[0]
+        self.assertEqual(data, [('CN=Small,OU=Groups,' + BASE_DN,
+                                 {'member': _members(3, 'Small')})])
+        self.assertEqual(self.adq._unclaimed, {})
+        self.assertEqual(self.connection.responses, {})
+
+
+class PagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.entries = {'CN=User {0},OU=People,{1}'.format(index, BASE_DN): {'cn': [str(index)]}
+                        for index in range(5)}
+
+
+    def _adq(self, server_page_size=None):
+        self.connection = FakeConnection(self.entries, True, server_page_size)
+        with mock.patch('ldap.initialize', return_value=self.connection), \
+             mock.patch('ldap.set_option'), \
+             mock.patch.object(self.connection, 'start_tls_s', create=True), \
+             mock.patch.object(self.connection, 'simple_bind_s', create=True):
+            return ADQuery('user', 'password', page_size=2)
+
+
+    def test_last_page_asks_for_only_the_results_still_wanted(self):
+        adq = self._adq()
+        pages = list(adq.iter_pages(BASE_DN, 'OU=People', ['cn'], limit=3))
+        self.assertEqual([len(page) for page in pages], [2, 1])
+        # The search stopped with results left, so its paging state is released
+        self.assertEqual(self.connection.requests, [(2, ''), (1, '2'), (0, '3')])
+        self.assertEqual(self.connection.responses, {})
+
+
+    def test_limit_reached_in_the_middle_of_a_page(self):
+        # A server returning pages of 2, whatever size is asked for
+        adq = self._adq(2)
+        results = list(adq.iter_search(BASE_DN, 'OU=People', ['cn'], limit=3))
+        self.assertEqual([values['cn'] for _, values in results], [['0'], ['1'], ['2']])
+        self.assertEqual(self.connection.requests, [(2, ''), (1, '2'), (0, '4')])
+
+
+    def test_paging_state_is_released_when_the_caller_stops_early(self):
+        adq = self._adq()
+        pages = adq.iter_pages(BASE_DN, 'OU=People', ['cn'])
+        self.assertEqual(len(next(pages)), 2)
+        pages.close()
+        self.assertEqual(self.connection.requests, [(2, ''), (0, '2')])
+        self.assertEqual(self.connection.responses, {})
+
+
+    def test_complete_searches_are_not_released(self):
+        adq = self._adq()
+        self.assertEqual(len(adq.search(BASE_DN, 'OU=People', ['cn'])), 5)
+        self.assertEqual(self.connection.requests, [(2, ''), (2, '2'), (2, '4')])
+        self.assertEqual(len(list(adq.iter_search(BASE_DN, 'OU=People', ['cn'], limit=5))), 5)
+        self.assertEqual(self.connection.requests[3:], [(2, ''), (2, '2'), (1, '4')])
+
+
+class ADQueryPoolTest(unittest.TestCase):
+
+    def _pool(self, size):
+        entries = {'CN=Small,OU=Groups,' + BASE_DN: {'member': _members(3, 'Small')}}
+        with mock.patch('ldap.initialize', side_effect=lambda url: FakeConnection(entries)), \
+             mock.patch('ldap.set_option'), \
+             mock.patch.object(FakeConnection, 'start_tls_s', create=True), \
+             mock.patch.object(FakeConnection, 'simple_bind_s', create=True):
+            return ADQueryPool('user', 'password', size=size)
+
+
+    def test_generator_connection_is_not_reused_while_others_are_idle(self):
+        pool = self._pool(2)
+        pages = pool.iter_pages(BASE_DN, 'CN=Small,', ['member'])
+        next(pages)
+        held = pool._held[list(pool._held)[0]][0]
+        adq = pool.checkout()
+        self.assertIsNot(adq, held)
+        pool.checkin(adq)
+        pages.close()
+        self.assertEqual(pool._idle.qsize(), 2)
+        self.assertEqual(pool._held, {})
+
+
+    def test_nested_checkout_shares_when_none_are_idle(self):
+        pool = self._pool(1)
+        outer = pool.checkout()
+        inner = pool.checkout(timeout=0)
+        self.assertIs(inner, outer)
+        pool.checkin(inner)
+        self.assertEqual(pool._idle.qsize(), 0)
+        pool.checkin(outer)
+        self.assertEqual(pool._idle.qsize(), 1)
+        self.assertRaises(ValueError, pool.checkin, outer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_ad_schema"""
+#pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pudl.ad_object import flatten
+from pudl.ad_schema import ATTRIBUTE_SCHEMA_FILTER, DN_SYNTAX, ADSchema
+from pudl.ad_user import ADUser
+
+SCHEMA_DN = 'CN=Schema,CN=Configuration,DC=example,DC=com'
+
+# lDAPDisplayName, isSingleValued, attributeSyntax and systemFlags of each attribute
+ATTRIBUTES = [('sAMAccountName', 'TRUE', '2.5.5.12', '0'),
+              ('title', 'TRUE', '2.5.5.12', '0'),
+              ('manager', 'TRUE', DN_SYNTAX, '0'),
+              ('memberOf', 'FALSE', DN_SYNTAX, '0'),
+              ('proxyAddresses', 'FALSE', '2.5.5.12', '0'),
+              ('tokenGroups', 'FALSE', '2.5.5.17', '4')]
+
+
+class FakeQuery(object):
+    """Answers the searches ADSchema reads the schema with"""
+
+    def __init__(self):
+        self.schema = None
+        self.searches = 0
+
+
+    def search(self, base_dn, search_filter, attributes, scope):
+        #pylint: disable=unused-argument
+        return [('', {'schemaNamingContext': [SCHEMA_DN]})]
+
+
+    def iter_search(self, base_dn, search_filter, attributes, scope):
+        #pylint: disable=unused-argument
+        self.searches += 1
+        if search_filter == ATTRIBUTE_SCHEMA_FILTER:
+            for name, single_valued, syntax, flags in ATTRIBUTES:
+                yield ('CN={0},{1}'.format(name, base_dn),
+                       {'lDAPDisplayName': [name], 'isSingleValued': [single_valued],
+                        'attributeSyntax': [syntax], 'systemFlags': [flags]})
+        else:
+            yield ('CN=User,' + base_dn,
+                   {'lDAPDisplayName': ['user'], 'subClassOf': ['top'],
+                    'mayContain': [name for name, _, _, _ in ATTRIBUTES]})
+
+
+class ADSchemaTest(unittest.TestCase):
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.adq = FakeQuery()
+        self.schema = ADSchema(self.adq, path=os.path.join(path, 'schema.json')).load()
+
+
+    def test_single_valued(self):
+        self.assertEqual(self.schema.single_valued(('TITLE', 'memberOf', 'tokenGroups',
+                                                    'manager;range=0-1', 'unknown')),
+                         (True, False, False, True, None))
+
+
+    def test_validate(self):
+        self.schema.validate(['title', 'MemberOf', 'memberOf;range=0-1499', '*', '1.1'])
+        self.assertRaises(ValueError, self.schema.validate, ['title', 'titel'])
+
+
+    def test_class_attributes_leave_out_constructed_attributes(self):
+        self.assertEqual(self.schema.class_attributes('User'),
+                         ['manager', 'memberOf', 'proxyAddresses', 'sAMAccountName', 'title'])
+        self.assertEqual(self.schema.class_attributes('computer'), [])
+
+
+    def test_definitions_are_cached(self):
+        self.assertEqual(self.adq.searches, 2)
+        schema = ADSchema(self.adq, path=self.schema.path).load()
+        self.assertEqual(self.adq.searches, 2)
+        self.assertEqual(schema.definitions, self.schema.definitions)
+
+
+    def test_values_are_typed_by_definition(self):
+        attributes = {'title': ['Engineer'], 'memberOf': ['CN=Staff,DC=example,DC=com'],
+                      'proxyAddresses': ['smtp:a@example.com', 'smtp:b@example.com'],
+                      'description': ['Undefined'], 'info': ['a', 'b']}
+        self.assertEqual(flatten(attributes, self.schema),
+                         {'title': 'Engineer', 'memberof': ['CN=Staff,DC=example,DC=com'],
+                          'proxyaddresses': ['smtp:a@example.com', 'smtp:b@example.com'],
+                          'description': 'Undefined', 'info': ['a', 'b']})
+        # Without a schema, every single value is unwrapped
+        self.assertEqual(flatten(attributes)['memberof'], 'CN=Staff,DC=example,DC=com')
+
+
+    def test_objects_are_typed_by_definition(self):
+        self.adq.schema = self.schema
+        users = ADUser(self.adq)._objects_factory([  #pylint: disable=protected-access
+            ('CN=Bob,DC=example,DC=com',
+             {'sAMAccountName': ['bob'], 'memberOf': ['CN=Staff,DC=example,DC=com']}),
+            ('CN=Ann,DC=example,DC=com',
+             {'sAMAccountName': ['ann'], 'title': ['Engineer'],
+              'memberOf': ['CN=Staff,DC=example,DC=com', 'CN=Leads,DC=example,DC=com']})])
+        self.assertEqual([adu.samaccountname for adu in users], ['bob', 'ann'])
+        self.assertEqual(users[0].memberof, ['CN=Staff,DC=example,DC=com'])
+        self.assertEqual(users[1].memberof, ['CN=Staff,DC=example,DC=com',
+                                             'CN=Leads,DC=example,DC=com'])
+        self.assertEqual(users[1].title, 'Engineer')
+
+
+if __name__ == '__main__':
+    unittest.main()
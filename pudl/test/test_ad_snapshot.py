@@ -0,0 +1,162 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_ad_snapshot"""
+#pylint: disable=missing-docstring
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from pudl.ad_computer import COMPUTER_FILTER
+from pudl.ad_group import GROUP_FILTER
+from pudl.ad_snapshot import ADSnapshot
+from pudl.ad_user import USER_FILTER
+from pudl.helper import is_beneath
+
+DOMAIN = 'DC=example,DC=com'
+BASE_DN = 'OU=Departments,' + DOMAIN
+PEOPLE = 'OU=People,' + BASE_DN
+GROUPS = 'OU=Groups,' + BASE_DN
+
+
+class FakeDirectory(object):
+    """A directory of users and groups, searched the way ADSnapshot searches it.
+    Every change is given the next uSNChanged, as a domain controller does.
+    """
+
+    schema = None
+    exclude_attributes = ()
+
+    def __init__(self, server='CN=DC1'):
+        self.server = server
+        self.usn = 100
+        # DN to the object type and its attributes
+        self.objects = {}
+        self.filters = []
+
+
+    def put(self, object_type, distinguished_name, **values):
+        self.usn += 1
+        guid = values.pop('guid', None)
+        for dn, (_, attributes) in list(self.objects.items()):
+            if attributes['objectGUID'][0] == guid:
+                del self.objects[dn]
+        attributes = {'objectGUID': [guid], 'uSNChanged': [str(self.usn)]}
+        attributes.update(values)
+        self.objects[distinguished_name] = (object_type, attributes)
+
+
+    def search(self, base_dn, search_filter, attributes, scope):
+        #pylint: disable=unused-argument
+        return [('', {'dsServiceName': [self.server],
+                      'highestCommittedUSN': [str(self.usn)]})]
+
+
+    def iter_pages(self, base_dn, search_filter, attributes):
+        #pylint: disable=unused-argument
+        self.filters.append(search_filter)
+        object_type = [object_type for object_type, template in
+                       (('user', USER_FILTER), ('group', GROUP_FILTER),
+                        ('computer', COMPUTER_FILTER))
+                       if search_filter.startswith(template.split('{0}')[0])][0]
+        yield [(dn, dict(values)) for dn, values in self._changed(base_dn, search_filter)
+               if self.objects[dn][0] == object_type and 'isDeleted' not in values]
+
+
+    def iter_search(self, base_dn, search_filter, attributes, serverctrls):
+        #pylint: disable=unused-argument
+        self.filters.append(search_filter)
+        for distinguished_name, values in self._changed(base_dn, search_filter):
+            yield distinguished_name, {key: value for key, value in values.items()
+                                       if key in ('objectGUID', 'isDeleted')}
+
+
+    def _changed(self, base_dn, search_filter):
+        match = re.search(r'uSNChanged>=(\d+)', search_filter)
+        usn = int(match.group(1)) if match else 0
+        return [(dn, values) for dn, (_, values) in sorted(self.objects.items())
+                if is_beneath(dn, base_dn) and int(values['uSNChanged'][0]) >= usn]
+
+
+class ADSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = FakeDirectory()
+        self.directory.put('user', 'CN=Bob,' + PEOPLE, guid=b'bob', sAMAccountName=['bob'],
+                           title=['Engineer'], memberOf=['CN=Staff,' + GROUPS])
+        self.directory.put('user', 'CN=Ann,' + PEOPLE, guid=b'ann', sAMAccountName=['ann'])
+        self.directory.put('group', 'CN=Staff,' + GROUPS, guid=b'staff',
+                           sAMAccountName=['staff'], member=['CN=Bob,' + PEOPLE])
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.snapshot = ADSnapshot(self.directory, path=os.path.join(path, 'snapshot.db'))
+        self.addCleanup(self.snapshot.close)
+        self.snapshot.refresh(BASE_DN)
+
+
+    def _titles(self):
+        return {adu.samaccountname: getattr(adu, 'title', None)
+                for adu in self.snapshot.users(BASE_DN)}
+
+
+    def test_refresh_only_fetches_changes(self):
+        usn = self.directory.usn
+        self.directory.put('user', 'CN=Bob,' + PEOPLE, guid=b'bob', sAMAccountName=['bob'],
+                           title=['Manager'])
+        self.directory.put('user', 'CN=Cy,' + PEOPLE, guid=b'cy', sAMAccountName=['cy'])
+        self.directory.filters = []
+        self.snapshot.refresh(BASE_DN)
+        self.assertEqual(self._titles(), {'ann': None, 'bob': 'Manager', 'cy': None})
+        self.assertEqual(self.directory.filters,
+                         [USER_FILTER.format('(uSNChanged>={0})'.format(usn + 1)),
+                          GROUP_FILTER.format('(uSNChanged>={0})'.format(usn + 1)),
+                          COMPUTER_FILTER.format('(uSNChanged>={0})'.format(usn + 1)),
+                          '(uSNChanged>={0})'.format(usn + 1)])
+
+
+    def test_deleted_and_moved_objects_are_removed(self):
+        self.directory.put('user', 'CN=Bob\\0ADEL:bob,CN=Deleted Objects,' + DOMAIN, guid=b'bob',
+                           isDeleted=['TRUE'])
+        self.directory.put('user', 'CN=Ann,OU=Departed,' + DOMAIN, guid=b'ann',
+                           sAMAccountName=['ann'])
+        self.snapshot.refresh(BASE_DN)
+        self.assertEqual(self._titles(), {})
+        self.assertEqual([adg.samaccountname for adg in self.snapshot.groups(BASE_DN)],
+                         ['staff'])
+
+
+    def test_another_server_takes_a_full_snapshot(self):
+        directory = FakeDirectory(server='CN=DC2')
+        directory.put('user', 'CN=Ann,' + PEOPLE, guid=b'ann', sAMAccountName=['ann'])
+        self.snapshot.adq = directory
+        self.snapshot.refresh(BASE_DN)
+        self.assertEqual(self._titles(), {'ann': None})
+        self.assertEqual(directory.filters, [USER_FILTER.format(''), GROUP_FILTER.format(''),
+                                             COMPUTER_FILTER.format('')])
+
+
+    def test_memberof_follows_group_changes(self):
+        self.directory.put('group', 'CN=Staff,' + GROUPS, guid=b'staff',
+                           sAMAccountName=['staff'], member=['CN=Ann,' + PEOPLE])
+        self.snapshot.refresh(BASE_DN)
+        memberof = {adu.samaccountname: getattr(adu, 'memberof', None)
+                    for adu in self.snapshot.users(BASE_DN)}
+        # Bob's stored memberOf still names the group, it is a back-link
+        self.assertEqual(memberof, {'ann': ['CN=Staff,' + GROUPS], 'bob': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_cache"""
+#pylint: disable=missing-docstring
+
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pudl.cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = TTLCache()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+
+    def test_least_recently_used_are_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Reading a makes b the least recently used
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+
+    @mock.patch('time.time')
+    def test_entries_expire(self, time):
+        cache = TTLCache(ttl=10)
+        time.return_value = 1000
+        cache.set('a', 1)
+        time.return_value = 1010
+        self.assertEqual(cache.get('a'), 1)
+        time.return_value = 1011
+        self.assertEqual(cache.get('a', 'expired'), 'expired')
+        self.assertEqual(len(cache), 0)
+        # Setting again restarts the time to live
+        cache.set('a', 2)
+        time.return_value = 1020
+        self.assertEqual(cache.get('a'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
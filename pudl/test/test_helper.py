@@ -0,0 +1,150 @@
+# Copyright (C) 2015 zulily, llc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""test_helper"""
+#pylint: disable=missing-docstring
+
+import csv
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pudl import helper
+from pudl.helper import ObjectFilter, StringIO, dump, guid_string, iter_filter, sid_string
+
+# S-1-5-21-1004336348-1177238915-682003330-512, as AD stores it
+SID = (b'\x01\x05\x00\x00\x00\x00\x00\x05\x15\x00\x00\x00\xdc\xf4\xdc\x3b'
+       b'\x83\x3d\x2b\x46\x82\x8b\xa6\x28\x00\x02\x00\x00')
+
+# 8e5f0b4d-3a7c-4c1e-9f0a-2b6d1c3e4f50, the first three fields little-endian
+GUID = b'\x4d\x0b\x5f\x8e\x7c\x3a\x1e\x4c\x9f\x0a\x2b\x6d\x1c\x3e\x4f\x50'
+
+
+class StringFormTest(unittest.TestCase):
+
+    def test_sid_string(self):
+        self.assertEqual(sid_string(SID), 'S-1-5-21-1004336348-1177238915-682003330-512')
+        # Well known SIDs, such as S-1-5-32-544 for Administrators
+        self.assertEqual(sid_string(b'\x01\x02\x00\x00\x00\x00\x00\x05'
+                                    b'\x20\x00\x00\x00\x20\x02\x00\x00'), 'S-1-5-32-544')
+        self.assertEqual(sid_string(b'\x01\x00\x00\x00\x00\x00\x00\x00'), 'S-1-0')
+        self.assertEqual(sid_string([SID, SID]),
+                         ['S-1-5-21-1004336348-1177238915-682003330-512'] * 2)
+
+
+    def test_sid_string_leaves_other_values(self):
+        self.assertEqual(sid_string(u'S-1-5-32-544'), u'S-1-5-32-544')
+        self.assertEqual(sid_string(SID[:-1]), SID[:-1])
+        self.assertEqual(sid_string(b'\x01'), b'\x01')
+
+
+    def test_guid_string(self):
+        self.assertEqual(guid_string(GUID), '8e5f0b4d-3a7c-4c1e-9f0a-2b6d1c3e4f50')
+        self.assertEqual(guid_string([GUID]), ['8e5f0b4d-3a7c-4c1e-9f0a-2b6d1c3e4f50'])
+        self.assertEqual(guid_string(u'8e5f0b4d-3a7c-4c1e-9f0a-2b6d1c3e4f50'),
+                         u'8e5f0b4d-3a7c-4c1e-9f0a-2b6d1c3e4f50')
+        self.assertEqual(guid_string(GUID[:15]), GUID[:15])
+
+
+class ObjectFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.objects = [
+            {'samaccountname': 'jdoe', 'title': 'Engineering Manager', 'logoncount': '12',
+             'memberof': ['CN=Staff,DC=example,DC=com', 'CN=Managers,DC=example,DC=com']},
+            {'samaccountname': 'asmith', 'title': 'Engineer', 'logoncount': '3',
+             'memberof': ['CN=Staff,DC=example,DC=com'], 'objectsid': b'\x01\x05'},
+            {'samaccountname': 'bjones', 'department': 'Eng (Tools)', 'logoncount': 'never'},
+        ]
+
+
+    def _matches(self, grep=(), attribute_grep=(), where=()):
+        matcher = ObjectFilter(grep, attribute_grep, where)
+        return [values['samaccountname'] for values in self.objects if matcher(values)]
+
+
+    def test_grep_matches_any_value_case_insensitively(self):
+        self.assertEqual(self._matches(['ENGINEER']), ['jdoe', 'asmith'])
+        self.assertEqual(self._matches(['managers,dc=']), ['jdoe'])
+        # Every pattern must match, and may span values
+        self.assertEqual(self._matches(['engineer', 'staff']), ['jdoe', 'asmith'])
+        self.assertEqual(self._matches(['Eng (Tools)']), [])
+        self.assertEqual(self._matches([r'Eng \(Tools\)']), ['bjones'])
+
+
+    def test_attribute_grep_matches_a_value_of_the_attribute(self):
+        self.assertEqual(self._matches(attribute_grep=['memberOf=cn=managers']), ['jdoe'])
+        self.assertEqual(self._matches(attribute_grep=['title=^engineer$']), ['asmith'])
+        self.assertEqual(self._matches(attribute_grep=['department=.']), ['bjones'])
+        self.assertRaises(ValueError, ObjectFilter, (), ['title'])
+        self.assertRaises(ValueError, ObjectFilter, (), ['=engineer'])
+
+
+    def test_where_comparisons(self):
+        self.assertEqual(self._matches(where=['title=eng*']), ['jdoe', 'asmith'])
+        self.assertEqual(self._matches(where=['title!=*manager']), ['asmith', 'bjones'])
+        self.assertEqual(self._matches(where=['memberof=CN=Managers,*']), ['jdoe'])
+        # Numeric values compare as integers, others as strings
+        self.assertEqual(self._matches(where=['logoncount>=10']), ['jdoe', 'bjones'])
+        self.assertEqual(self._matches(where=['logoncount<=3']), ['asmith'])
+        self.assertEqual(self._matches(where=['title=eng*'], grep=['staff']),
+                         ['jdoe', 'asmith'])
+
+
+    def test_iter_filter_passes_everything_without_patterns(self):
+        self.assertEqual(list(iter_filter(self.objects, [])), self.objects)
+        self.assertEqual(list(iter_filter(self.objects, ['jones'])), self.objects[2:])
+
+
+class DumpColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        # title is only held by objects after the first batch
+        self.objects = [{'cn': 'User {0}'.format(index)} for index in range(helper.BATCH_SIZE)]
+        self.objects.append({'cn': 'Late', 'title': 'Engineer', 'mail': 'late@example.com'})
+
+
+    def _rows(self, columns):
+        stream = StringIO()
+        with mock.patch('logging.warning') as warning:
+            dump(self.objects, stream, output_format='csv', columns=columns)
+        stream.seek(0)
+        return list(csv.reader(stream)), warning
+
+
+    def test_columns_include_attributes_first_seen_late(self):
+        rows, warning = self._rows(['cn', 'mail', 'title'])
+        self.assertEqual(rows[0], ['cn', 'mail', 'title'])
+        self.assertEqual(rows[-1], ['Late', 'late@example.com', 'Engineer'])
+        self.assertFalse(warning.called)
+
+
+    def test_attributes_without_a_column_are_named_in_the_warning(self):
+        rows, warning = self._rows(['cn', 'title'])
+        self.assertEqual(rows[-1], ['Late', 'Engineer'])
+        self.assertEqual(warning.call_args[0][0],
+                         'Attributes not among the columns are not written: %s')
+        self.assertEqual(warning.call_args[0][1:], ('mail',))
+
+
+    def test_columns_default_to_the_first_batch(self):
+        rows, warning = self._rows(None)
+        self.assertEqual(rows[0], ['cn'])
+        self.assertIn('first', warning.call_args[0][0])
+        self.assertEqual(warning.call_args[0][2], 'mail, title')
+
+
+if __name__ == '__main__':
+    unittest.main()
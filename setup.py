@@ -36,6 +36,9 @@ setup(name='pudl',
           'python-ldap',
           'pyyaml'
       ],
+      extras_require={
+          'arrow': ['pyarrow']
+      },
       classifiers=[
           'Development Status :: 4 - Beta',
           'Environment :: Console',